@@ -0,0 +1,261 @@
+"""Benchmarks of the music commands, run offline against a fake Lavalink node.
+
+    python -m benchmarks --iterations 200 --latency-ms 5 --output results.json
+    python -m benchmarks --baseline results.json --max-regression 0.2
+
+The command callbacks are called directly with a fake context, so the times cover
+the command itself, lavalink_rs and the REST round trips to the fake node, but not
+Discord. Allocations are measured with tracemalloc in a second pass, so they only
+count Python objects, not the memory lavalink_rs allocates in Rust.
+"""
+
+from __future__ import annotations
+import argparse
+import asyncio
+import dataclasses
+import json
+import logging
+import random
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+import typing as t
+
+import lightbulb
+
+from benchmarks.fake_lavalink import FakeLavalink
+from benchmarks.harness import Harness, configure, percentiles
+
+
+@dataclasses.dataclass
+class Scenario:
+    name: str
+    command: lightbulb.CommandLike
+    guild_id: int
+    # the options of the iteration, the queue length is passed to pick valid indexes
+    options: t.Callable[[int, int], t.Dict[str, t.Any]]
+    # the least tracks the queue needs before each iteration, refilled untimed
+    min_queue: int = 0
+
+
+@dataclasses.dataclass
+class Result:
+    name: str
+    iterations: int
+    p50_ms: float
+    p95_ms: float
+    p99_ms: float
+    alloc_kib: float
+    retained_kib: float
+
+
+def scenarios() -> t.List[Scenario]:
+    from plugins import music_advanced, music_basic
+
+    return [
+        Scenario(
+            "play (track)",
+            music_basic.play,
+            101,
+            lambda i, n: {"query": f"https://example.com/track/{i}"},
+        ),
+        Scenario(
+            "play (cached)",
+            music_basic.play,
+            102,
+            lambda i, n: {"query": "https://example.com/track/cached"},
+        ),
+        Scenario(
+            "play (search)",
+            music_basic.play,
+            103,
+            lambda i, n: {"query": f"song {i}"},
+        ),
+        Scenario(
+            "queue",
+            music_advanced.queue,
+            104,
+            # the pages past the end of the queue show the last one
+            lambda i, n: {"page": i % 10 + 1},
+            min_queue=2,
+        ),
+        Scenario(
+            "swap",
+            music_advanced.swap,
+            105,
+            lambda i, n: dict(
+                zip(["index1", "index2"], random.sample(range(1, n + 1), 2))
+            ),
+            min_queue=2,
+        ),
+        Scenario("skip", music_basic.skip, 106, lambda i, n: {}, min_queue=2),
+    ]
+
+
+async def run(
+    harness: Harness, scenario: Scenario, iterations: int, warmup: int
+) -> Result:
+    latencies = []
+    allocated = []
+    retained = []
+
+    for i in range(warmup + iterations):
+        count = await harness.fill_queue(scenario.guild_id, scenario.min_queue)
+        ctx = harness.context(scenario.guild_id, scenario.options(i, count))
+
+        start = time.perf_counter()
+        await scenario.command.callback(ctx)
+        elapsed = time.perf_counter() - start
+
+        if i >= warmup:
+            latencies.append(elapsed * 1000)
+
+        await asyncio.sleep(harness.settle)
+
+    tracemalloc.start()
+
+    try:
+        for i in range(iterations):
+            count = await harness.fill_queue(scenario.guild_id, scenario.min_queue)
+            ctx = harness.context(
+                scenario.guild_id, scenario.options(warmup + iterations + i, count)
+            )
+
+            tracemalloc.reset_peak()
+            before = tracemalloc.get_traced_memory()[0]
+            await scenario.command.callback(ctx)
+            current, peak = tracemalloc.get_traced_memory()
+
+            allocated.append((peak - before) / 1024)
+            retained.append((current - before) / 1024)
+
+            await asyncio.sleep(harness.settle)
+    finally:
+        tracemalloc.stop()
+
+    p50, p95, p99 = percentiles(latencies)
+
+    return Result(
+        scenario.name,
+        iterations,
+        p50,
+        p95,
+        p99,
+        statistics.median(allocated),
+        statistics.mean(retained),
+    )
+
+
+def print_results(results: t.List[Result]) -> None:
+    print(
+        f"{'command':<16}{'n':>6}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}"
+        f"{'alloc KiB':>12}{'retained KiB':>14}"
+    )
+
+    for r in results:
+        print(
+            f"{r.name:<16}{r.iterations:>6}{r.p50_ms:>10.3f}{r.p95_ms:>10.3f}"
+            f"{r.p99_ms:>10.3f}{r.alloc_kib:>12.1f}{r.retained_kib:>14.1f}"
+        )
+
+
+def regressions(
+    results: t.List[Result], baseline: t.Dict[str, t.Any], max_regression: float
+) -> t.List[str]:
+    """Return the commands whose p95 is more than `max_regression` slower than the baseline."""
+    previous = {i["name"]: i for i in baseline["results"]}
+    slower = []
+
+    for r in results:
+        old = previous.get(r.name)
+
+        if old and r.p95_ms > old["p95_ms"] * (1 + max_regression):
+            slower.append(f"{r.name}: p95 {old['p95_ms']:.3f}ms -> {r.p95_ms:.3f}ms")
+
+    return slower
+
+
+async def main(args: argparse.Namespace) -> int:
+    random.seed(args.seed)
+    lavalink = FakeLavalink(args.latency_ms / 1000, args.playlist_size)
+    await lavalink.start()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        configure(lavalink, tmp, MAX_QUEUE_LENGTH=str(10 * args.playlist_size))
+
+        harness = Harness(lavalink, args.latency_ms / 1000 * 2 + 0.002)
+        await harness.start()
+        results = []
+
+        try:
+            for scenario in scenarios():
+                if args.only and scenario.name.split()[0] not in args.only:
+                    continue
+
+                results.append(
+                    await run(harness, scenario, args.iterations, args.warmup)
+                )
+        finally:
+            await harness.stop()
+            await lavalink.close()
+
+    print_results(results)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(
+                {
+                    "latency_ms": args.latency_ms,
+                    "python": sys.version.split()[0],
+                    "results": [dataclasses.asdict(i) for i in results],
+                },
+                f,
+                indent=2,
+            )
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            slower = regressions(results, json.load(f), args.max_regression)
+
+        for i in slower:
+            print(f"REGRESSION {i}", file=sys.stderr)
+
+        if slower:
+            return 1
+
+    return 0
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        prog="python -m benchmarks", description="Benchmark the music commands offline."
+    )
+    parser.add_argument("--iterations", type=int, default=200)
+    parser.add_argument("--warmup", type=int, default=20)
+    parser.add_argument(
+        "--latency-ms", type=float, default=0, help="REST latency of the fake node"
+    )
+    parser.add_argument(
+        "--playlist-size", type=int, default=100, help="tracks used to fill the queues"
+    )
+    parser.add_argument(
+        "--only", nargs="*", help="commands to run: play, queue, swap, skip"
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--baseline", help="JSON results to compare the p95 with")
+    parser.add_argument(
+        "--max-regression",
+        type=float,
+        default=0.2,
+        help="fail if a p95 is this fraction slower than the baseline",
+    )
+
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.WARNING)
+    sys.exit(asyncio.run(main(parse_args())))
@@ -0,0 +1,393 @@
+"""Memory kept by hikari's cache with every gateway profile, run offline.
+
+    python -m benchmarks.cache_profiles --guilds 100 --members 2000 --output cache.json
+
+For every profile, a GatewayBot with its intents and cache settings receives the
+events Discord would send it for `--guilds` guilds: GUILD_CREATE, and with the
+GUILD_MEMBERS intent the member chunks of every guild, and with the message
+intents `--messages` messages per guild. Every profile runs in a new process, so
+the resident memory of one doesn't leak into the next.
+"""
+
+from __future__ import annotations
+import argparse
+import asyncio
+import concurrent.futures
+import dataclasses
+import gc
+import itertools
+import json
+import logging
+import multiprocessing
+import sys
+import tracemalloc
+import typing as t
+
+import hikari
+
+from benchmarks.scale import rss_bytes
+from gateway_profile import PROFILES, gateway_settings
+
+BOT_ID = 1
+# the member chunks Discord sends have at most this many members
+CHUNK_SIZE = 1000
+
+
+@dataclasses.dataclass
+class Profile:
+    name: str
+    prefix_commands: bool
+    intents: str
+    cached_members: int
+    cached_messages: int
+    cached_voice_states: int
+    retained_mib: float
+    rss_mib: float
+
+
+class FakeShard:
+    """The only parts of a shard the event manager uses when a guild is created."""
+
+    id = 0
+
+    def get_user_id(self) -> hikari.Snowflake:
+        return hikari.Snowflake(BOT_ID)
+
+    async def request_guild_members(self, *args: t.Any, **kwargs: t.Any) -> None:
+        # the chunks are sent by `receive_guild` instead
+        pass
+
+
+def user(user_id: int) -> t.Dict[str, t.Any]:
+    return {
+        "id": str(user_id),
+        "username": f"user{user_id}",
+        "discriminator": "0",
+        "global_name": f"User {user_id}",
+        "avatar": "a" * 32,
+        "bot": user_id == BOT_ID,
+    }
+
+
+def member(user_id: int, roles: t.List[str]) -> t.Dict[str, t.Any]:
+    return {
+        "user": user(user_id),
+        "nick": None,
+        "roles": roles,
+        "joined_at": "2024-01-01T00:00:00+00:00",
+        "deaf": False,
+        "mute": False,
+    }
+
+
+def guild_create(
+    guild_id: int, members: t.List[int], voice_users: t.List[int]
+) -> t.Dict[str, t.Any]:
+    """Return a GUILD_CREATE with a few channels, roles and emojis, and users in voice.
+
+    Like in large guilds, or without the presences intent, only the members in a voice
+    channel and the bot come with the guild, the rest come in chunks.
+    """
+    roles = [str(guild_id * 100 + i) for i in range(10)]
+    text_channel = str(guild_id * 100 + 50)
+    voice_channel = str(guild_id * 100 + 51)
+
+    return {
+        "id": str(guild_id),
+        "name": f"Guild {guild_id}",
+        "icon": None,
+        "splash": None,
+        "discovery_splash": None,
+        "owner_id": str(members[0]),
+        "afk_channel_id": None,
+        "afk_timeout": 300,
+        "verification_level": 0,
+        "default_message_notifications": 0,
+        "explicit_content_filter": 0,
+        "features": [],
+        "mfa_level": 0,
+        "application_id": None,
+        "system_channel_id": None,
+        "system_channel_flags": 0,
+        "rules_channel_id": None,
+        "vanity_url_code": None,
+        "description": None,
+        "banner": None,
+        "premium_tier": 0,
+        "preferred_locale": "en-US",
+        "public_updates_channel_id": None,
+        "nsfw_level": 0,
+        "large": len(members) > 250,
+        "joined_at": "2024-01-01T00:00:00+00:00",
+        "member_count": len(members),
+        "unavailable": False,
+        "roles": [
+            {
+                "id": role_id,
+                "name": f"role {role_id}",
+                "color": 0,
+                "hoist": False,
+                "position": i,
+                "permissions": "0",
+                "managed": False,
+                "mentionable": False,
+            }
+            for i, role_id in enumerate(roles)
+        ],
+        "emojis": [
+            {
+                "id": str(guild_id * 100 + 60 + i),
+                "name": f"emoji{i}",
+                "roles": [],
+                "require_colons": True,
+                "managed": False,
+                "animated": False,
+                "available": True,
+            }
+            for i in range(20)
+        ],
+        "stickers": [],
+        "channels": [
+            {
+                "id": text_channel,
+                "type": 0,
+                "guild_id": str(guild_id),
+                "name": "general",
+                "position": 0,
+                "permission_overwrites": [],
+                "nsfw": False,
+                "parent_id": None,
+                "topic": None,
+                "last_message_id": None,
+                "rate_limit_per_user": 0,
+            },
+            {
+                "id": voice_channel,
+                "type": 2,
+                "guild_id": str(guild_id),
+                "name": "music",
+                "position": 1,
+                "permission_overwrites": [],
+                "nsfw": False,
+                "parent_id": None,
+                "bitrate": 64000,
+                "user_limit": 0,
+                "rtc_region": None,
+            },
+        ],
+        "threads": [],
+        "presences": [],
+        "members": [member(i, roles[:2]) for i in [BOT_ID, *voice_users]],
+        "voice_states": [
+            {
+                "guild_id": str(guild_id),
+                "channel_id": voice_channel,
+                "user_id": str(i),
+                "session_id": f"{guild_id}-{i}",
+                "deaf": False,
+                "mute": False,
+                "self_deaf": False,
+                "self_mute": False,
+                "self_video": False,
+                "suppress": False,
+                "request_to_speak_timestamp": None,
+            }
+            for i in voice_users
+        ],
+    }
+
+
+def message_create(
+    guild_id: int, message_id: int, author_id: int, content: bool
+) -> t.Dict[str, t.Any]:
+    return {
+        "id": str(message_id),
+        "channel_id": str(guild_id * 100 + 50),
+        "guild_id": str(guild_id),
+        "author": user(author_id),
+        "member": {k: v for k, v in member(author_id, []).items() if k != "user"},
+        # without the MESSAGE_CONTENT intent Discord sends the messages empty
+        "content": f"message {message_id} of the conversation" if content else "",
+        "timestamp": "2024-01-01T00:00:00+00:00",
+        "edited_timestamp": None,
+        "tts": False,
+        "mention_everyone": False,
+        "mentions": [],
+        "mention_roles": [],
+        "attachments": [],
+        "embeds": [],
+        "pinned": False,
+        "type": 0,
+        "flags": 0,
+    }
+
+
+async def receive_guild(
+    bot: hikari.GatewayBot,
+    intents: hikari.Intents,
+    guild_id: int,
+    members: int,
+    voice_users: int,
+    messages: int,
+) -> None:
+    """Send the events of a guild to the bot, as Discord would with its intents."""
+    manager = t.cast(t.Any, bot.event_manager)
+    shard = FakeShard()
+    member_ids = list(range(guild_id * 1_000_000, guild_id * 1_000_000 + members))
+
+    await manager.on_guild_create(
+        shard, guild_create(guild_id, member_ids, member_ids[:voice_users])
+    )
+
+    if intents & hikari.Intents.GUILD_MEMBERS:
+        for i in range(0, members, CHUNK_SIZE):
+            await manager.on_guild_members_chunk(
+                shard,
+                {
+                    "guild_id": str(guild_id),
+                    "members": [
+                        member(j, [str(guild_id * 100)])
+                        for j in member_ids[i : i + CHUNK_SIZE]
+                    ],
+                    "chunk_index": i // CHUNK_SIZE,
+                    "chunk_count": -(-members // CHUNK_SIZE),
+                },
+            )
+
+    if intents & hikari.Intents.GUILD_MESSAGES:
+        content = bool(intents & hikari.Intents.MESSAGE_CONTENT)
+
+        for i in range(messages):
+            await manager.on_message_create(
+                shard,
+                message_create(
+                    guild_id,
+                    guild_id * 1_000_000 + i,
+                    member_ids[i % members],
+                    content,
+                ),
+            )
+
+
+def measure(profile: str, prefix_commands: bool, args: argparse.Namespace) -> Profile:
+    """Fill the cache of a new bot with the profile, in the current process."""
+    intents, cache_settings = gateway_settings(profile, prefix_commands)
+
+    async def fill() -> hikari.GatewayBot:
+        bot = hikari.GatewayBot(
+            "benchmark",
+            intents=intents,
+            cache_settings=cache_settings,
+            banner=None,
+            logs="ERROR",
+        )
+
+        for guild_id in range(1, args.guilds + 1):
+            await receive_guild(
+                bot, intents, guild_id, args.members, args.voice_users, args.messages
+            )
+
+        return bot
+
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    bot = asyncio.run(fill())
+    gc.collect()
+    retained = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+
+    return Profile(
+        profile,
+        prefix_commands,
+        str(intents),
+        sum(len(i) for i in bot.cache.get_members_view().values()),
+        len(bot.cache.get_messages_view()),
+        sum(len(i) for i in bot.cache.get_voice_states_view().values()),
+        retained / 1024 / 1024,
+        rss_bytes() / 1024 / 1024,
+    )
+
+
+def print_profiles(profiles: t.List[Profile]) -> None:
+    print(
+        f"{'profile':>10}{'prefix':>8}{'members':>10}{'messages':>10}"
+        f"{'voice':>8}{'kept MiB':>10}{'RSS MiB':>10}"
+    )
+
+    for p in profiles:
+        print(
+            f"{p.name:>10}{'yes' if p.prefix_commands else 'no':>8}"
+            f"{p.cached_members:>10}{p.cached_messages:>10}"
+            f"{p.cached_voice_states:>8}{p.retained_mib:>10.1f}{p.rss_mib:>10.1f}"
+        )
+
+
+def main(args: argparse.Namespace) -> int:
+    profiles = []
+    context = multiprocessing.get_context("spawn")
+
+    for profile, prefix_commands in itertools.product(args.profiles, [True, False]):
+        # a new process per profile, the memory hikari frees isn't given back
+        with concurrent.futures.ProcessPoolExecutor(1, mp_context=context) as pool:
+            profiles.append(
+                pool.submit(measure, profile, prefix_commands, args).result()
+            )
+
+        print(
+            f"Measured {profile} {'with' if prefix_commands else 'without'} prefix",
+            file=sys.stderr,
+        )
+
+    print_profiles(profiles)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(
+                {
+                    "guilds": args.guilds,
+                    "members": args.members,
+                    "voice_users": args.voice_users,
+                    "messages": args.messages,
+                    "hikari": hikari.__version__,
+                    "python": sys.version.split()[0],
+                    "profiles": [dataclasses.asdict(i) for i in profiles],
+                },
+                f,
+                indent=2,
+            )
+
+    return 0
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        prog="python -m benchmarks.cache_profiles",
+        description="Measure the memory of hikari's cache with every gateway profile.",
+    )
+    parser.add_argument(
+        "--profiles",
+        nargs="+",
+        choices=list(PROFILES),
+        default=list(PROFILES),
+        help="profiles to measure, each with and without prefix commands",
+    )
+    parser.add_argument("--guilds", type=int, default=100)
+    parser.add_argument("--members", type=int, default=2000, help="members per guild")
+    parser.add_argument(
+        "--voice-users", type=int, default=5, help="members in voice per guild"
+    )
+    parser.add_argument(
+        "--messages",
+        type=int,
+        default=300,
+        help="messages per guild, only cached with prefix commands",
+    )
+    parser.add_argument("--output", help="write the results to this JSON file")
+
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.ERROR)
+    sys.exit(main(parse_args()))
@@ -0,0 +1,254 @@
+from __future__ import annotations
+import collections
+import itertools
+import typing as t
+
+import hikari
+import lightbulb
+from lightbulb.utils import DataStore
+
+
+class FakeUser:
+    __slots__ = ["id", "is_bot"]
+
+    def __init__(self, user_id: int, is_bot: bool = False) -> None:
+        self.id = hikari.Snowflake(user_id)
+        self.is_bot = is_bot
+
+
+class FakeMessage:
+    __slots__ = ["id", "channel_id", "content"]
+
+    def __init__(self, message_id: int, channel_id: int, content: t.Any) -> None:
+        self.id = hikari.Snowflake(message_id)
+        self.channel_id = hikari.Snowflake(channel_id)
+        self.content = content
+
+
+class FakeResponse:
+    """What `Context.respond` returns, with the `edit` the commands use."""
+
+    __slots__ = ["message"]
+
+    def __init__(self, message: FakeMessage) -> None:
+        self.message = message
+
+    async def edit(self, content: t.Any = hikari.UNDEFINED, **kwargs: t.Any) -> None:
+        if content is not hikari.UNDEFINED:
+            self.message.content = content
+
+
+class FakeRest:
+    """The REST calls the music plugins make, answered locally and counted by name."""
+
+    __slots__ = ["calls", "__ids"]
+
+    def __init__(self) -> None:
+        self.calls: t.Counter[str] = collections.Counter()
+        self.__ids = itertools.count(1_000_000)
+
+    def next_message(self, channel_id: int, content: t.Any) -> FakeMessage:
+        return FakeMessage(next(self.__ids), channel_id, content)
+
+    async def fetch_my_user(self) -> FakeUser:
+        self.calls["fetch_my_user"] += 1
+        return FakeUser(1, True)
+
+    async def create_message(
+        self, channel: int, content: t.Any = hikari.UNDEFINED, **kwargs: t.Any
+    ) -> FakeMessage:
+        self.calls["create_message"] += 1
+        return self.next_message(channel, content)
+
+    async def edit_message(
+        self,
+        channel: int,
+        message: int,
+        content: t.Any = hikari.UNDEFINED,
+        **kwargs: t.Any,
+    ) -> FakeMessage:
+        self.calls["edit_message"] += 1
+        return FakeMessage(int(message), channel, content)
+
+    async def delete_message(self, channel: int, message: int) -> None:
+        self.calls["delete_message"] += 1
+
+    def build_message_action_row(self) -> hikari.api.MessageActionRowBuilder:
+        return hikari.impl.MessageActionRowBuilder()
+
+
+class FakeVoiceState:
+    __slots__ = ["channel_id", "member"]
+
+    def __init__(self, channel_id: int, user_id: int) -> None:
+        self.channel_id = hikari.Snowflake(channel_id)
+        self.member = FakeUser(user_id)
+
+
+class FakeCache:
+    __slots__ = ["voice_states"]
+
+    def __init__(self) -> None:
+        self.voice_states: t.Dict[t.Tuple[int, int], FakeVoiceState] = {}
+
+    def get_voice_state(self, guild: int, user: int) -> t.Optional[FakeVoiceState]:
+        return self.voice_states.get((int(guild), int(user)))
+
+    def get_voice_states_view_for_channel(
+        self, guild: int, channel: int
+    ) -> t.Dict[hikari.Snowflake, FakeVoiceState]:
+        return {
+            hikari.Snowflake(user_id): state
+            for (guild_id, user_id), state in self.voice_states.items()
+            if guild_id == guild and state.channel_id == channel
+        }
+
+
+class FakeVoice:
+    """Creates voice connections without the gateway, as if Discord had answered at once."""
+
+    __slots__ = ["connections"]
+
+    def __init__(self) -> None:
+        self.connections: t.Dict[hikari.Snowflake, hikari.api.VoiceConnection] = {}
+
+    async def connect_to(
+        self,
+        guild: int,
+        channel: int,
+        voice_connection_type: t.Type[hikari.api.VoiceConnection],
+        *,
+        deaf: bool = False,
+        mute: bool = False,
+        timeout: t.Optional[int] = 5,
+        **kwargs: t.Any,
+    ) -> hikari.api.VoiceConnection:
+        guild_id = hikari.Snowflake(guild)
+        connection = await voice_connection_type.initialize(
+            channel_id=hikari.Snowflake(channel),
+            endpoint="benchmark.discord.media:443",
+            guild_id=guild_id,
+            on_close=self.__on_close,
+            owner=self,
+            session_id=f"benchmark-{guild_id}",
+            shard_id=0,
+            token="benchmark",
+            user_id=hikari.Snowflake(1),
+            **kwargs,
+        )
+        self.connections[guild_id] = connection
+
+        return connection
+
+    async def disconnect_all(self) -> None:
+        for connection in list(self.connections.values()):
+            await connection.disconnect()
+
+    async def __on_close(self, connection: hikari.api.VoiceConnection) -> None:
+        self.connections.pop(connection.guild_id, None)
+
+
+class FakeBot:
+    """The parts of `lightbulb.BotApp` used by the music plugins, with a single shard."""
+
+    __slots__ = ["d", "rest", "cache", "voice", "shards", "shard_count"]
+
+    def __init__(self) -> None:
+        self.d = DataStore()
+        self.rest = FakeRest()
+        self.cache = FakeCache()
+        self.voice = FakeVoice()
+        self.shards = {0: None}
+        self.shard_count = 1
+
+    def add_plugin(self, plugin: lightbulb.Plugin) -> None:
+        # only the listeners are used, the commands are called directly and not registered
+        plugin._app = t.cast(lightbulb.BotApp, self)
+
+    async def dispatch(
+        self, event: t.Type[hikari.Event], *plugins: lightbulb.Plugin
+    ) -> None:
+        """Run the listeners of `event` of the plugins, in order, like the event manager."""
+        for plugin in plugins:
+            for listener in plugin._listeners.get(event, []):
+                await listener(event(app=self))  # type: ignore[call-arg]
+
+
+class FakeContext(lightbulb.Context):
+    """A context for calling command callbacks directly, as a member in a voice channel."""
+
+    def __init__(
+        self,
+        bot: FakeBot,
+        guild_id: int,
+        channel_id: int,
+        user_id: int,
+        options: t.Dict[str, t.Any],
+    ) -> None:
+        super().__init__(t.cast(lightbulb.BotApp, bot))
+        self.__guild_id = hikari.Snowflake(guild_id)
+        self.__channel_id = hikari.Snowflake(channel_id)
+        self.__author = FakeUser(user_id)
+        self.__options = options
+
+    @property
+    def raw_options(self) -> t.Dict[str, t.Any]:
+        return self.__options
+
+    @property
+    def event(self) -> None:
+        return None
+
+    @property
+    def channel_id(self) -> hikari.Snowflake:
+        return self.__channel_id
+
+    @property
+    def guild_id(self) -> hikari.Snowflake:
+        return self.__guild_id
+
+    @property
+    def attachments(self) -> t.Sequence[hikari.Attachment]:
+        return []
+
+    @property
+    def member(self) -> None:
+        return None
+
+    @property
+    def author(self) -> hikari.User:
+        return t.cast(hikari.User, self.__author)
+
+    @property
+    def invoked_with(self) -> str:
+        return "benchmark"
+
+    @property
+    def prefix(self) -> str:
+        return "/"
+
+    @property
+    def command(self) -> None:
+        return None
+
+    def get_channel(self) -> None:
+        return None
+
+    async def _maybe_defer(self) -> None:
+        return None
+
+    async def respond(
+        self,
+        *args: t.Any,
+        delete_after: t.Union[int, float, None] = None,
+        **kwargs: t.Any,
+    ) -> lightbulb.ResponseProxy:
+        message = self.bot.rest.next_message(
+            self.__channel_id, args[0] if args else kwargs.get("content")
+        )
+        self._responded = True
+
+        return t.cast(lightbulb.ResponseProxy, FakeResponse(message))
+
+    async def respond_with_modal(self, *args: t.Any, **kwargs: t.Any) -> None:
+        raise NotImplementedError
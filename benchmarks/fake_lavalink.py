@@ -0,0 +1,301 @@
+from __future__ import annotations
+import asyncio
+import json
+import typing as t
+
+from aiohttp import web
+
+
+def track_json(identifier: str, uri: t.Optional[str] = None) -> t.Dict[str, t.Any]:
+    """Return a track as Lavalink v4 serializes it, using the identifier as encoded track."""
+    return {
+        "encoded": f"fake:{identifier}",
+        "info": {
+            "identifier": identifier,
+            "isSeekable": True,
+            "author": f"Author {identifier}",
+            "length": 180_000,
+            "isStream": False,
+            "position": 0,
+            "title": f"Title {identifier}",
+            "uri": uri,
+            "artworkUrl": None,
+            "isrc": None,
+            "sourceName": "http",
+        },
+        "pluginInfo": {},
+        "userData": {},
+    }
+
+
+class FakeLavalink:
+    """An in-process Lavalink v4 node, for running the bot without network access.
+
+    Every REST response waits `latency` seconds. Starting a track answers with a
+    TrackStartEvent on the websocket, like a real node does once the audio is loaded.
+
+    Identifiers containing `playlist` load a playlist of `playlist_size` tracks,
+    search prefixes (`spsearch:`, `ytsearch:`...) load `search_size` results,
+    identifiers containing `missing` load nothing and the rest load a single track.
+    """
+
+    __slots__ = [
+        "latency",
+        "playlist_size",
+        "search_size",
+        "requests",
+        "__players",
+        "__sockets",
+        "__runner",
+        "__port",
+    ]
+
+    def __init__(
+        self, latency: float = 0.0, playlist_size: int = 100, search_size: int = 5
+    ) -> None:
+        self.latency = latency
+        self.playlist_size = playlist_size
+        self.search_size = search_size
+        self.requests = 0
+
+        self.__players: t.Dict[str, t.Dict[str, t.Any]] = {}
+        self.__sockets: t.List[web.WebSocketResponse] = []
+        self.__runner: t.Optional[web.AppRunner] = None
+        self.__port = 0
+
+    @property
+    def hostname(self) -> str:
+        """Return the `host:port` to use as LAVALINK_HOSTNAME."""
+        return f"127.0.0.1:{self.__port}"
+
+    @property
+    def players(self) -> int:
+        return len(self.__players)
+
+    async def start(self) -> None:
+        app = web.Application()
+        app.router.add_get("/v4/websocket", self.__websocket)
+        app.router.add_get("/v4/loadtracks", self.__load_tracks)
+        app.router.add_get("/v4/decodetrack", self.__decode_track)
+        app.router.add_post("/v4/decodetracks", self.__decode_tracks)
+        app.router.add_get("/v4/sessions/{session}/players", self.__get_players)
+        app.router.add_get("/v4/sessions/{session}/players/{guild}", self.__get_player)
+        app.router.add_patch(
+            "/v4/sessions/{session}/players/{guild}", self.__update_player
+        )
+        app.router.add_delete(
+            "/v4/sessions/{session}/players/{guild}", self.__delete_player
+        )
+        app.router.add_patch("/v4/sessions/{session}", self.__update_session)
+        app.router.add_get("/v4/info", self.__info)
+        app.router.add_get("/v4/stats", self.__stats)
+        app.router.add_get("/version", self.__version)
+
+        self.__runner = web.AppRunner(app, access_log=None)
+        await self.__runner.setup()
+        site = web.TCPSite(self.__runner, "127.0.0.1", 0)
+        await site.start()
+        self.__port = self.__runner.addresses[0][1]
+
+    async def close(self) -> None:
+        for ws in self.__sockets:
+            await ws.close()
+
+        if self.__runner:
+            await self.__runner.cleanup()
+            self.__runner = None
+
+    async def send_event(self, event: t.Dict[str, t.Any]) -> None:
+        """Send a player event to every connected client."""
+        message = json.dumps({"op": "event", **event})
+
+        for ws in list(self.__sockets):
+            if not ws.closed:
+                await ws.send_str(message)
+
+    async def end_track(self, guild_id: int, reason: str = "finished") -> None:
+        """Finish the track of a player, as if it had played until the end."""
+        player = self.__players.get(str(guild_id))
+
+        if not player or not player["track"]:
+            return
+
+        track, player["track"] = player["track"], None
+        await self.send_event(
+            {
+                "type": "TrackEndEvent",
+                "guildId": str(guild_id),
+                "track": track,
+                "reason": reason,
+            }
+        )
+
+    async def __respond(self, data: t.Any, status: int = 200) -> web.Response:
+        self.requests += 1
+
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        return web.json_response(data, status=status)
+
+    async def __websocket(self, request: web.Request) -> web.WebSocketResponse:
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        self.__sockets.append(ws)
+
+        await ws.send_str(
+            json.dumps({"op": "ready", "resumed": False, "sessionId": "benchmark"})
+        )
+
+        async for _ in ws:
+            pass
+
+        self.__sockets.remove(ws)
+
+        return ws
+
+    async def __load_tracks(self, request: web.Request) -> web.Response:
+        identifier = request.query.get("identifier", "")
+        prefix, _, query = identifier.partition(":")
+
+        if "missing" in identifier:
+            return await self.__respond({"loadType": "empty", "data": None})
+        elif "playlist" in identifier:
+            data = {
+                "info": {"name": identifier, "selectedTrack": -1},
+                "pluginInfo": {},
+                "tracks": [
+                    track_json(f"{identifier}#{i}", f"{identifier}#{i}")
+                    for i in range(self.playlist_size)
+                ],
+            }
+            return await self.__respond({"loadType": "playlist", "data": data})
+        elif prefix.endswith("search"):
+            data = [
+                track_json(f"{query}#{i}", f"https://example.com/{query}#{i}")
+                for i in range(self.search_size)
+            ]
+            return await self.__respond({"loadType": "search", "data": data})
+
+        return await self.__respond(
+            {"loadType": "track", "data": track_json(identifier, identifier)}
+        )
+
+    async def __decode_track(self, request: web.Request) -> web.Response:
+        return await self.__respond(self.__decode(request.query["encodedTrack"]))
+
+    async def __decode_tracks(self, request: web.Request) -> web.Response:
+        return await self.__respond([self.__decode(i) for i in await request.json()])
+
+    def __decode(self, encoded: str) -> t.Dict[str, t.Any]:
+        identifier = encoded.partition(":")[2]
+        return track_json(identifier, identifier)
+
+    async def __get_players(self, request: web.Request) -> web.Response:
+        return await self.__respond(list(self.__players.values()))
+
+    async def __get_player(self, request: web.Request) -> web.Response:
+        player = self.__players.get(request.match_info["guild"])
+
+        if not player:
+            return await self.__respond(
+                {"status": 404, "error": "Not Found", "message": "Player not found"},
+                404,
+            )
+
+        return await self.__respond(player)
+
+    async def __update_player(self, request: web.Request) -> web.Response:
+        guild_id = request.match_info["guild"]
+        body = await request.json()
+        player = self.__players.setdefault(
+            guild_id,
+            {
+                "guildId": guild_id,
+                "track": None,
+                "volume": 100,
+                "paused": False,
+                "state": {"time": 0, "position": 0, "connected": True, "ping": 0},
+                "voice": {"token": "", "endpoint": "", "sessionId": ""},
+                "filters": {},
+            },
+        )
+        started = None
+
+        if "voice" in body:
+            player["voice"] = body["voice"]
+        if "paused" in body:
+            player["paused"] = body["paused"]
+        if "volume" in body:
+            player["volume"] = body["volume"]
+        if "position" in body:
+            player["state"]["position"] = body["position"]
+
+        if "track" in body:
+            encoded = body["track"].get("encoded")
+
+            if encoded:
+                started = self.__decode(encoded)
+                started["encoded"] = encoded
+                started["userData"] = body["track"].get("userData") or {}
+                player["state"]["position"] = body.get("position", 0)
+
+            player["track"] = started
+
+        response = await self.__respond(player)
+
+        if started:
+            # the real node starts the track a moment after answering
+            await self.send_event(
+                {"type": "TrackStartEvent", "guildId": guild_id, "track": started}
+            )
+
+        return response
+
+    async def __delete_player(self, request: web.Request) -> web.Response:
+        self.__players.pop(request.match_info["guild"], None)
+        # lavalink_rs reads the body of this response as JSON, so it can't be empty
+        return await self.__respond(None)
+
+    async def __update_session(self, request: web.Request) -> web.Response:
+        body = await request.json()
+        return await self.__respond(
+            {"resuming": body.get("resuming", False), "timeout": 60}
+        )
+
+    async def __info(self, request: web.Request) -> web.Response:
+        return await self.__respond(
+            {
+                "version": {
+                    "semver": "4.0.0",
+                    "major": 4,
+                    "minor": 0,
+                    "patch": 0,
+                    "preRelease": None,
+                    "build": None,
+                },
+                "buildTime": 0,
+                "git": {"branch": "main", "commit": "benchmark", "commitTime": 0},
+                "jvm": "none",
+                "lavaplayer": "none",
+                "sourceManagers": ["http"],
+                "filters": [],
+                "plugins": [],
+            }
+        )
+
+    async def __stats(self, request: web.Request) -> web.Response:
+        return await self.__respond(
+            {
+                "players": len(self.__players),
+                "playingPlayers": sum(1 for i in self.__players.values() if i["track"]),
+                "uptime": 0,
+                "memory": {"free": 0, "used": 0, "allocated": 0, "reservable": 0},
+                "cpu": {"cores": 1, "systemLoad": 0.0, "lavalinkLoad": 0.0},
+                "frameStats": None,
+            }
+        )
+
+    async def __version(self, request: web.Request) -> web.Response:
+        self.requests += 1
+        return web.Response(text="4.0.0")
@@ -0,0 +1,105 @@
+from __future__ import annotations
+import asyncio
+import os
+import statistics
+import time
+import typing as t
+
+import hikari
+
+from benchmarks.fake_discord import FakeBot, FakeContext, FakeVoiceState
+from benchmarks.fake_lavalink import FakeLavalink
+
+TEXT_CHANNEL_ID = 10
+USER_ID = 20
+
+
+def configure(lavalink: FakeLavalink, directory: str, **env: str) -> None:
+    """Point the plugins to the fake node and keep their files in `directory`."""
+    # the plugins read their configuration when the bot starts
+    os.environ.update(
+        {
+            "LAVALINK_NODES": "",
+            "LAVALINK_HOSTNAME": lavalink.hostname,
+            "LAVALINK_SSL": "false",
+            "LAVALINK_PASSWORD": "benchmark",
+            "TRACK_CACHE_PATH": "",
+            "TRACK_INDEX_PATH": "",
+            "QUEUE_STORE_PATH": os.path.join(directory, "queues.sqlite3"),
+            "METRICS_PORT": "0",
+            **env,
+        }
+    )
+
+
+def percentiles(samples: t.List[float]) -> t.Tuple[float, float, float]:
+    """Return the p50, p95 and p99 of `samples`."""
+    if len(samples) < 2:
+        return samples[0], samples[0], samples[0]
+
+    cuts = statistics.quantiles(samples, n=100, method="inclusive")
+
+    return cuts[49], cuts[94], cuts[98]
+
+
+class Harness:
+    """Loads the plugins on a fake bot, to run their commands against a fake node."""
+
+    def __init__(self, lavalink: FakeLavalink, settle: float) -> None:
+        from plugins import meta, monitoring, music_advanced, music_base, music_basic
+
+        self.lavalink = lavalink
+        # how long to wait after a command for the events it causes
+        self.settle = settle
+        self.bot = FakeBot()
+        self.plugins = [
+            meta.plugin,
+            music_base.plugin,
+            music_basic.plugin,
+            music_advanced.plugin,
+            monitoring.plugin,
+        ]
+
+        for plugin in self.plugins:
+            self.bot.add_plugin(plugin)
+
+    async def start(self) -> None:
+        await self.bot.dispatch(hikari.StartingEvent, *self.plugins)
+        await self.bot.dispatch(hikari.StartedEvent, *self.plugins)
+        # waits for lavalink_rs to connect to the websocket of the node
+        await asyncio.sleep(0.5)
+
+    async def stop(self) -> None:
+        await self.bot.voice.disconnect_all()
+        await self.bot.dispatch(hikari.StoppingEvent, *self.plugins)
+        await self.bot.dispatch(hikari.StoppedEvent, *self.plugins)
+
+    def context(self, guild_id: int, options: t.Dict[str, t.Any]) -> FakeContext:
+        """Return a context of the user, who is in a voice channel of the guild."""
+        self.bot.cache.voice_states[(guild_id, USER_ID)] = FakeVoiceState(
+            guild_id + 1, USER_ID
+        )
+        return FakeContext(self.bot, guild_id, TEXT_CHANNEL_ID, USER_ID, options)
+
+    async def fill_queue(self, guild_id: int, min_queue: int) -> int:
+        """Queue playlists until the queue of the guild is long enough, returning its length."""
+        from plugins import music_basic
+
+        queue = self.bot.d.queues.get(guild_id)
+
+        while min_queue and (queue is None or len(queue) < min_queue):
+            await music_basic.play.callback(
+                self.context(
+                    guild_id,
+                    {"query": f"https://example.com/playlist/{time.monotonic_ns()}"},
+                )
+            )
+            queue = self.bot.d.queues.get(guild_id)
+
+            # the rest of the playlist is added in the background
+            while self.bot.d.playlists.stats()["running"]:
+                await asyncio.sleep(0.01)
+
+            await asyncio.sleep(self.settle)
+
+        return len(queue) if queue is not None else 0
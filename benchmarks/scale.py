@@ -0,0 +1,339 @@
+"""Capacity of one bot process as the number of guild sessions grows, run offline.
+
+    python -m benchmarks.scale --guilds 100 500 1000 2000 --duration 10 --output scale.json
+    python -m benchmarks.scale --guilds 1000 --baseline scale.json --max-regression 0.2
+
+Every session is what a playing guild keeps in the process: a LavalinkVoice, its
+PlayerContext and player data, the queue mirror and the saved state. After adding
+the sessions of a step, the memory is measured, and then a mix of commands and
+finished tracks is run on random guilds for `--duration` seconds, measuring the
+throughput and how late the event loop wakes up.
+"""
+
+from __future__ import annotations
+import argparse
+import asyncio
+import dataclasses
+import gc
+import json
+import logging
+import os
+import random
+import resource
+import sys
+import tempfile
+import time
+import typing as t
+
+from benchmarks.fake_lavalink import FakeLavalink
+from benchmarks.harness import Harness, configure, percentiles
+
+# how often every operation of the mix is run, relative to the others
+MIX = {"play": 3, "queue": 3, "skip": 1, "swap": 1, "track_end": 2}
+
+
+@dataclasses.dataclass
+class Step:
+    guilds: int
+    rss_mib: float
+    kib_per_guild: float
+    objects_per_guild: float
+    commands_per_s: float
+    track_starts_per_s: float
+    command_p99_ms: float
+    lag_p50_ms: float
+    lag_p99_ms: float
+    lag_max_ms: float
+
+
+def rss_bytes() -> int:
+    """Return the current resident memory of the process."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        # only the peak is available outside of Linux, in KiB on Linux and bytes on macOS
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+
+
+def memory() -> t.Tuple[int, int]:
+    """Return the resident memory and the objects tracked by the garbage collector."""
+    gc.collect()
+    return rss_bytes(), len(gc.get_objects())
+
+
+class Simulator:
+    """Adds guild sessions to a harness and runs the command mix on them."""
+
+    def __init__(self, harness: Harness, queue_length: int) -> None:
+        self.harness = harness
+        self.queue_length = queue_length
+        self.guilds: t.List[int] = []
+        self.latencies: t.List[float] = []
+
+    async def add_guild(self, guild_id: int) -> None:
+        """Join the guild and queue `queue_length` tracks after the one playing."""
+        from plugins import music_basic
+
+        for i in range(self.queue_length + 1):
+            await music_basic.play.callback(
+                self.harness.context(
+                    guild_id, {"query": f"https://example.com/track/{guild_id}-{i}"}
+                )
+            )
+
+        self.guilds.append(guild_id)
+
+    async def grow(self, count: int, concurrency: int) -> None:
+        start = len(self.guilds)
+        guild_ids = range(1_000 + start, 1_000 + count)
+
+        for i in range(0, len(guild_ids), concurrency):
+            await asyncio.gather(
+                *[self.add_guild(g) for g in guild_ids[i : i + concurrency]]
+            )
+
+        await asyncio.sleep(self.harness.settle)
+
+    async def run_operation(self, op: str, guild_id: int) -> None:
+        from plugins import music_advanced, music_basic
+
+        bot = self.harness.bot
+
+        if op == "track_end":
+            # the node says the track finished, lavalink_rs starts the next one
+            await self.harness.lavalink.end_track(guild_id)
+            return
+
+        queue = bot.d.queues.get(guild_id)
+        count = len(queue) if queue is not None else 0
+
+        if op == "play":
+            command = music_basic.play
+            options = {"query": f"https://example.com/track/{random.random()}"}
+        elif op == "skip":
+            command, options = music_basic.skip, {}
+        elif op == "swap" and count >= 2:
+            command = music_advanced.swap
+            index1, index2 = random.sample(range(1, count + 1), 2)
+            options = {"index1": index1, "index2": index2}
+        else:
+            command = music_advanced.queue
+            options = {"page": random.randint(1, 3)}
+
+        start = time.perf_counter()
+        await command.callback(self.harness.context(guild_id, options))
+        self.latencies.append((time.perf_counter() - start) * 1000)
+
+    async def drive(self, duration: float, concurrency: int, rate: float) -> int:
+        """Run the mix on random guilds with `concurrency` workers, returning the commands run.
+
+        With a `rate`, the workers together run about that many operations per second,
+        otherwise they run as fast as the event loop allows.
+        """
+        ops = list(MIX)
+        weights = list(MIX.values())
+        deadline = time.monotonic() + duration
+        pause = concurrency / rate if rate else 0
+        self.latencies = []
+
+        async def worker() -> None:
+            while time.monotonic() < deadline:
+                op = random.choices(ops, weights)[0]
+
+                try:
+                    await self.run_operation(op, random.choice(self.guilds))
+                except Exception as e:
+                    logging.warning(f"{op} failed: {e}")
+
+                # lets the events of the node run, like a bot waiting for Discord
+                await asyncio.sleep(pause)
+
+        await asyncio.gather(*[worker() for _ in range(concurrency)])
+
+        return len(self.latencies)
+
+
+async def measure_lag(interval: float, samples: t.List[float]) -> None:
+    """Record how much later than asked the event loop wakes up, until cancelled."""
+    loop = asyncio.get_running_loop()
+
+    while True:
+        start = loop.time()
+        await asyncio.sleep(interval)
+        samples.append((loop.time() - start - interval) * 1000)
+
+
+async def run_step(
+    simulator: Simulator,
+    guilds: int,
+    base: t.Tuple[int, int],
+    args: argparse.Namespace,
+) -> Step:
+    await simulator.grow(guilds, args.concurrency)
+    rss, objects = memory()
+
+    bot = simulator.harness.bot
+    track_starts = bot.d.now_playing.stats()["updates"]
+    lag: t.List[float] = []
+    monitor = asyncio.create_task(measure_lag(0.01, lag))
+    start = time.perf_counter()
+
+    try:
+        commands = await simulator.drive(args.duration, args.concurrency, args.rate)
+    finally:
+        monitor.cancel()
+
+    elapsed = time.perf_counter() - start
+    track_starts = bot.d.now_playing.stats()["updates"] - track_starts
+    lag = lag or [0.0]
+    command_p99 = percentiles(simulator.latencies)[2] if simulator.latencies else 0.0
+
+    return Step(
+        guilds,
+        rss / 2**20,
+        (rss - base[0]) / 1024 / guilds,
+        (objects - base[1]) / guilds,
+        commands / elapsed,
+        track_starts / elapsed,
+        command_p99,
+        percentiles(lag)[0],
+        percentiles(lag)[2],
+        max(lag),
+    )
+
+
+def print_steps(steps: t.List[Step]) -> None:
+    print(
+        f"{'guilds':>8}{'RSS MiB':>10}{'KiB/guild':>11}{'objs/guild':>12}"
+        f"{'cmd/s':>9}{'starts/s':>10}{'cmd p99':>9}{'lag p50':>9}"
+        f"{'lag p99':>9}{'lag max':>9}"
+    )
+
+    for s in steps:
+        print(
+            f"{s.guilds:>8}{s.rss_mib:>10.1f}{s.kib_per_guild:>11.1f}"
+            f"{s.objects_per_guild:>12.1f}{s.commands_per_s:>9.0f}"
+            f"{s.track_starts_per_s:>10.0f}{s.command_p99_ms:>9.2f}"
+            f"{s.lag_p50_ms:>9.2f}{s.lag_p99_ms:>9.2f}{s.lag_max_ms:>9.2f}"
+        )
+
+
+def regressions(
+    steps: t.List[Step], baseline: t.Dict[str, t.Any], max_regression: float
+) -> t.List[str]:
+    """Return the steps that use more than `max_regression` more memory per guild."""
+    previous = {i["guilds"]: i for i in baseline["steps"]}
+    worse = []
+
+    for s in steps:
+        old = previous.get(s.guilds)
+
+        if not old:
+            continue
+
+        for field in ["kib_per_guild", "objects_per_guild"]:
+            if getattr(s, field) > old[field] * (1 + max_regression):
+                worse.append(
+                    f"{s.guilds} guilds: {field} {old[field]:.1f} -> {getattr(s, field):.1f}"
+                )
+
+    return worse
+
+
+async def main(args: argparse.Namespace) -> int:
+    random.seed(args.seed)
+    lavalink = FakeLavalink(args.latency_ms / 1000)
+    await lavalink.start()
+    steps = []
+
+    with tempfile.TemporaryDirectory() as tmp:
+        configure(lavalink, tmp)
+        harness = Harness(lavalink, args.latency_ms / 1000 * 2 + 0.002)
+        await harness.start()
+        simulator = Simulator(harness, args.queue_length)
+        base = memory()
+
+        try:
+            for guilds in sorted(args.guilds):
+                steps.append(await run_step(simulator, guilds, base, args))
+                print(f"Measured {guilds} guilds", file=sys.stderr)
+        finally:
+            await harness.stop()
+            await lavalink.close()
+
+    print_steps(steps)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(
+                {
+                    "latency_ms": args.latency_ms,
+                    "queue_length": args.queue_length,
+                    "python": sys.version.split()[0],
+                    "steps": [dataclasses.asdict(i) for i in steps],
+                },
+                f,
+                indent=2,
+            )
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            worse = regressions(steps, json.load(f), args.max_regression)
+
+        for i in worse:
+            print(f"REGRESSION {i}", file=sys.stderr)
+
+        if worse:
+            return 1
+
+    return 0
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        prog="python -m benchmarks.scale",
+        description="Measure the cost of every guild session offline.",
+    )
+    parser.add_argument(
+        "--guilds",
+        type=int,
+        nargs="+",
+        default=[100, 500, 1000, 2000],
+        help="guild counts to measure, the sessions are added between steps",
+    )
+    parser.add_argument(
+        "--queue-length", type=int, default=5, help="tracks queued in every guild"
+    )
+    parser.add_argument(
+        "--duration", type=float, default=10, help="seconds to run the mix per step"
+    )
+    parser.add_argument(
+        "--concurrency", type=int, default=50, help="commands running at once"
+    )
+    parser.add_argument(
+        "--rate",
+        type=float,
+        default=0,
+        help="operations per second of the mix, as fast as possible if 0",
+    )
+    parser.add_argument(
+        "--latency-ms", type=float, default=0, help="REST latency of the fake node"
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--baseline", help="JSON results to compare the memory with")
+    parser.add_argument(
+        "--max-regression",
+        type=float,
+        default=0.2,
+        help="fail if the memory per guild is this fraction over the baseline",
+    )
+
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.ERROR)
+    sys.exit(asyncio.run(main(parse_args())))
@@ -5,23 +5,34 @@ import lightbulb
 import os
 from dotenv import load_dotenv
 
+from gateway_profile import gateway_settings
+
 load_dotenv()
 
-# Instantiate a Bot instance
-bot = lightbulb.BotApp(
-    token=os.environ["DISCORD_TOKEN"],
-    prefix=os.environ["DISCORD_PREFIX"],
-    default_enabled_guilds=list(filter(int, os.environ["DEFAULT_ENABLED_GUIDS"].split(','))),
-    intents=hikari.Intents.ALL_MESSAGES
-    | hikari.Intents.MESSAGE_CONTENT
-    | hikari.Intents.GUILD_VOICE_STATES
-    | hikari.Intents.GUILDS
-    | hikari.Intents.GUILD_MEMBERS,
-)
-
-bot.load_extensions_from("./plugins")
-
-# Run the bot
-# Note that this is blocking meaning no code after this line will run
-# until the bot is shut off
-bot.run()
+
+def create_bot() -> lightbulb.BotApp:
+    # Without a prefix there are no prefix commands, and no message content to read
+    prefix = os.environ.get("DISCORD_PREFIX") or None
+    intents, cache_settings = gateway_settings(
+        os.environ.get("GATEWAY_PROFILE", "minimal"), prefix is not None
+    )
+
+    # Instantiate a Bot instance
+    bot = lightbulb.BotApp(
+        token=os.environ["DISCORD_TOKEN"],
+        prefix=prefix,
+        default_enabled_guilds=list(filter(int, os.environ["DEFAULT_ENABLED_GUIDS"].split(','))),
+        intents=intents,
+        cache_settings=cache_settings,
+    )
+
+    bot.load_extensions_from("./plugins")
+
+    return bot
+
+
+if __name__ == "__main__":
+    # Run the bot, with every shard in this process (see launcher.py to split them)
+    # Note that this is blocking meaning no code after this line will run
+    # until the bot is shut off
+    create_bot().run()
@@ -0,0 +1,157 @@
+from __future__ import annotations
+import logging
+import typing as t
+
+import tracing
+
+# lavalink decodes all of them, but opus is what Discord sends, so it needs no resampling
+CODECS = ["opus", "vorbis", "mp4a", "aac", "mp3"]
+CONTAINERS = ["webm", "ogg", "m4a", "mp4", "mp3"]
+# the protocols lavalink's http source plays as a single file
+DIRECT_PROTOCOLS = {"http", "https"}
+
+
+def _preference(value: t.Optional[str], preferred: t.List[str]) -> int:
+    value = (value or "").lower()
+
+    for i, name in enumerate(preferred):
+        if value.startswith(name):
+            return len(preferred) - i
+
+    return 0
+
+
+def bitrate(fmt: t.Dict[str, t.Any]) -> t.Optional[float]:
+    """Return the bitrate of a format in kbps, the audio one if it's known."""
+    return fmt.get("abr") or fmt.get("tbr")
+
+
+def audio_only(fmt: t.Dict[str, t.Any]) -> bool:
+    return fmt.get("vcodec") == "none" and fmt.get("acodec") not in (None, "none")
+
+
+def estimated_size(
+    fmt: t.Dict[str, t.Any], duration: t.Optional[float]
+) -> t.Optional[int]:
+    """Return the bytes a format takes to download, from its size or its bitrate."""
+    size = fmt.get("filesize") or fmt.get("filesize_approx")
+
+    if size:
+        return int(size)
+
+    # the total bitrate, the video of a muxed format is downloaded too
+    kbps = fmt.get("tbr") or fmt.get("abr")
+
+    if kbps and duration:
+        return int(kbps * 125 * duration)
+
+    return None
+
+
+def previous_format(
+    formats: t.List[t.Dict[str, t.Any]],
+) -> t.Optional[t.Dict[str, t.Any]]:
+    """Return the format that was played before there was a policy, to compare with."""
+    valid = [i for i in formats if i.get("url") and not i.get("filesize_approx")]
+
+    return valid[-1] if valid else None
+
+
+class FormatPolicy:
+    """Chooses which format of a yt-dlp extraction lavalink streams.
+
+    A format ranks higher if lavalink can play it as a single file, if it has no
+    video, if its bitrate is under `max_bitrate`, and then by codec, container,
+    bitrate and sample rate. Over the ceiling the lowest bitrate wins, so a
+    format without a cheaper alternative is still played.
+    """
+
+    __slots__ = [
+        "max_bitrate",
+        "selections",
+        "audio_only",
+        "over_ceiling",
+        "saved_bytes",
+        "unknown_size",
+    ]
+
+    def __init__(self, max_bitrate: float) -> None:
+        self.max_bitrate = max_bitrate
+        self.selections = 0
+        self.audio_only = 0
+        self.over_ceiling = 0
+        # compared with the format played before, only when both sizes are known
+        self.saved_bytes = 0
+        self.unknown_size = 0
+
+    def stats(self) -> t.Dict[str, int]:
+        """Return the counters of the policy."""
+        return {
+            "selections": self.selections,
+            "audio_only": self.audio_only,
+            "over_ceiling": self.over_ceiling,
+            "saved_bytes": self.saved_bytes,
+            "unknown_size": self.unknown_size,
+        }
+
+    def rank(self, fmt: t.Dict[str, t.Any]) -> t.Tuple[t.Any, ...]:
+        """Return the sort key of a format, the best one is the largest."""
+        kbps = bitrate(fmt) or 0
+        under = kbps <= self.max_bitrate
+
+        return (
+            (fmt.get("protocol") or "https") in DIRECT_PROTOCOLS,
+            audio_only(fmt),
+            under,
+            _preference(fmt.get("acodec"), CODECS),
+            _preference(fmt.get("ext"), CONTAINERS),
+            kbps if under else -kbps,
+            fmt.get("asr") or 0,
+        )
+
+    def choose(
+        self, formats: t.List[t.Dict[str, t.Any]]
+    ) -> t.Optional[t.Dict[str, t.Any]]:
+        """Return the best format with audio, if there is any."""
+        playable = [i for i in formats if i.get("url") and i.get("acodec") != "none"]
+
+        if not playable:
+            return None
+
+        return max(playable, key=self.rank)
+
+    def select(self, info: t.Dict[str, t.Any]) -> None:
+        """Make the best format of an extraction the one its `url` streams."""
+        formats = info.get("formats") or []
+        chosen = self.choose(formats)
+
+        if not chosen:
+            return
+
+        previous = previous_format(formats)
+        duration = info.get("duration")
+        size = estimated_size(chosen, duration)
+        previous_size = estimated_size(previous, duration) if previous else None
+
+        for key in ("url", "format_id", "ext", "acodec", "vcodec", "abr", "asr"):
+            if key in chosen:
+                info[key] = chosen[key]
+
+        self.selections += 1
+        self.audio_only += audio_only(chosen)
+        self.over_ceiling += (bitrate(chosen) or 0) > self.max_bitrate
+
+        if size is not None and previous_size is not None:
+            saved = previous_size - size
+            self.saved_bytes += saved
+        else:
+            saved = None
+            self.unknown_size += 1
+
+        tracing.annotate(format=chosen.get("format_id"), saved_bytes=saved)
+        logging.info(
+            f"Chose format {chosen.get('format_id')} ({chosen.get('acodec')} in "
+            f"{chosen.get('ext')}, {bitrate(chosen) or 0:.0f}kbps, {size} bytes) for "
+            f"{info.get('original_url') or info.get('webpage_url')}, saving {saved} "
+            f"bytes over format {previous.get('format_id') if previous else None}"
+        )
@@ -0,0 +1,59 @@
+from __future__ import annotations
+import dataclasses
+import typing as t
+
+import hikari
+from hikari.api import CacheComponents
+
+
+@dataclasses.dataclass(frozen=True)
+class GatewayProfile:
+    intents: hikari.Intents
+    cache_components: CacheComponents
+
+
+PROFILES = {
+    # only what the music commands read: the guilds, their channels, the voice states
+    # (which keep the member of every user in a voice channel) and the bot's own user.
+    # The guild messages are received, without their content and without caching them,
+    # so the now playing message is sent again when the chat scrolls it away
+    "minimal": GatewayProfile(
+        hikari.Intents.GUILDS
+        | hikari.Intents.GUILD_VOICE_STATES
+        | hikari.Intents.GUILD_MESSAGES,
+        CacheComponents.GUILDS
+        | CacheComponents.GUILD_CHANNELS
+        | CacheComponents.VOICE_STATES
+        | CacheComponents.ME,
+    ),
+    # hikari's default cache, with every member of every guild
+    "full": GatewayProfile(
+        hikari.Intents.GUILDS
+        | hikari.Intents.GUILD_VOICE_STATES
+        | hikari.Intents.GUILD_MESSAGES
+        | hikari.Intents.GUILD_MEMBERS,
+        CacheComponents.ALL,
+    ),
+}
+
+# prefix commands need every message, and their content, to find the commands in them
+PREFIX_COMMAND_INTENTS = hikari.Intents.ALL_MESSAGES | hikari.Intents.MESSAGE_CONTENT
+
+
+def gateway_settings(
+    profile: str, prefix_commands: bool
+) -> t.Tuple[hikari.Intents, hikari.impl.CacheSettings]:
+    """Return the intents and cache settings of a profile, with or without prefix commands."""
+    if profile not in PROFILES:
+        raise ValueError(
+            f"Unknown gateway profile {profile!r}, expected one of {', '.join(PROFILES)}"
+        )
+
+    intents = PROFILES[profile].intents
+
+    if prefix_commands:
+        intents |= PREFIX_COMMAND_INTENTS
+
+    return intents, hikari.impl.CacheSettings(
+        components=PROFILES[profile].cache_components
+    )
@@ -0,0 +1,126 @@
+from __future__ import annotations
+import enum
+import logging
+import typing as t
+
+from lavalink_rs.model.events import TrackEndReason
+from lavalink_rs.model.track import TrackData
+
+from shadow_queue import ShadowQueue
+
+
+class RepeatMode(enum.Enum):
+    OFF = "off"
+    # the track that is playing starts again when it ends
+    TRACK = "track"
+    # every track goes back to the end of the queue when it starts
+    QUEUE = "queue"
+
+
+class GuildSession:
+    """The playback settings of a guild, that last until the bot leaves its channel."""
+
+    __slots__ = ["guild_id", "repeat", "repeats"]
+
+    def __init__(self, guild_id: int) -> None:
+        self.guild_id = guild_id
+        self.repeat = RepeatMode.OFF
+        # tracks queued again by the repeat mode
+        self.repeats = 0
+
+    def set_repeat(
+        self, mode: RepeatMode, queue: ShadowQueue, playing: t.Optional[TrackData]
+    ) -> bool:
+        """Change the repeat mode while `playing` is the track playing, returning if it changed."""
+        if mode is self.repeat:
+            return False
+
+        if self.repeat is RepeatMode.TRACK:
+            queue.attach()
+
+        self.repeat = mode
+
+        if playing and mode is RepeatMode.TRACK:
+            queue.detach(playing)
+        # the track that is playing already started, so it's queued now instead
+        elif playing and mode is RepeatMode.QUEUE:
+            queue.push_to_back(playing)
+            self.repeats += 1
+
+        return True
+
+    def track_started(self, queue: ShadowQueue, track: TrackData) -> None:
+        """Choose what plays after `track`, which just started, by the repeat mode.
+
+        lavalink_rs plays the front of its queue when a track ends, so the next
+        track has to be there before then, or the queue has to be empty for a
+        track that is replayed in `track_ended`.
+        """
+        if self.repeat is RepeatMode.TRACK:
+            queue.detach(track)
+        elif self.repeat is RepeatMode.QUEUE:
+            queue.push_to_back(track)
+            self.repeats += 1
+
+    async def track_ended(
+        self, queue: ShadowQueue, track: TrackData, reason: TrackEndReason
+    ) -> None:
+        """Play `track` again if it's repeated and it ended by itself."""
+        if not queue.detached:
+            return
+
+        # lavalink_rs stops the player when it finds its queue empty, asking it for
+        # something waits for that, so the stop can't come after a track played here
+        await queue.player_ctx.get_queue().get_count()
+
+        if reason == TrackEndReason.Finished:
+            try:
+                await queue.player_ctx.play_now(track)
+                self.repeats += 1
+                return
+            except Exception as e:
+                logging.error(f"Could not repeat the track in {self.guild_id}: {e}")
+                # the next track plays instead, as if it had failed to load
+                reason = TrackEndReason.LoadFailed
+
+        # lavalink_rs found its queue empty, so the next track is taken from the copy,
+        # which is still detached to not race with it
+        if reason == TrackEndReason.LoadFailed and len(queue):
+            await queue.player_ctx.play_now(queue.remove(0))
+            return
+
+        # it was stopped or replaced, the queue goes on as lavalink_rs would
+        queue.attach()
+
+
+class GuildSessions:
+    __slots__ = ["__sessions"]
+
+    def __init__(self) -> None:
+        self.__sessions: t.Dict[int, GuildSession] = {}
+
+    def stats(self) -> t.Dict[str, int]:
+        """Return the counters of the sessions."""
+        sessions = self.__sessions.values()
+
+        return {
+            "guilds": len(self.__sessions),
+            "repeat_track": sum(i.repeat is RepeatMode.TRACK for i in sessions),
+            "repeat_queue": sum(i.repeat is RepeatMode.QUEUE for i in sessions),
+            "repeats": sum(i.repeats for i in sessions),
+        }
+
+    def get(self, guild_id: int) -> GuildSession:
+        """Return the session of a guild, starting one if it has none."""
+        session = self.__sessions.get(guild_id)
+
+        if session is None:
+            session = self.__sessions[guild_id] = GuildSession(guild_id)
+
+        return session
+
+    def peek(self, guild_id: int) -> t.Optional[GuildSession]:
+        return self.__sessions.get(guild_id)
+
+    def forget(self, guild_id: int) -> None:
+        self.__sessions.pop(guild_id, None)
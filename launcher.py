@@ -0,0 +1,319 @@
+from __future__ import annotations
+import asyncio
+import logging
+import math
+import multiprocessing
+import os
+import signal
+import time
+import typing as t
+
+import aiohttp
+import hikari
+from dotenv import load_dotenv
+
+from metrics import MetricsServer, Registry, merge_metrics
+
+# Discord allows `max_concurrency` shards to identify every 5 seconds, for the whole bot
+IDENTIFY_INTERVAL = 5
+# a worker that crashes sooner than this after starting waits longer before the next try
+STABLE_AFTER = 60
+
+
+def shard_ranges(shard_count: int, workers: int) -> t.List[t.List[int]]:
+    """Split the shards in `workers` contiguous ranges, as even as possible."""
+    workers = max(1, min(workers, shard_count))
+    size, extra = divmod(shard_count, workers)
+    ranges = []
+    start = 0
+
+    for i in range(workers):
+        end = start + size + (i < extra)
+        ranges.append(list(range(start, end)))
+        start = end
+
+    return ranges
+
+
+def run_worker(shard_ids: t.List[int], shard_count: int, metrics_port: int) -> None:
+    """Run a bot with some of the shards, in a worker process."""
+    # each worker has its own metrics, which the supervisor scrapes and merges
+    os.environ["METRICS_PORT"] = str(metrics_port)
+
+    from bot import create_bot
+
+    create_bot().run(shard_ids=shard_ids, shard_count=shard_count)
+
+
+class Worker:
+    __slots__ = [
+        "index",
+        "shard_ids",
+        "metrics_port",
+        "process",
+        "started_at",
+        "restarts",
+        "restart_delay",
+    ]
+
+    def __init__(self, index: int, shard_ids: t.List[int], metrics_port: int) -> None:
+        self.index = index
+        self.shard_ids = shard_ids
+        self.metrics_port = metrics_port
+        self.process: t.Optional[multiprocessing.process.BaseProcess] = None
+        self.started_at = 0.0
+        self.restarts = 0
+        self.restart_delay = 0.0
+
+    @property
+    def alive(self) -> bool:
+        return self.process is not None and self.process.is_alive()
+
+
+class Supervisor:
+    """Runs the shards of the bot split between worker processes, restarting the ones that crash.
+
+    Every worker has its own gateway shards, Lavalink client and caches. The saved
+    queues are shared through the same SQLite files, and each worker restores only
+    the guilds of its shards, so a guild that moves to another worker when the
+    shard count changes continues there.
+    """
+
+    __slots__ = [
+        "shard_count",
+        "max_concurrency",
+        "workers",
+        "min_restart_delay",
+        "max_restart_delay",
+        "__context",
+        "__stopping",
+        "__session",
+    ]
+
+    def __init__(
+        self,
+        shard_count: int,
+        max_concurrency: int,
+        workers: int,
+        metrics_port: int,
+        min_restart_delay: float = 1,
+        max_restart_delay: float = 60,
+    ) -> None:
+        self.shard_count = shard_count
+        self.max_concurrency = max_concurrency
+        self.min_restart_delay = min_restart_delay
+        self.max_restart_delay = max_restart_delay
+        # the supervisor serves the metrics on `metrics_port`, and worker i on the next i + 1
+        self.workers = [
+            Worker(i, shard_ids, metrics_port + i + 1 if metrics_port else 0)
+            for i, shard_ids in enumerate(shard_ranges(shard_count, workers))
+        ]
+
+        # spawn, so the workers don't inherit the event loop of the supervisor
+        self.__context = multiprocessing.get_context("spawn")
+        self.__stopping = asyncio.Event()
+        self.__session: t.Optional[aiohttp.ClientSession] = None
+
+    def stats(self) -> t.Dict[str, int]:
+        """Return the counters of the supervisor."""
+        return {
+            "workers": len(self.workers),
+            "alive": sum(i.alive for i in self.workers),
+            "restarts": sum(i.restarts for i in self.workers),
+        }
+
+    def registry(self) -> Registry:
+        """Return the metrics of the supervisor itself."""
+        registry = Registry()
+        registry.gauge(
+            "jukebox_worker_up",
+            "Whether the process of a worker is running",
+            ["worker"],
+            collect=lambda: {(str(i.index),): int(i.alive) for i in self.workers},
+        )
+        registry.gauge(
+            "jukebox_worker_shards",
+            "Gateway shards run by a worker",
+            ["worker"],
+            collect=lambda: {(str(i.index),): len(i.shard_ids) for i in self.workers},
+        )
+        registry.counter(
+            "jukebox_worker_restarts_total",
+            "Times a worker was restarted after its process exited",
+            ["worker"],
+            collect=lambda: {(str(i.index),): i.restarts for i in self.workers},
+        )
+
+        return registry
+
+    async def scrape(self) -> str:
+        """Return the metrics of every running worker, with a `worker` label."""
+        if not self.__session:
+            self.__session = aiohttp.ClientSession(
+                timeout=aiohttp.ClientTimeout(total=5)
+            )
+
+        workers = [i for i in self.workers if i.metrics_port and i.alive]
+        texts = await asyncio.gather(
+            *[self.__scrape(i) for i in workers], return_exceptions=True
+        )
+        scrapes = {}
+
+        for worker, text in zip(workers, texts):
+            if isinstance(text, BaseException):
+                logging.warning(f"Could not scrape worker {worker.index}: {text}")
+            else:
+                scrapes[str(worker.index)] = text
+
+        return merge_metrics("worker", scrapes)
+
+    async def run(self, interval: float = 1) -> None:
+        """Start the workers, and restart the ones that exit until `stop` is called."""
+        for worker in self.workers:
+            self.__start(worker)
+
+            # identifying more shards at once than Discord allows fails
+            await self.__wait(
+                IDENTIFY_INTERVAL
+                * math.ceil(len(worker.shard_ids) / self.max_concurrency)
+            )
+
+        while not self.__stopping.is_set():
+            for worker in self.workers:
+                if not worker.alive and not self.__stopping.is_set():
+                    await self.__restart(worker)
+
+            await self.__wait(interval)
+
+    async def stop(self, timeout: float = 30) -> None:
+        """Ask every worker to disconnect and save its state, killing the ones that don't."""
+        self.__stopping.set()
+
+        for worker in self.workers:
+            if worker.alive:
+                assert worker.process and worker.process.pid
+                # hikari closes the bot cleanly on SIGTERM, like on Ctrl+C
+                os.kill(worker.process.pid, signal.SIGTERM)
+
+        deadline = time.monotonic() + timeout
+
+        for worker in self.workers:
+            if worker.process:
+                await asyncio.to_thread(
+                    worker.process.join, max(0, deadline - time.monotonic())
+                )
+
+                if worker.process.is_alive():
+                    logging.warning(f"Worker {worker.index} didn't stop, killing it")
+                    worker.process.kill()
+
+        if self.__session:
+            await self.__session.close()
+            self.__session = None
+
+    def __start(self, worker: Worker) -> None:
+        worker.process = self.__context.Process(
+            target=run_worker,
+            args=(worker.shard_ids, self.shard_count, worker.metrics_port),
+            name=f"worker-{worker.index}",
+        )
+        worker.process.start()
+        worker.started_at = time.monotonic()
+        logging.info(
+            f"Started worker {worker.index} with shards "
+            f"{worker.shard_ids[0]}-{worker.shard_ids[-1]} of {self.shard_count}"
+        )
+
+    async def __restart(self, worker: Worker) -> None:
+        assert worker.process
+        exitcode = worker.process.exitcode
+
+        # a worker that keeps crashing waits twice as long every time
+        if time.monotonic() - worker.started_at < STABLE_AFTER:
+            worker.restart_delay = min(
+                max(worker.restart_delay * 2, self.min_restart_delay),
+                self.max_restart_delay,
+            )
+        else:
+            worker.restart_delay = self.min_restart_delay
+
+        logging.error(
+            f"Worker {worker.index} exited with {exitcode}, "
+            f"restarting it in {worker.restart_delay:.1f}s"
+        )
+        await self.__wait(worker.restart_delay)
+
+        if not self.__stopping.is_set():
+            worker.restarts += 1
+            self.__start(worker)
+
+    async def __scrape(self, worker: Worker) -> str:
+        assert self.__session
+
+        async with self.__session.get(
+            f"http://127.0.0.1:{worker.metrics_port}/metrics"
+        ) as response:
+            response.raise_for_status()
+            return await response.text()
+
+    async def __wait(self, seconds: float) -> None:
+        try:
+            await asyncio.wait_for(self.__stopping.wait(), seconds)
+        except asyncio.TimeoutError:
+            pass
+
+
+async def gateway_info() -> hikari.GatewayBotInfo:
+    """Return the shard count Discord recommends and how many can identify at once."""
+    rest = hikari.RESTApp()
+    await rest.start()
+
+    try:
+        async with rest.acquire(os.environ["DISCORD_TOKEN"], "Bot") as client:
+            return await client.fetch_gateway_bot_info()
+    finally:
+        await rest.close()
+
+
+async def main() -> None:
+    info = await gateway_info()
+    metrics_port = int(os.environ.get("METRICS_PORT", 0))
+    supervisor = Supervisor(
+        int(os.environ.get("SHARD_COUNT", 0)) or info.shard_count,
+        info.session_start_limit.max_concurrency,
+        int(os.environ.get("WORKERS", 0)) or os.cpu_count() or 1,
+        metrics_port,
+    )
+    server = None
+
+    if metrics_port:
+        server = MetricsServer(
+            supervisor.registry(),
+            os.environ.get("METRICS_HOST", "127.0.0.1"),
+            metrics_port,
+            supervisor.scrape,
+        )
+        await server.start()
+
+    loop = asyncio.get_running_loop()
+
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, lambda: asyncio.create_task(supervisor.stop()))
+
+    try:
+        await supervisor.run()
+    finally:
+        await supervisor.stop()
+
+        if server:
+            await server.stop()
+
+        logging.info(f"Supervisor stats: {supervisor.stats()}")
+
+
+if __name__ == "__main__":
+    load_dotenv()
+    logging.basicConfig(
+        level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s"
+    )
+    asyncio.run(main())
@@ -0,0 +1,338 @@
+from __future__ import annotations
+import asyncio
+import dataclasses
+import logging
+import time
+import typing as t
+
+import hikari
+import lavalink_rs
+from lavalink_rs import GuildId, LavalinkClient, PlayerContext
+from lavalink_rs.model import events
+
+
+@dataclasses.dataclass
+class NodeConfig:
+    hostname: str
+    is_ssl: bool
+    password: str
+
+
+def parse_nodes(value: str) -> t.List[NodeConfig]:
+    """Parse `host:port|ssl|password` entries separated by commas."""
+    nodes = []
+
+    for entry in value.split(","):
+        entry = entry.strip()
+
+        if not entry:
+            continue
+
+        hostname, is_ssl, password = entry.split("|", 2)
+        nodes.append(NodeConfig(hostname, is_ssl.lower() == "true", password))
+
+    return nodes
+
+
+class NodeStatus:
+    __slots__ = [
+        "index",
+        "config",
+        "healthy",
+        "failures",
+        "session_id",
+        "players",
+        "playing_players",
+        "system_load",
+        "frames_deficit",
+        "frames_nulled",
+        "last_stats",
+    ]
+
+    def __init__(self, index: int, config: NodeConfig) -> None:
+        self.index = index
+        self.config = config
+        self.healthy = True
+        self.failures = 0
+        self.session_id: t.Optional[str] = None
+        self.players = 0
+        self.playing_players = 0
+        self.system_load = 0.0
+        self.frames_deficit = 0
+        self.frames_nulled = 0
+        # a node that never sends stats goes stale too, so it counts from its creation
+        self.last_stats = time.monotonic()
+
+    @property
+    def penalty(self) -> float:
+        """Return how loaded the node is, using the same weights as the Lavalink clients."""
+        cpu = 1.05 ** (100 * self.system_load) * 10 - 10
+        # frame stats are per minute, 3000 frames is a full minute of audio
+        deficit = 1.03 ** (500 * self.frames_deficit / 3000) * 600 - 600
+        nulled = (1.03 ** (500 * self.frames_nulled / 3000) * 600 - 600) * 2
+
+        return self.playing_players + cpu + deficit + nulled
+
+
+class NodeEvents(lavalink_rs.EventHandler):
+    """Receives the events of a single node, to keep its `NodeStatus` up to date."""
+
+    status: NodeStatus
+
+    async def ready(
+        self,
+        client: lavalink_rs.LavalinkClient,
+        session_id: str,
+        event: events.Ready,
+    ) -> None:
+        del client, event
+        self.status.session_id = session_id
+        self.status.healthy = True
+        self.status.failures = 0
+        self.status.last_stats = time.monotonic()
+
+    async def stats(
+        self,
+        client: lavalink_rs.LavalinkClient,
+        session_id: str,
+        event: events.Stats,
+    ) -> None:
+        del client, session_id
+        status = self.status
+        status.players = event.players
+        status.playing_players = event.playing_players
+        status.system_load = event.cpu.system_load
+        status.last_stats = time.monotonic()
+
+        if event.frame_stats:
+            status.frames_deficit = event.frame_stats.deficit
+            status.frames_nulled = event.frame_stats.nulled
+
+
+class LavalinkManager:
+    """Owns the only `LavalinkClient` of the process, from bot start to bot stop."""
+
+    __slots__ = [
+        "client",
+        "shards",
+        "nodes",
+        "placements",
+        "failovers",
+        "health_interval",
+        "max_failures",
+        "stats_timeout",
+        "on_player_moved",
+        "__lock",
+        "__health_task",
+    ]
+    client: t.Optional[LavalinkClient]
+
+    def __init__(
+        self, health_interval: float, max_failures: int, stats_timeout: float = 180
+    ) -> None:
+        self.client = None
+        self.shards: t.Set[int] = set()
+        self.nodes: t.List[NodeStatus] = []
+        self.placements: t.Dict[int, int] = {}
+        self.failovers = 0
+        self.health_interval = health_interval
+        self.max_failures = max_failures
+        # Lavalink sends stats every minute, without them the websocket is gone even
+        # if the REST API still answers, and its players get no more events
+        self.stats_timeout = stats_timeout
+        self.on_player_moved: t.Optional[
+            t.Callable[[int, PlayerContext], t.Awaitable[None]]
+        ] = None
+
+        self.__lock = asyncio.Lock()
+        self.__health_task: t.Optional[asyncio.Task[None]] = None
+
+    async def start(
+        self,
+        user_id: hikari.Snowflake,
+        events: lavalink_rs.EventHandler,
+        nodes: t.List[NodeConfig],
+    ) -> LavalinkClient:
+        """Connect to every Lavalink node, unless this process already did."""
+        async with self.__lock:
+            if self.client:
+                return self.client
+
+            builders = []
+
+            for idx, config in enumerate(nodes):
+                node_events = NodeEvents()
+                node_events.status = NodeStatus(idx, config)
+                self.nodes.append(node_events.status)
+
+                builders.append(
+                    lavalink_rs.NodeBuilder(
+                        config.hostname,
+                        config.is_ssl,
+                        config.password,
+                        user_id,
+                        None,
+                        node_events,
+                    )
+                )
+
+            self.client = await LavalinkClient.new(
+                events,
+                builders,
+                lavalink_rs.NodeDistributionStrategy.custom(self.__choose_node),
+            )
+            self.__health_task = asyncio.create_task(self.__health_loop())
+            logging.info(f"Lavalink client started with {len(builders)} nodes")
+
+            return self.client
+
+    def register_shard(self, shard_id: int) -> None:
+        """Record that a shard is ready to carry voice connections."""
+        self.shards.add(shard_id)
+        logging.info(f"Shard {shard_id} registered with the Lavalink client")
+
+    def unregister_shard(self, shard_id: int) -> None:
+        self.shards.discard(shard_id)
+
+    def forget_player(self, guild_id: int) -> None:
+        self.placements.pop(guild_id, None)
+
+    async def stop(self) -> None:
+        """Drop every player and the client itself."""
+        async with self.__lock:
+            if not self.client:
+                return
+
+            if self.__health_task:
+                self.__health_task.cancel()
+                self.__health_task = None
+
+            await self.client.delete_all_player_contexts()
+            self.client = None
+            self.shards.clear()
+            self.nodes.clear()
+            self.placements.clear()
+            logging.info("Lavalink client stopped")
+
+    async def __choose_node(
+        self, client: LavalinkClient, guild_id: t.Union[GuildId, int]
+    ) -> lavalink_rs.Node:
+        if isinstance(guild_id, GuildId):
+            guild_id = guild_id.inner
+
+        candidates = [i for i in self.nodes if i.healthy] or self.nodes
+        placed = [0] * len(self.nodes)
+
+        for i in self.placements.values():
+            placed[i] += 1
+
+        # stats only arrive once a minute, so players placed since then count too
+        best = min(
+            candidates,
+            key=lambda i: i.penalty
+            - i.playing_players
+            + max(i.playing_players, placed[i.index]),
+        )
+        self.placements[guild_id] = best.index
+
+        node = client.get_node_by_index(best.index)
+        assert node
+
+        return node
+
+    async def __health_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.health_interval)
+
+            for status in self.nodes:
+                await self.__check_node(status)
+
+    async def __check_node(self, status: NodeStatus) -> None:
+        assert self.client
+        node = self.client.get_node_by_index(status.index)
+
+        try:
+            assert node
+            await asyncio.wait_for(node.http.version(), self.health_interval)
+
+            stale = time.monotonic() - status.last_stats
+
+            if stale > self.stats_timeout:
+                raise TimeoutError(f"no stats for {stale:.0f}s")
+        except Exception as e:
+            status.failures += 1
+            logging.warning(
+                f"Lavalink node {status.config.hostname} failed a health check: {e}"
+            )
+        else:
+            if not status.healthy:
+                logging.info(f"Lavalink node {status.config.hostname} is back")
+
+            status.failures = 0
+            status.healthy = True
+            return
+
+        if status.healthy and status.failures >= self.max_failures:
+            status.healthy = False
+            logging.error(f"Lavalink node {status.config.hostname} is down")
+
+            if any(i.healthy for i in self.nodes):
+                await self.__failover(status.index)
+
+    async def __failover(self, index: int) -> None:
+        guilds = [k for k, v in self.placements.items() if v == index]
+
+        for guild_id in guilds:
+            try:
+                await self.__move_player(guild_id)
+            except Exception as e:
+                logging.error(f"Could not move the player of {guild_id}: {e}")
+
+    async def __move_player(self, guild_id: int) -> None:
+        assert self.client
+        old_ctx = self.client.get_player_context(guild_id)
+
+        if not old_ctx:
+            self.placements.pop(guild_id, None)
+            return
+
+        # the local state of the player is still there even if the node is not
+        player = await old_ctx.get_player()
+        queue = await old_ctx.get_queue().get_queue()
+        data = old_ctx.data
+        position = player.state.position
+
+        if player.track and not player.paused:
+            position += int(time.time() * 1000) - player.state.time
+
+        try:
+            await self.client.delete_player(guild_id)
+        except Exception:
+            # the node is gone, so it can't acknowledge the delete
+            pass
+
+        new_ctx = await self.client.create_player_context(
+            guild_id,
+            player.voice.endpoint,
+            player.voice.token,
+            player.voice.session_id,
+        )
+        new_ctx.data = data
+
+        if queue:
+            new_ctx.get_queue().replace(queue)
+
+        if player.track:
+            await new_ctx.play_now(player.track)
+            await new_ctx.set_position_ms(max(position, 0))
+
+            if player.paused:
+                await new_ctx.set_pause(True)
+
+        self.failovers += 1
+        logging.info(
+            f"Moved the player of {guild_id} to node {self.placements.get(guild_id)}"
+        )
+
+        if self.on_player_moved:
+            await self.on_player_moved(guild_id, new_ctx)
@@ -9,6 +9,8 @@ from lavalink_rs import LavalinkClient, PlayerContext
 from lavalink_rs.model.http import UpdatePlayer
 from lavalink_rs.model.player import ConnectionInfo
 
+import tracing
+
 
 class LavalinkVoice(VoiceConnection):
     __slots__ = [
@@ -106,14 +108,16 @@ class LavalinkVoice(VoiceConnection):
         player_data: t.Any,
         deaf: bool = True,
     ) -> LavalinkVoice:
-        voice: LavalinkVoice = await client.voice.connect_to(
-            guild_id,
-            channel_id,
-            voice_connection_type=LavalinkVoice,
-            lavalink_client=lavalink_client,
-            player_data=player_data,
-            deaf=deaf,
-        )
+        # waits for Discord to send the voice server, then creates the player
+        with tracing.span("voice.connect", guild_id=guild_id, channel_id=channel_id):
+            voice: LavalinkVoice = await client.voice.connect_to(
+                guild_id,
+                channel_id,
+                voice_connection_type=LavalinkVoice,
+                lavalink_client=lavalink_client,
+                player_data=player_data,
+                deaf=deaf,
+            )
 
         return voice
 
@@ -134,9 +138,10 @@ class LavalinkVoice(VoiceConnection):
         del user_id
         lavalink_client = kwargs["lavalink_client"]
 
-        player_ctx = await lavalink_client.create_player_context(
-            guild_id, endpoint, token, session_id
-        )
+        with tracing.span("lavalink.create_player", guild_id=guild_id):
+            player_ctx = await lavalink_client.create_player_context(
+                guild_id, endpoint, token, session_id
+            )
 
         player_data = kwargs["player_data"]
 
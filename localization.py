@@ -7,19 +7,69 @@ class MissingLocaleException(BaseException):
     pass
 
 
+class LocaleView:
+    """The texts of a single locale, with the fallbacks already applied."""
+
+    __slots__ = ["locale", "__texts", "__formatters"]
+
+    def __init__(self, locale: str, texts: t.Dict[str, str]) -> None:
+        self.locale = locale
+        self.__texts = texts
+        # str.format bound to each template, so formatting skips every lookup
+        self.__formatters: t.Dict[str, t.Callable[..., str]] = {
+            k: v.format for k, v in texts.items()
+        }
+
+    def get_text(self, text_id: str) -> str:
+        try:
+            return self.__texts[text_id]
+        except KeyError:
+            raise MissingLocaleException(
+                f"A text with the id {text_id} is not present in locale {self.locale}"
+            ) from None
+
+    def format(self, text_id: str, *args: t.Any) -> str:
+        try:
+            formatter = self.__formatters[text_id]
+        except KeyError:
+            raise MissingLocaleException(
+                f"A text with the id {text_id} is not present in locale {self.locale}"
+            ) from None
+
+        return formatter(*args)
+
+
 class Localizer:
-    __data: t.Dict[str, t.Dict[str, str]] = {}
-    __default: str
+    __slots__ = ["__langs", "__default", "__views"]
 
     def __init__(self, langs: t.List[str], default: str):
+        self.__langs = langs
         self.__default = default
+        self.__views: t.Dict[str, LocaleView] = {}
+
+        self.reload()
 
-        for i in langs:
+    def reload(self) -> None:
+        """Read every locale from disk again, swapping the catalog in one step."""
+        data: t.Dict[str, t.Dict[str, str]] = {}
+
+        for i in self.__langs:
             with open(f"./localization/{i}.json") as fd:
-                lang_data = t.cast(t.Dict[str, str], json.load(fd))
-                self.__data[i] = lang_data
+                data[i] = t.cast(t.Dict[str, str], json.load(fd))
+
+        if self.__default not in data:
+            raise MissingLocaleException(
+                f"The locale {self.__default} is not available."
+            )
+
+        default = data[self.__default]
+        # every locale falls back to the default one for the texts it is missing
+        views = {k: LocaleView(k, {**default, **v}) for k, v in data.items()}
 
-    def get_text(self, locale: t.Union[str, lightbulb.Context], text_id: str):
+        self.__views = views
+
+    def for_locale(self, locale: t.Union[str, lightbulb.Context]) -> LocaleView:
+        """Return the view of a locale, or of the locale of the user of a command."""
         if isinstance(locale, lightbulb.Context):
             ctx = locale
 
@@ -28,20 +78,18 @@ class Localizer:
             else:
                 locale = self.__default
 
-        texts = self.__data.get(locale)
-
-        if not texts:
-            locale = self.__default
-            texts = self.__data.get(locale)
+        views = self.__views
+        view = views.get(locale)
 
-        if not texts:
-            raise MissingLocaleException(f"The locale {locale} is not available.")
+        if not view:
+            view = views[self.__default]
 
-        text = texts.get(text_id)
+        return view
 
-        if not text:
-            raise MissingLocaleException(
-                f"A text with the id {text_id} is not present in locale {locale}"
-            )
+    def get_text(self, locale: t.Union[str, lightbulb.Context], text_id: str) -> str:
+        return self.for_locale(locale).get_text(text_id)
 
-        return text
+    def format(
+        self, locale: t.Union[str, lightbulb.Context], text_id: str, *args: t.Any
+    ) -> str:
+        return self.for_locale(locale).format(text_id, *args)
@@ -0,0 +1,282 @@
+from __future__ import annotations
+import bisect
+import logging
+import math
+import typing as t
+
+from aiohttp import web
+
+# in seconds, from a cached command to a slow yt-dlp extraction
+DEFAULT_BUCKETS = (
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+)
+
+Labels = t.Tuple[str, ...]
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    elif value == int(value):
+        return str(int(value))
+
+    return repr(value)
+
+
+def _format_labels(names: t.Sequence[str], values: t.Sequence[str]) -> str:
+    if not names:
+        return ""
+
+    escaped = (
+        str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+        for v in values
+    )
+
+    return "{" + ",".join(f'{k}="{v}"' for k, v in zip(names, escaped)) + "}"
+
+
+class Metric:
+    """A metric in the Prometheus text format, with one value per combination of labels.
+
+    A metric with `collect` reads its values from it when scraped, instead of
+    keeping them, for what other objects already count.
+    """
+
+    type = "untyped"
+
+    __slots__ = ["name", "help", "label_names", "collect", "_values"]
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        label_names: t.Sequence[str] = (),
+        collect: t.Optional[t.Callable[[], t.Dict[Labels, float]]] = None,
+    ) -> None:
+        self.name = name
+        self.help = help
+        self.label_names = tuple(label_names)
+        self.collect = collect
+        self._values: t.Dict[Labels, t.Any] = {}
+
+    def render(self) -> t.List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        values = self.collect() if self.collect else self._values
+
+        for labels, value in sorted(values.items()):
+            lines.append(
+                f"{self.name}{_format_labels(self.label_names, labels)} "
+                f"{_format_value(value)}"
+            )
+
+        return lines
+
+
+class Counter(Metric):
+    type = "counter"
+
+    __slots__: t.List[str] = []
+
+    def inc(self, *labels: str, amount: float = 1) -> None:
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+
+class Gauge(Metric):
+    type = "gauge"
+
+    __slots__: t.List[str] = []
+
+    def set(self, value: float, *labels: str) -> None:
+        self._values[labels] = value
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    __slots__ = ["buckets"]
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        label_names: t.Sequence[str] = (),
+        buckets: t.Sequence[float] = DEFAULT_BUCKETS,
+    ) -> None:
+        super().__init__(name, help, label_names)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, value: float, *labels: str) -> None:
+        # the counts are kept per bucket, and added up when rendered
+        counts, total = self._values.get(labels, (None, 0.0))
+
+        if counts is None:
+            counts = [0] * len(self.buckets)
+
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        self._values[labels] = (counts, total + value)
+
+    def render(self) -> t.List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        names = self.label_names + ("le",)
+
+        for labels, (counts, total) in sorted(self._values.items()):
+            cumulative = 0
+
+            for bucket, count in zip(self.buckets, counts):
+                cumulative += count
+                lines.append(
+                    f"{self.name}_bucket"
+                    f"{_format_labels(names, labels + (_format_value(bucket),))} "
+                    f"{cumulative}"
+                )
+
+            label_text = _format_labels(self.label_names, labels)
+            lines.append(f"{self.name}_sum{label_text} {_format_value(total)}")
+            lines.append(f"{self.name}_count{label_text} {cumulative}")
+
+        return lines
+
+
+class Registry:
+    """The metrics of the process, rendered together for a scrape."""
+
+    __slots__ = ["__metrics"]
+
+    def __init__(self) -> None:
+        self.__metrics: t.Dict[str, Metric] = {}
+
+    def register(self, metric: Metric) -> Metric:
+        if metric.name in self.__metrics:
+            raise ValueError(f"The metric {metric.name} is already registered")
+
+        self.__metrics[metric.name] = metric
+
+        return metric
+
+    def counter(self, *args: t.Any, **kwargs: t.Any) -> Counter:
+        return t.cast(Counter, self.register(Counter(*args, **kwargs)))
+
+    def gauge(self, *args: t.Any, **kwargs: t.Any) -> Gauge:
+        return t.cast(Gauge, self.register(Gauge(*args, **kwargs)))
+
+    def histogram(self, *args: t.Any, **kwargs: t.Any) -> Histogram:
+        return t.cast(Histogram, self.register(Histogram(*args, **kwargs)))
+
+    def render(self) -> str:
+        lines = []
+
+        for metric in self.__metrics.values():
+            try:
+                lines.extend(metric.render())
+            except Exception as e:
+                # one broken collector shouldn't hide the rest of the metrics
+                logging.error(f"Could not collect the metric {metric.name}: {e}")
+
+        return "\n".join(lines) + "\n"
+
+
+def merge_metrics(label: str, scrapes: t.Dict[str, str]) -> str:
+    """Merge the metrics scraped from several processes, labelling every sample with its own.
+
+    The samples of a metric have to be together, after its `# HELP` and `# TYPE`, so
+    they are grouped by metric instead of by process.
+    """
+    headers: t.Dict[str, t.List[str]] = {}
+    samples: t.Dict[str, t.List[str]] = {}
+
+    for value, text in scrapes.items():
+        added = f'{label}="{value}"'
+        name = ""
+
+        for line in text.splitlines():
+            if not line:
+                continue
+
+            if line.startswith("#"):
+                # "# HELP name ..." or "# TYPE name ..."
+                name = line.split(" ", 3)[2]
+
+                if name not in samples:
+                    headers[name] = []
+                    samples[name] = []
+
+                if len(headers[name]) < 2:
+                    headers[name].append(line)
+
+                continue
+
+            brace = line.find("{")
+            space = line.find(" ")
+
+            if brace != -1 and brace < space:
+                line = f"{line[:brace + 1]}{added},{line[brace + 1:]}"
+            else:
+                line = f"{line[:space]}{{{added}}}{line[space:]}"
+
+            samples.setdefault(name, []).append(line)
+
+    lines = []
+
+    for name, metric_samples in samples.items():
+        lines.extend(headers.get(name, []))
+        lines.extend(metric_samples)
+
+    return "\n".join(lines) + "\n"
+
+
+class MetricsServer:
+    """Serves the metrics of a registry on `/metrics`, for Prometheus to scrape.
+
+    With `scrape`, what it returns is served after the metrics of the registry.
+    """
+
+    __slots__ = ["registry", "host", "port", "scrape", "__runner"]
+
+    def __init__(
+        self,
+        registry: Registry,
+        host: str,
+        port: int,
+        scrape: t.Optional[t.Callable[[], t.Awaitable[str]]] = None,
+    ) -> None:
+        self.registry = registry
+        self.host = host
+        self.port = port
+        self.scrape = scrape
+        self.__runner: t.Optional[web.AppRunner] = None
+
+    async def start(self) -> None:
+        app = web.Application()
+        app.router.add_get("/metrics", self.__metrics)
+
+        self.__runner = web.AppRunner(app, access_log=None)
+        await self.__runner.setup()
+        await web.TCPSite(self.__runner, self.host, self.port).start()
+        logging.info(f"Serving metrics on http://{self.host}:{self.port}/metrics")
+
+    async def stop(self) -> None:
+        if self.__runner:
+            await self.__runner.cleanup()
+            self.__runner = None
+
+    async def __metrics(self, request: web.Request) -> web.Response:
+        text = self.registry.render()
+
+        if self.scrape:
+            text += await self.scrape()
+
+        return web.Response(
+            text=text,
+            headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"},
+        )
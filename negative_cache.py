@@ -0,0 +1,77 @@
+from __future__ import annotations
+import collections
+import time
+import typing as t
+
+from track_cache import normalize_query
+
+
+class NegativeCache:
+    """Remembers the queries that neither lavalink nor yt-dlp could play, for a short while.
+
+    Users tend to retry a broken link several times in a row, and every retry
+    would load it in lavalink and extract it again to fail the same way.
+    """
+
+    __slots__ = [
+        "max_entries",
+        "ttl",
+        "avoided",
+        "avoided_seconds",
+        "evictions",
+        "__entries",
+    ]
+
+    def __init__(self, max_entries: int, ttl: float) -> None:
+        self.max_entries = max_entries
+        self.ttl = ttl
+        # extractions not repeated, and what they took when they failed
+        self.avoided = 0
+        self.avoided_seconds = 0.0
+        self.evictions = 0
+
+        self.__entries: t.OrderedDict[str, t.Tuple[float, str, float]] = (
+            collections.OrderedDict()
+        )
+
+    def __len__(self) -> int:
+        return len(self.__entries)
+
+    def stats(self) -> t.Dict[str, int]:
+        """Return the counters of the cache."""
+        return {
+            "entries": len(self.__entries),
+            "avoided_extractions": self.avoided,
+            "avoided_ms": int(self.avoided_seconds * 1000),
+            "evictions": self.evictions,
+        }
+
+    def get(self, query: str) -> t.Optional[str]:
+        """Return why a query failed, if it failed recently."""
+        key = normalize_query(query)
+        entry = self.__entries.get(key)
+
+        if not entry:
+            return None
+
+        if entry[0] < time.monotonic():
+            del self.__entries[key]
+            return None
+
+        self.avoided += 1
+        self.avoided_seconds += entry[2]
+
+        return entry[1]
+
+    def put(self, query: str, reason: str, seconds: float) -> None:
+        """Remember that a query failed for `reason`, after trying for `seconds`."""
+        if self.ttl <= 0:
+            return
+
+        key = normalize_query(query)
+        self.__entries[key] = (time.monotonic() + self.ttl, reason, seconds)
+        self.__entries.move_to_end(key)
+
+        while len(self.__entries) > self.max_entries:
+            self.__entries.popitem(last=False)
+            self.evictions += 1
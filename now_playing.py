@@ -0,0 +1,188 @@
+from __future__ import annotations
+import asyncio
+import logging
+import time
+import typing as t
+
+import hikari
+
+
+class NowPlayingState:
+    __slots__ = [
+        "rest",
+        "channel_id",
+        "pending",
+        "content",
+        "message_id",
+        "message_channel_id",
+        "distance",
+        "last_sent",
+        "task",
+    ]
+
+    def __init__(self, rest: hikari.api.RESTClient, channel_id: int) -> None:
+        self.rest = rest
+        self.channel_id = channel_id
+        self.pending: t.Optional[str] = None
+        self.content: t.Optional[str] = None
+        self.message_id: t.Optional[int] = None
+        self.message_channel_id: t.Optional[int] = None
+        # how many messages were sent to the channel after ours
+        self.distance = 0
+        self.last_sent = 0.0
+        self.task: t.Optional[asyncio.Task[None]] = None
+
+
+class NowPlaying:
+    """Keeps a single "now playing" message per guild, editing it as tracks change."""
+
+    __slots__ = [
+        "min_interval",
+        "max_distance",
+        "updates",
+        "coalesced",
+        "unchanged",
+        "edited",
+        "created",
+        "rest_calls",
+        "__guilds",
+    ]
+
+    def __init__(self, min_interval: float, max_distance: int) -> None:
+        self.min_interval = min_interval
+        self.max_distance = max_distance
+        self.updates = 0
+        self.coalesced = 0
+        self.unchanged = 0
+        self.edited = 0
+        self.created = 0
+        # every Discord REST call made for the messages, by method, even the failed ones
+        self.rest_calls = {"create_message": 0, "edit_message": 0, "delete_message": 0}
+
+        self.__guilds: t.Dict[int, NowPlayingState] = {}
+
+    def stats(self) -> t.Dict[str, int]:
+        """Return the counters of the manager."""
+        return {
+            "guilds": len(self.__guilds),
+            "updates": self.updates,
+            "coalesced": self.coalesced,
+            "unchanged": self.unchanged,
+            "edited": self.edited,
+            "created": self.created,
+            "rest_calls": sum(self.rest_calls.values()),
+        }
+
+    def update(
+        self,
+        rest: hikari.api.RESTClient,
+        guild_id: int,
+        channel_id: int,
+        content: str,
+    ) -> None:
+        """Show `content` as the message of a guild, as soon as the rate allows."""
+        state = self.__guilds.get(guild_id)
+
+        if not state:
+            state = self.__guilds[guild_id] = NowPlayingState(rest, channel_id)
+
+        self.updates += 1
+
+        # only the newest content of a burst is sent
+        if state.pending is not None:
+            self.coalesced += 1
+
+        state.rest = rest
+        state.channel_id = channel_id
+        state.pending = content
+
+        if not state.task:
+            state.task = asyncio.create_task(self.__flush(state))
+
+    def message_created(self, guild_id: int, channel_id: int, message_id: int) -> None:
+        """Count a message sent to a guild, to know when ours scrolled out of view."""
+        state = self.__guilds.get(guild_id)
+
+        if (
+            state
+            and state.message_channel_id == channel_id
+            and state.message_id != message_id
+        ):
+            state.distance += 1
+
+    def message_deleted(self, guild_id: int, message_id: int) -> None:
+        state = self.__guilds.get(guild_id)
+
+        if state and state.message_id == message_id:
+            state.message_id = None
+
+    def forget(self, guild_id: int) -> None:
+        """Stop tracking the message of a guild that stopped playing."""
+        state = self.__guilds.pop(guild_id, None)
+
+        if state and state.task:
+            state.task.cancel()
+
+    async def __flush(self, state: NowPlayingState) -> None:
+        try:
+            while state.pending is not None:
+                delay = state.last_sent + self.min_interval - time.monotonic()
+
+                if delay > 0:
+                    await asyncio.sleep(delay)
+
+                content = state.pending
+                state.pending = None
+
+                try:
+                    await self.__send(state, content)
+                except Exception as e:
+                    logging.error(f"Could not update the now playing message: {e}")
+
+                state.last_sent = time.monotonic()
+        finally:
+            state.task = None
+
+    async def __send(self, state: NowPlayingState, content: str) -> None:
+        visible = (
+            state.message_id is not None
+            and state.message_channel_id == state.channel_id
+            and state.distance < self.max_distance
+        )
+
+        if visible and state.content == content:
+            # a looping track starts again with the exact same message
+            self.unchanged += 1
+            return
+
+        if visible:
+            assert state.message_id
+            self.rest_calls["edit_message"] += 1
+            try:
+                await state.rest.edit_message(
+                    state.channel_id, state.message_id, content
+                )
+            except hikari.NotFoundError:
+                pass
+            else:
+                state.content = content
+                self.edited += 1
+                return
+        elif state.message_id and state.message_channel_id:
+            # nobody would scroll up to see it, so it is replaced by a new one
+            self.rest_calls["delete_message"] += 1
+            try:
+                await state.rest.delete_message(
+                    state.message_channel_id, state.message_id
+                )
+            except hikari.HTTPError:
+                pass
+
+        self.rest_calls["create_message"] += 1
+        message = await state.rest.create_message(state.channel_id, content)
+
+        state.message_id = message.id
+        state.message_channel_id = state.channel_id
+        state.content = content
+        state.distance = 0
+        self.created += 1
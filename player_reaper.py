@@ -0,0 +1,153 @@
+from __future__ import annotations
+import asyncio
+import logging
+import time
+import typing as t
+
+import hikari
+from lavalink_rs import LavalinkClient
+
+
+def count_listeners(
+    cache: hikari.api.Cache, guild_id: int, channel_id: t.Optional[int]
+) -> int:
+    """Return how many users that are not bots are in a voice channel."""
+    if not channel_id:
+        return 0
+
+    states = cache.get_voice_states_view_for_channel(guild_id, channel_id)
+
+    return sum(1 for i in states.values() if i.member and not i.member.is_bot)
+
+
+class PlayerReaper:
+    """Disconnects the players nobody is listening to.
+
+    A player is reaped after `alone_timeout` seconds without anyone else in its
+    voice channel, or after `idle_timeout` seconds without activity and without
+    a track playing. A timeout of 0 disables that check.
+    """
+
+    __slots__ = [
+        "idle_timeout",
+        "alone_timeout",
+        "reaped",
+        "failures",
+        "on_reap",
+        "__last_active",
+        "__alone_since",
+        "__task",
+    ]
+
+    def __init__(self, idle_timeout: float, alone_timeout: float) -> None:
+        self.idle_timeout = idle_timeout
+        self.alone_timeout = alone_timeout
+        self.reaped = {"idle": 0, "alone": 0}
+        self.failures = 0
+        # receives the guild and the reason ("idle" or "alone"), and disconnects it
+        self.on_reap: t.Optional[t.Callable[[int, str], t.Awaitable[None]]] = None
+
+        self.__last_active: t.Dict[int, float] = {}
+        self.__alone_since: t.Dict[int, float] = {}
+        self.__task: t.Optional[asyncio.Task[None]] = None
+
+    def stats(self) -> t.Dict[str, int]:
+        """Return the counters of the reaper."""
+        return {
+            "players": len(self.__last_active),
+            "alone": len(self.__alone_since),
+            "reaped_idle": self.reaped["idle"],
+            "reaped_alone": self.reaped["alone"],
+            "failures": self.failures,
+        }
+
+    def joined(self, guild_id: int, alone: bool) -> None:
+        """Start watching a player that just connected."""
+        self.__last_active[guild_id] = time.monotonic()
+        self.__alone_since.pop(guild_id, None)
+        self.alone(guild_id, alone)
+
+    def touch(self, guild_id: int) -> None:
+        """Mark a watched player as in use, restarting its idle timeout."""
+        if guild_id in self.__last_active:
+            self.__last_active[guild_id] = time.monotonic()
+
+    def alone(self, guild_id: int, alone: bool) -> None:
+        """Tell whether a watched player has anyone to play for."""
+        if guild_id not in self.__last_active:
+            return
+
+        if not alone:
+            self.__alone_since.pop(guild_id, None)
+        elif guild_id not in self.__alone_since:
+            self.__alone_since[guild_id] = time.monotonic()
+
+    def forget(self, guild_id: int) -> None:
+        self.__last_active.pop(guild_id, None)
+        self.__alone_since.pop(guild_id, None)
+
+    def start(self, interval: float, lavalink: LavalinkClient) -> None:
+        """Start looking for players to reap in the background."""
+        if not self.__task:
+            self.__task = asyncio.create_task(self.__reap_loop(interval, lavalink))
+
+    def stop(self) -> None:
+        if self.__task:
+            self.__task.cancel()
+            self.__task = None
+
+    async def reap(self, lavalink: LavalinkClient) -> None:
+        """Reap every player that has been alone or idle for too long."""
+        now = time.monotonic()
+
+        for guild_id, last_active in list(self.__last_active.items()):
+            alone_since = self.__alone_since.get(guild_id)
+
+            if (
+                self.alone_timeout
+                and alone_since is not None
+                and alone_since + self.alone_timeout < now
+            ):
+                await self.__reap(guild_id, "alone")
+                continue
+
+            if not self.idle_timeout or last_active + self.idle_timeout > now:
+                continue
+
+            # a long track doesn't count as activity until it ends, so it's checked here
+            player_ctx = lavalink.get_player_context(guild_id)
+
+            if player_ctx:
+                try:
+                    player = await player_ctx.get_player()
+                except Exception as e:
+                    logging.warning(f"Could not check if {guild_id} is idle: {e}")
+                    continue
+
+                if player.track and not player.paused:
+                    self.touch(guild_id)
+                    continue
+
+            await self.__reap(guild_id, "idle")
+
+    async def __reap(self, guild_id: int, reason: str) -> None:
+        self.forget(guild_id)
+
+        if not self.on_reap:
+            return
+
+        try:
+            await self.on_reap(guild_id, reason)
+        except Exception as e:
+            self.failures += 1
+            logging.error(
+                f"Could not disconnect the {reason} player of {guild_id}: {e}"
+            )
+            return
+
+        self.reaped[reason] += 1
+
+    async def __reap_loop(self, interval: float, lavalink: LavalinkClient) -> None:
+        while True:
+            await asyncio.sleep(interval)
+            await self.reap(lavalink)
@@ -0,0 +1,164 @@
+from __future__ import annotations
+import asyncio
+import logging
+import time
+import typing as t
+
+import lightbulb
+from lavalink_rs.model.track import TrackData
+
+from localization import LocaleView
+from shadow_queue import ShadowQueue
+
+
+class PlaylistIngest:
+    __slots__ = ["name", "total", "added", "truncated"]
+
+    def __init__(self, name: str, total: int) -> None:
+        self.name = name
+        self.total = total
+        self.added = 0
+        self.truncated = False
+
+
+class PlaylistIngester:
+    """Adds the tracks of big playlists to a queue in chunks, in the background."""
+
+    __slots__ = [
+        "chunk_size",
+        "max_queue",
+        "progress_interval",
+        "ingested",
+        "truncated",
+        "__tasks",
+    ]
+
+    def __init__(
+        self, chunk_size: int, max_queue: int, progress_interval: float
+    ) -> None:
+        self.chunk_size = chunk_size
+        self.max_queue = max_queue
+        self.progress_interval = progress_interval
+        self.ingested = 0
+        self.truncated = 0
+
+        self.__tasks: t.Dict[int, t.Set[asyncio.Task[None]]] = {}
+
+    def stats(self) -> t.Dict[str, int]:
+        """Return the counters of the ingester."""
+        return {
+            "running": sum(len(i) for i in self.__tasks.values()),
+            "ingested": self.ingested,
+            "truncated": self.truncated,
+        }
+
+    async def ingest(
+        self,
+        ctx: lightbulb.Context,
+        queue: ShadowQueue,
+        name: str,
+        tracks: t.Sequence[TrackData],
+    ) -> PlaylistIngest:
+        """Queue the first track right away and reply, then queue the rest in the background."""
+        assert ctx.guild_id
+        ingest = PlaylistIngest(name, len(tracks))
+        locale = ctx.bot.d.localizer.for_locale(ctx)
+        requester_id = int(ctx.author.id)
+
+        if tracks and len(queue) < self.max_queue:
+            tracks[0].user_data = {"requester_id": requester_id}
+            queue.push_to_back(tracks[0])
+            ingest.added = 1
+        elif tracks:
+            ingest.truncated = True
+
+        response = await ctx.respond(self.progress_text(ingest, locale))
+
+        if ingest.truncated or ingest.added == ingest.total:
+            self.__finished(ingest)
+            return ingest
+
+        task = asyncio.create_task(
+            self.__ingest(queue, ingest, tracks, requester_id, locale, response)
+        )
+        tasks = self.__tasks.setdefault(ctx.guild_id, set())
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+
+        return ingest
+
+    def forget(self, guild_id: int) -> None:
+        """Stop adding playlists to the queue of a guild that stopped playing."""
+        for task in self.__tasks.pop(guild_id, ()):
+            task.cancel()
+
+    def progress_text(self, ingest: PlaylistIngest, locale: LocaleView) -> str:
+        if ingest.truncated:
+            return locale.format(
+                "cmd.play.playlist_truncated.response",
+                ingest.name,
+                ingest.added,
+                self.max_queue,
+            )
+        elif ingest.added < ingest.total:
+            return locale.format(
+                "cmd.play.playlist_progress.response",
+                ingest.name,
+                ingest.added,
+                ingest.total,
+            )
+
+        return locale.format("cmd.play.added_playlist_to_queue.response", ingest.name)
+
+    async def __ingest(
+        self,
+        queue: ShadowQueue,
+        ingest: PlaylistIngest,
+        tracks: t.Sequence[TrackData],
+        requester_id: int,
+        locale: LocaleView,
+        response: lightbulb.ResponseProxy,
+    ) -> None:
+        last_progress = time.monotonic()
+
+        while ingest.added < ingest.total:
+            room = self.max_queue - len(queue)
+
+            if room <= 0:
+                ingest.truncated = True
+                break
+
+            chunk = tracks[ingest.added : ingest.added + min(self.chunk_size, room)]
+
+            for i in chunk:
+                i.user_data = {"requester_id": requester_id}
+
+            queue.append(list(chunk))
+            ingest.added += len(chunk)
+
+            if time.monotonic() - last_progress >= self.progress_interval:
+                last_progress = time.monotonic()
+                await self.__progress(ingest, locale, response)
+
+            # lets the other guilds run between chunks
+            await asyncio.sleep(0)
+
+        self.__finished(ingest)
+        await self.__progress(ingest, locale, response)
+
+    async def __progress(
+        self,
+        ingest: PlaylistIngest,
+        locale: LocaleView,
+        response: lightbulb.ResponseProxy,
+    ) -> None:
+        try:
+            await response.edit(self.progress_text(ingest, locale))
+        except Exception as e:
+            logging.warning(f"Could not update the progress of {ingest.name}: {e}")
+
+    def __finished(self, ingest: PlaylistIngest) -> None:
+        self.ingested += ingest.added
+
+        if ingest.truncated:
+            self.truncated += 1
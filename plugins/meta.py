@@ -1,15 +1,30 @@
+import logging
+import os
+
 import hikari
 import lightbulb
 from lightbulb import Plugin
 
 import localization
+from track_info import TrackInfoRenderer
 
 plugin = lightbulb.Plugin("Meta Plugin")
 
 
-@plugin.listener(hikari.ShardReadyEvent, bind=True)
-async def start(plug: Plugin, event: hikari.ShardReadyEvent) -> None:
+# StartingEvent solo pasa una vez por proceso, al contrario que ShardReadyEvent,
+# que se repite por cada shard y cada reconexión
+@plugin.listener(hikari.StartingEvent, bind=True)
+async def start(plug: Plugin, event: hikari.StartingEvent) -> None:
     plug.bot.d.localizer = localization.Localizer(["en-US", "es-ES"], "en-US")
+    # la información de cada canción se genera una vez por idioma, no en cada mensaje
+    plug.bot.d.track_info = TrackInfoRenderer(
+        plug.bot.d.localizer, int(os.environ.get("TRACK_INFO_CACHE_SIZE", 4096))
+    )
+
+
+@plugin.listener(hikari.StoppedEvent, bind=True)
+async def stop(plug: Plugin, event: hikari.StoppedEvent) -> None:
+    logging.info(f"Track info stats: {plug.bot.d.track_info.stats()}")
 
 
 # Register the command to the bot
@@ -25,6 +40,19 @@ async def ping(ctx: lightbulb.Context) -> None:
     await ctx.respond(ctx.bot.d.localizer.get_text(ctx, "cmd.ping.response"))
 
 
+@plugin.command()
+@lightbulb.add_checks(lightbulb.owner_only)
+@lightbulb.command("reload_localization", "Reloads the localization files")
+@lightbulb.implements(lightbulb.PrefixCommand, lightbulb.SlashCommand)
+async def reload_localization(ctx: lightbulb.Context) -> None:
+    # se vuelven a leer los ficheros sin reiniciar el bot
+    ctx.bot.d.localizer.reload()
+    ctx.bot.d.track_info.clear()
+    await ctx.respond(
+        ctx.bot.d.localizer.get_text(ctx, "cmd.reload_localization.response")
+    )
+
+
 @plugin.command()
 @lightbulb.option(
     "text", "Text to repeat", modifier=lightbulb.OptionModifier.CONSUME_REST
@@ -0,0 +1,256 @@
+import logging
+import os
+import time
+import typing as t
+
+import hikari
+import lightbulb
+from hikari import GatewayBot
+from lightbulb import Plugin
+
+from lavalink_voice import LavalinkVoice
+from metrics import MetricsServer, Registry
+from tracing import FileExporter, Tracer, ZipkinExporter
+
+plugin = Plugin("Monitoring")
+
+# las extracciones de yt-dlp tardan mucho más que el resto
+EXTRACTION_BUCKETS = (0.5, 1.0, 2.0, 5.0, 10.0, 20.0, 30.0, 60.0)
+
+
+class BotMetrics:
+    """The metrics of the bot, most of them read from the stats of its parts when scraped."""
+
+    __slots__ = [
+        "registry",
+        "commands",
+        "load_tracks",
+        "load_streams",
+        "extractions",
+        "extraction_failures",
+        "started",
+    ]
+
+    def __init__(self, bot: lightbulb.BotApp) -> None:
+        self.registry = registry = Registry()
+        self.commands = registry.histogram(
+            "jukebox_command_duration_seconds",
+            "Time from the invocation of a command until it finished",
+            ["command", "outcome"],
+        )
+        self.load_tracks = registry.histogram(
+            "jukebox_load_tracks_duration_seconds",
+            "Time of the load_tracks calls to Lavalink that missed the track cache",
+            ["load_type"],
+        )
+        self.load_streams = registry.histogram(
+            "jukebox_load_stream_duration_seconds",
+            "Time of the load_tracks calls to Lavalink for the streams yt-dlp extracted",
+            ["outcome"],
+        )
+        self.extractions = registry.histogram(
+            "jukebox_ytdl_extraction_duration_seconds",
+            "Time of the yt-dlp extractions",
+            ["outcome"],
+            buckets=EXTRACTION_BUCKETS,
+        )
+        self.extraction_failures = registry.counter(
+            "jukebox_ytdl_extraction_failures_total",
+            "yt-dlp extractions that failed or timed out",
+            ["reason"],
+        )
+        registry.gauge(
+            "jukebox_active_players",
+            "Voice connections with a Lavalink player",
+            collect=lambda: {
+                (): sum(
+                    isinstance(i, LavalinkVoice) for i in bot.voice.connections.values()
+                )
+            },
+        )
+        registry.gauge(
+            "jukebox_queued_tracks",
+            "Tracks waiting in the queues of every guild",
+            collect=lambda: {(): bot.d.queues.stats()["tracks"]},
+        )
+        registry.gauge(
+            "jukebox_queue_length_max",
+            "Tracks waiting in the longest queue",
+            collect=lambda: {(): bot.d.queues.stats()["longest"]},
+        )
+        registry.gauge(
+            "jukebox_lavalink_node_healthy",
+            "1 while a Lavalink node passes its health checks, 0 once it is down",
+            ["node"],
+            collect=lambda: {
+                (i.config.hostname,): int(i.healthy)
+                for i in bot.d.lavalink_manager.nodes
+            },
+        )
+        registry.counter(
+            "jukebox_lavalink_failovers_total",
+            "Players moved to another Lavalink node when theirs went down",
+            collect=lambda: {(): bot.d.lavalink_manager.failovers},
+        )
+        registry.counter(
+            "jukebox_track_start_rest_calls_total",
+            "Discord REST calls made to show the track that started playing",
+            ["method"],
+            collect=lambda: {(k,): v for k, v in bot.d.now_playing.rest_calls.items()},
+        )
+        registry.gauge(
+            "jukebox_component_stat",
+            "The counters every cache and pool logs when the bot stops",
+            ["component", "stat"],
+            collect=lambda: component_stats(bot),
+        )
+
+        # el momento en que empezó cada comando que se está ejecutando, por contexto
+        self.started: t.Dict[int, float] = {}
+
+    def loaded(self, load_type: str, seconds: float) -> None:
+        self.load_tracks.observe(seconds, load_type)
+
+    def loaded_stream(self, outcome: str, seconds: float) -> None:
+        self.load_streams.observe(seconds, outcome)
+
+    def extracted(self, outcome: str, seconds: float) -> None:
+        self.extractions.observe(seconds, outcome)
+
+        if outcome != "ok":
+            self.extraction_failures.inc(outcome)
+
+    def command_finished(self, ctx: lightbulb.Context, outcome: str) -> None:
+        start = self.started.pop(id(ctx), None)
+
+        if start is not None and ctx.command:
+            self.commands.observe(
+                time.perf_counter() - start, ctx.command.qualname, outcome
+            )
+
+
+def component_stats(bot: lightbulb.BotApp) -> t.Dict[t.Tuple[str, ...], float]:
+    values = {}
+
+    for component in [
+        "track_cache",
+        "track_index",
+        "track_info",
+        "prefetcher",
+        "queue_pages",
+        "queues",
+        "sessions",
+        "queue_store",
+        "reaper",
+        "now_playing",
+        "playlists",
+        "router",
+        "negative_cache",
+        "ytdl_pool",
+        "stream_cache",
+        "format_policy",
+        "tracer",
+    ]:
+        if component in bot.d:
+            for stat, value in bot.d[component].stats().items():
+                values[(component, stat)] = value
+
+    return values
+
+
+@plugin.listener(hikari.StartingEvent, bind=True)
+async def start_metrics(plug: Plugin, event: hikari.StartingEvent) -> None:
+    """Event that triggers before the bot connects to the gateway."""
+
+    plug.bot.d.metrics = BotMetrics(plug.bot)
+
+
+@plugin.listener(hikari.StartedEvent, bind=True)
+async def serve_metrics(plug: Plugin, event: hikari.StartedEvent) -> None:
+    """Event that triggers once the bot is connected to the gateway."""
+
+    bot = plug.bot
+    metrics = bot.d.metrics
+
+    # el resto de plugins ya han creado sus caches en el StartingEvent
+    bot.d.track_cache.on_load = metrics.loaded
+    bot.d.stream_cache.on_load = metrics.loaded_stream
+    bot.d.ytdl_pool.on_extracted = metrics.extracted
+
+    # sin puerto, las métricas se recogen igualmente pero no se sirven
+    port = int(os.environ.get("METRICS_PORT", 0))
+
+    if port:
+        bot.d.metrics_server = MetricsServer(
+            metrics.registry, os.environ.get("METRICS_HOST", "127.0.0.1"), port
+        )
+        await bot.d.metrics_server.start()
+
+
+@plugin.listener(hikari.StoppedEvent, bind=True)
+async def stop_metrics(plug: Plugin, event: hikari.StoppedEvent) -> None:
+    """Event that triggers when the bot has disconnected from the gateway."""
+
+    if "metrics_server" in plug.bot.d:
+        await plug.bot.d.metrics_server.stop()
+
+
+@plugin.listener(hikari.StartingEvent, bind=True)
+async def start_tracing(plug: Plugin, event: hikari.StartingEvent) -> None:
+    """Event that triggers before the bot connects to the gateway."""
+
+    # las trazas se mandan a un colector de Zipkin, o se guardan en un fichero si no hay
+    exporter: t.Optional[t.Union[FileExporter, ZipkinExporter]] = None
+
+    if os.environ.get("TRACING_ZIPKIN_URL"):
+        exporter = ZipkinExporter(os.environ["TRACING_ZIPKIN_URL"])
+    elif os.environ.get("TRACING_PATH"):
+        exporter = FileExporter(os.environ["TRACING_PATH"])
+
+    plug.bot.d.tracer = Tracer(
+        os.environ.get("TRACING_SERVICE", "jukebox"),
+        float(os.environ.get("TRACING_SAMPLE_RATE", 0)),
+        exporter,
+    )
+    plug.bot.d.tracer.start(float(os.environ.get("TRACING_FLUSH_INTERVAL", 5)))
+
+
+@plugin.listener(hikari.StoppedEvent, bind=True)
+async def stop_tracing(plug: Plugin, event: hikari.StoppedEvent) -> None:
+    """Event that triggers when the bot has disconnected from the gateway."""
+
+    logging.info(f"Tracing stats: {plug.bot.d.tracer.stats()}")
+    await plug.bot.d.tracer.stop()
+
+
+@plugin.listener(lightbulb.CommandInvocationEvent, bind=True)
+async def command_invoked(
+    plug: Plugin, event: lightbulb.CommandInvocationEvent
+) -> None:
+    """Event that triggers before a command is run."""
+
+    plug.bot.d.metrics.started[id(event.context)] = time.perf_counter()
+
+
+@plugin.listener(lightbulb.CommandCompletionEvent, bind=True)
+async def command_completed(
+    plug: Plugin, event: lightbulb.CommandCompletionEvent
+) -> None:
+    """Event that triggers after a command finished without errors."""
+
+    plug.bot.d.metrics.command_finished(event.context, "ok")
+
+
+@plugin.listener(lightbulb.CommandErrorEvent, bind=True)
+async def command_failed(plug: Plugin, event: lightbulb.CommandErrorEvent) -> None:
+    """Event that triggers when a command raised an error."""
+
+    plug.bot.d.metrics.command_finished(event.context, "error")
+    # con un listener de este evento lightbulb da el error por tratado y ya no lo
+    # lanza, así que se registra aquí como lo registraba hikari
+    command = event.context.command.qualname if event.context.command else None
+    logging.error(f"Error in the command {command}", exc_info=event.exception)
+
+
+def load(bot: GatewayBot) -> None:
+    bot.add_plugin(plugin)
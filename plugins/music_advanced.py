@@ -1,8 +1,12 @@
 import hikari
 
+from guild_session import RepeatMode
 from lavalink_voice import LavalinkVoice
+from localization import LocaleView
+from queue_pages import QueuePage
+from track_info import track_fields
 
-import random
+import typing as t
 
 import lightbulb
 from hikari import GatewayBot
@@ -42,31 +46,18 @@ async def pause(ctx: Context) -> None:
     # este if mira si hay una canción reproduciendose ahora mismo
     if player.track:
         # este if mira si hay una uri
-        if player.track.info.uri:
-            await ctx.respond(
-                ctx.bot.d.localizer.get_text(ctx, "cmd.pause.paused.response").format(
-                    ctx.bot.d.localizer.get_text(ctx, "generic.track_info_url").format(
-                        player.track.info.author,
-                        player.track.info.title,
-                        player.track.info.uri,
-                        player.track.user_data["requester_id"],
-                    )
-                )
-            )
-        else:
-            await ctx.respond(
-                ctx.bot.d.localizer.get_text(ctx, "cmd.pause.paused.response").format(
-                    ctx.bot.d.localizer.get_text(
-                        ctx, "generic.track_info_no_url"
-                    ).format(
-                        player.track.info.author,
-                        player.track.info.title,
-                        player.track.user_data["requester_id"],
-                    )
-                )
+        await ctx.respond(
+            ctx.bot.d.localizer.format(
+                ctx,
+                "cmd.pause.paused.response",
+                ctx.bot.d.track_info.render(ctx, player.track),
             )
+        )
         # este await pausa la cancion
         await voice.player_ctx.set_pause(True)
+        ctx.bot.d.queue_store.record(
+            ctx.guild_id, "position", player.state.position, True
+        )
     else:
         await ctx.respond(
             ctx.bot.d.localizer.get_text(ctx, "cmd.pause.nothing_pause.response")
@@ -103,31 +94,18 @@ async def resume(ctx: Context) -> None:
     # player.track es la canción que está en el reproductor (el if mira si hay una canción en el reproductor)
     if player.track:
         # este if mira si la canción tiene un url, si lo tiene saldrá en el mensaje del bot
-        if player.track.info.uri:
-            await ctx.respond(
-                ctx.bot.d.localizer.get_text(ctx, "cmd.resume.resumed.response").format(
-                    ctx.bot.d.localizer.get_text(ctx, "generic.track_info_url").format(
-                        player.track.info.author,
-                        player.track.info.title,
-                        player.track.info.uri,
-                        player.track.user_data["requester_id"],
-                    )
-                )
-            )
-        else:
-            await ctx.respond(
-                ctx.bot.d.localizer.get_text(ctx, "cmd.resume.resumed.response").format(
-                    ctx.bot.d.localizer.get_text(
-                        ctx, "generic.track_info_no_url"
-                    ).format(
-                        player.track.info.author,
-                        player.track.info.title,
-                        player.track.user_data["requester_id"],
-                    )
-                )
+        await ctx.respond(
+            ctx.bot.d.localizer.format(
+                ctx,
+                "cmd.resume.resumed.response",
+                ctx.bot.d.track_info.render(ctx, player.track),
             )
+        )
         # el bot continua la canción
         await voice.player_ctx.set_pause(False)
+        ctx.bot.d.queue_store.record(
+            ctx.guild_id, "position", player.state.position, False
+        )
     else:
         # el reproductor no tiene nignuna canción asi que no hay nada que continuar
         await ctx.respond(
@@ -174,31 +152,18 @@ async def seek(ctx: Context) -> None:
     # player.track es la canción que está en el reproductor (el if mira si hay una canción en el reproductor)
     if player.track:
         # este if mira si la canción tiene un url, si lo tiene saldrá en el mensaje del bot
-        if player.track.info.uri:
-            await ctx.respond(
-                ctx.bot.d.localizer.get_text(ctx, "cmd.seek.seeked.response").format(
-                    ctx.bot.d.localizer.get_text(ctx, "generic.track_info_url").format(
-                        player.track.info.author,
-                        player.track.info.title,
-                        player.track.info.uri,
-                        player.track.user_data["requester_id"],
-                    )
-                )
-            )
-        else:
-            await ctx.respond(
-                ctx.bot.d.localizer.get_text(ctx, "cmd.seek.seeked.response").format(
-                    ctx.bot.d.localizer.get_text(
-                        ctx, "generic.track_info_no_url"
-                    ).format(
-                        player.track.info.author,
-                        player.track.info.title,
-                        player.track.user_data["requester_id"],
-                    )
-                )
+        await ctx.respond(
+            ctx.bot.d.localizer.format(
+                ctx,
+                "cmd.seek.seeked.response",
+                ctx.bot.d.track_info.render(ctx, player.track),
             )
+        )
         # el bot continua la canción en los segundos indicados multiplicados por 1000 (milisegundos)
         await voice.player_ctx.set_position_ms(ctx.options.seconds * 1000)
+        ctx.bot.d.queue_store.record(
+            ctx.guild_id, "position", ctx.options.seconds * 1000, player.paused
+        )
     else:
         # si no hay ninguna canción en el reproductor pone este mensaje
         await ctx.respond(
@@ -207,6 +172,18 @@ async def seek(ctx: Context) -> None:
 
 
 @plugin.command()
+@lightbulb.option(
+    "page",
+    "The page of the queue to show",
+    int,
+    required=False,
+    default=1,
+    min_value=1,
+    name_localizations={hikari.Locale.ES_ES: "pagina"},
+    description_localizations={
+        hikari.Locale.ES_ES: "La página de la cola que quieres ver"
+    },
+)
 @lightbulb.command(
     "queue",
     "List the current queue",
@@ -230,9 +207,53 @@ async def queue(ctx: Context) -> None:
 
     assert isinstance(voice, LavalinkVoice)
 
+    # los comandos de prefijo no comprueban el valor mínimo de la página
+    page = max(1, ctx.options.page or 1)
+    content, row = await render_queue(
+        ctx.bot, ctx.bot.d.localizer.for_locale(ctx), voice, page
+    )
+
+    await ctx.respond(content, component=row or hikari.UNDEFINED)
+
+
+@plugin.listener(hikari.InteractionCreateEvent, bind=True)
+async def queue_page(plug: Plugin, event: hikari.InteractionCreateEvent) -> None:
+    """Event that triggers when a button of the queue is pressed."""
+
+    interaction = event.interaction
+
+    if not isinstance(
+        interaction, hikari.ComponentInteraction
+    ) or not interaction.custom_id.startswith("queue:"):
+        return None
+
+    locale = plug.bot.d.localizer.for_locale(interaction.locale)
+    voice = plug.bot.voice.connections.get(interaction.guild_id)
+
+    if not isinstance(voice, LavalinkVoice):
+        await interaction.create_initial_response(
+            hikari.ResponseType.MESSAGE_UPDATE,
+            locale.get_text("cmd.error.no_voice.response"),
+            component=None,
+        )
+        return None
+
+    # el custom_id de los botones es "queue:<pagina>"
+    content, row = await render_queue(
+        plug.bot, locale, voice, int(interaction.custom_id.split(":")[1])
+    )
+
+    await interaction.create_initial_response(
+        hikari.ResponseType.MESSAGE_UPDATE, content, component=row
+    )
+
+
+async def render_queue(
+    bot: lightbulb.BotApp, locale: LocaleView, voice: LavalinkVoice, page: int
+) -> t.Tuple[str, t.Optional[hikari.api.MessageActionRowBuilder]]:
     player = await voice.player_ctx.get_player()
 
-    now_playing = ctx.bot.d.localizer.get_text(ctx, "cmd.queue.now_playing.response")
+    now_playing = locale.get_text("cmd.queue.now_playing.response")
 
     if player.track:
         # este es el tiempo de la canción en segundos (dentro del minuto)
@@ -249,76 +270,97 @@ async def queue(ctx: Context) -> None:
         else:
             time = f"{time_m:02}:{time_s:02}"
 
-        if player.track.user_data.get("title"):
-            title = player.track.user_data["title"]
-            author = player.track.user_data["author"]
-            uri = player.track.user_data["uri"]
-        else:
-            title = player.track.info.title
-            author = player.track.info.author
-            uri = player.track.info.uri
+        author, title, uri, requester_id = track_fields(player.track)
 
         if uri:
-            now_playing = ctx.bot.d.localizer.get_text(
-                ctx, "cmd.queue.now_playing_url.response"
-            ).format(
+            now_playing = locale.format(
+                "cmd.queue.now_playing_url.response",
                 author,
                 title,
                 uri,
                 time,
                 time_true_s,
-                player.track.user_data["requester_id"],
+                requester_id,
             )
         else:
-            now_playing = ctx.bot.d.localizer.get_text(
-                ctx, "cmd.queue.now_playing_no_url.response"
-            ).format(
+            now_playing = locale.format(
+                "cmd.queue.now_playing_no_url.response",
                 author,
                 title,
                 time,
                 time_true_s,
-                player.track.user_data["requester_id"],
+                requester_id,
             )
-    # queue es la lista de canciones que hay en la cola
-    queue = await voice.player_ctx.get_queue().get_queue()
-    queue_text = ""
-    # enumerate enumera el numero de canciones en la cola y su información, el máximo de canciones en la cola es 10
-    for idx, i in enumerate(queue):
-        if idx == 9:
-            break
-
-        if i.track.info.uri:
-            queue_text += ctx.bot.d.localizer.get_text(
-                ctx, "cmd.queue.queue_text_info.response"
-            ).format(
-                idx + 1,
-                ctx.bot.d.localizer.get_text(ctx, "generic.track_info_url").format(
-                    i.track.info.author,
-                    i.track.info.title,
-                    i.track.info.uri,
-                    i.track.user_data["requester_id"],
-                ),
+
+    # las páginas ya generadas se guardan hasta que cambia la cola
+    queue_pages = bot.d.queue_pages
+    rendered = queue_pages.get(voice.guild_id, locale.locale, page)
+
+    if not rendered:
+        rendered = render_queue_page(bot, locale, voice, page)
+        queue_pages.put(voice.guild_id, locale.locale, page, rendered)
+
+    pages = queue_pages.page_count(rendered.count)
+    page = max(1, min(page, pages))
+    row = None
+
+    if pages > 1:
+        row = (
+            bot.rest.build_message_action_row()
+            .add_interactive_button(
+                hikari.ButtonStyle.SECONDARY,
+                f"queue:{page - 1}",
+                label="◀",
+                is_disabled=page <= 1,
             )
-        else:
-            queue_text += ctx.bot.d.localizer.get_text(
-                ctx, "cmd.queue.queue_text_info.response"
-            ).format(
-                idx + 1,
-                ctx.bot.d.localizer.get_text(ctx, "generic.track_info_no_url").format(
-                    i.track.info.author,
-                    i.track.info.title,
-                    i.track.user_data["requester_id"],
-                ),
+            .add_interactive_button(
+                hikari.ButtonStyle.SECONDARY,
+                f"queue:{page + 1}",
+                label="▶",
+                is_disabled=page >= pages,
             )
+        )
+
+    return (
+        locale.format(
+            "cmd.queue.now_playing_queue.response",
+            now_playing,
+            rendered.text.replace("\\n", "\n"),
+        ),
+        row,
+    )
+
+
+def render_queue_page(
+    bot: lightbulb.BotApp, locale: LocaleView, voice: LavalinkVoice, page: int
+) -> QueuePage:
+    page_size = bot.d.queue_pages.page_size
+    shadow_queue = bot.d.queues.get(voice.guild_id)
+    count = len(shadow_queue) if shadow_queue else 0
+    pages = bot.d.queue_pages.page_count(count)
+    # si la página ya no existe porque la cola es más corta, se enseña la última,
+    # y nunca una antes de la primera
+    page = max(1, min(page, pages))
+    # solo se copian de la cola las canciones de la página, no la cola entera
+    queue = []
+    if shadow_queue:
+        queue = shadow_queue.slice((page - 1) * page_size, page * page_size)
+
+    queue_text = ""
+    # enumerate enumera las canciones de la página y su información, continuando el número de la página anterior
+    for idx, i in enumerate(queue, (page - 1) * page_size + 1):
+        queue_text += locale.format(
+            "cmd.queue.queue_text_info.response",
+            idx,
+            bot.d.track_info.render(locale.locale, i),
+        )
 
     if not queue_text:
-        queue_text = ctx.bot.d.localizer.get_text(ctx, "cmd.queue.queue_text.response")
+        queue_text = locale.get_text("cmd.queue.queue_text.response")
+    elif pages > 1:
+        queue_text += "\\n" + locale.format("cmd.queue.page.response", page, pages)
 
-    await ctx.respond(
-        ctx.bot.d.localizer.get_text(
-            ctx, "cmd.queue.now_playing_queue.response"
-        ).format(now_playing, queue_text.replace("\\n", "\n"))
-    )
+    return QueuePage(queue_text, count)
 
 
 @plugin.command()
@@ -356,41 +398,26 @@ async def remove(ctx: Context) -> None:
 
     assert isinstance(voice, LavalinkVoice)
 
-    queue = await voice.player_ctx.get_queue().get_queue()
-    # si el indice indicado por el usuario es mayor a la longitud de la cola, saldrá este mensaje
-    if ctx.options.index > len(queue):
+    queue = ctx.bot.d.queues.get(ctx.guild_id)
+    # si el indice indicado por el usuario no está en la cola, saldrá este mensaje,
+    # los comandos de prefijo no comprueban el valor mínimo de la opción
+    if not queue or not 1 <= ctx.options.index <= len(queue):
         await ctx.respond(
             ctx.bot.d.localizer.get_text(ctx, "cmd.remove.index_out_range.response")
         )
         return None
 
     assert isinstance(ctx.options.index, int)
-    track = queue[ctx.options.index - 1].track
+    track = queue.peek(ctx.options.index - 1)
+    assert track
 
-    if track.info.uri:
-        await ctx.respond(
-            ctx.bot.d.localizer.get_text(ctx, "cmd.remove.removed.response").format(
-                ctx.bot.d.localizer.get_text(ctx, "generic.track_info_url").format(
-                    track.info.author,
-                    track.info.title,
-                    track.info.uri,
-                    track.user_data["requester_id"],
-                )
-            )
-        )
-    else:
-        await ctx.respond(
-            ctx.bot.d.localizer.get_text(ctx, "cmd.remove.removed.response").format(
-                ctx.bot.d.localizer.get_text(ctx, "generic.track_info_no_url").format(
-                    track.info.author,
-                    track.info.title,
-                    track.user_data["requester_id"],
-                )
-            )
+    await ctx.respond(
+        ctx.bot.d.localizer.format(
+            ctx, "cmd.remove.removed.response", ctx.bot.d.track_info.render(ctx, track)
         )
+    )
     # el indice de la cola se reduce en uno
-    queue_ref = voice.player_ctx.get_queue()
-    queue_ref.remove(ctx.options.index - 1)
+    queue.remove(ctx.options.index - 1)
     # voice.player_ctx.set_queue_remove(ctx.options.index - 1)
 
 
@@ -418,7 +445,7 @@ async def clear(ctx: Context) -> None:
 
     assert isinstance(voice, LavalinkVoice)
 
-    queue = await voice.player_ctx.get_queue().get_queue()
+    queue = ctx.bot.d.queues.get(ctx.guild_id)
 
     if not queue:
         await ctx.respond(
@@ -426,8 +453,7 @@ async def clear(ctx: Context) -> None:
         )
         return None
     # da la cola vacia a voice
-    queue_ref = voice.player_ctx.get_queue()
-    queue_ref.clear()
+    queue.clear()
     # voice.player_ctx.set_queue_clear()
     await ctx.respond(
         ctx.bot.d.localizer.get_text(ctx, "cmd.clear.queue_cleared.response")
@@ -478,15 +504,16 @@ async def swap(ctx: Context) -> None:
 
     assert isinstance(voice, LavalinkVoice)
 
-    queue = await voice.player_ctx.get_queue().get_queue()
-    # mira si el indice indicado por el usuario es mayor a la longitud de la cola
-    if ctx.options.index1 > len(queue):
+    queue = ctx.bot.d.queues.get(ctx.guild_id)
+    assert queue is not None
+    # mira si el indice indicado por el usuario está en la cola
+    if not 1 <= ctx.options.index1 <= len(queue):
         await ctx.respond(
             ctx.bot.d.localizer.get_text(ctx, "cmd.swap.index1_out_range.response")
         )
         return None
-    # mira si el indice indicado por el usuario es mayor a la longitud de la cola
-    if ctx.options.index2 > len(queue):
+    # mira si el indice indicado por el usuario está en la cola
+    if not 1 <= ctx.options.index2 <= len(queue):
         await ctx.respond(
             ctx.bot.d.localizer.get_text(ctx, "cmd.swap.index2_out_range.response")
         )
@@ -501,54 +528,18 @@ async def swap(ctx: Context) -> None:
     assert isinstance(ctx.options.index1, int)
     assert isinstance(ctx.options.index2, int)
 
-    track1 = queue[ctx.options.index1 - 1]
-    track2 = queue[ctx.options.index2 - 1]
-    # se intercambian los indices de las dos canciones
-    queue[ctx.options.index1 - 1] = track2
-    queue[ctx.options.index2 - 1] = track1
-    # da la cola modificada a voice
-    queue_ref = voice.player_ctx.get_queue()
-    queue_ref.replace(queue)
-
-    if track1.track.info.uri:
-        track1_text = ctx.bot.d.localizer.get_text(
-            ctx, "generic.track_info_url"
-        ).format(
-            track1.track.info.author,
-            track1.track.info.title,
-            track1.track.info.uri,
-            track1.track.user_data["requester_id"],
-        )
-    else:
-        track1_text = ctx.bot.d.localizer.get_text(
-            ctx, "generic.track_info_no_url"
-        ).format(
-            track1.track.info.author,
-            track1.track.info.title,
-            track1.track.user_data["requester_id"],
-        )
-
-    if track2.track.info.uri:
-        track2_text = ctx.bot.d.localizer.get_text(
-            ctx, "generic.track_info_url"
-        ).format(
-            track2.track.info.author,
-            track2.track.info.title,
-            track2.track.info.uri,
-            track2.track.user_data["requester_id"],
-        )
-    else:
-        track2_text = ctx.bot.d.localizer.get_text(
-            ctx, "generic.track_info_no_url"
-        ).format(
-            track2.track.info.author,
-            track2.track.info.title,
-            track2.track.user_data["requester_id"],
-        )
+    track1 = queue.peek(ctx.options.index1 - 1)
+    track2 = queue.peek(ctx.options.index2 - 1)
+    assert track1 and track2
+    # se intercambian los indices de las dos canciones, solo se mandan esas dos a lavalink
+    queue.swap(ctx.options.index1 - 1, ctx.options.index2 - 1)
+
+    track1_text = ctx.bot.d.track_info.render(ctx, track1)
+    track2_text = ctx.bot.d.track_info.render(ctx, track2)
 
     await ctx.respond(
-        ctx.bot.d.localizer.get_text(ctx, "cmd.swap.swapped.response").format(
-            track2_text, track1_text
+        ctx.bot.d.localizer.format(
+            ctx, "cmd.swap.swapped.response", track2_text, track1_text
         )
     )
 
@@ -577,12 +568,10 @@ async def shuffle(ctx: Context) -> None:
 
     assert isinstance(voice, LavalinkVoice)
 
-    queue = await voice.player_ctx.get_queue().get_queue()
-    # se mezclan los indices de la cola
-    random.shuffle(queue)
-    # da la cola modificada a voice
-    queue_ref = voice.player_ctx.get_queue()
-    queue_ref.replace(queue)
+    queue = ctx.bot.d.queues.get(ctx.guild_id)
+    assert queue is not None
+    # se mezclan los indices de la cola y se da la cola modificada a voice
+    queue.shuffle()
 
     await ctx.respond(
         ctx.bot.d.localizer.get_text(ctx, "cmd.shuffle.queue_shuffled.response")
@@ -630,40 +619,21 @@ async def loop_start(ctx: Context) -> None:
     player = await voice.player_ctx.get_player()
 
     if player.track:
-        queue_ref = voice.player_ctx.get_queue()
-        queue_ref.push_to_front(player.track)
-        if voice.lavalink.data:
-            voice.lavalink.data.add(int(ctx.guild_id))
-        else:
-            voice.lavalink.data = {int(ctx.guild_id)}
-
-        if player.track.info.uri:
-            await ctx.respond(
-                ctx.bot.d.localizer.get_text(
-                    ctx, "cmd.loop_start.starting_loop.response"
-                ).format(
-                    ctx.bot.d.localizer.get_text(ctx, "generic.track_info_url").format(
-                        player.track.info.author,
-                        player.track.info.title,
-                        player.track.info.uri,
-                        player.track.user_data["requester_id"],
-                    )
-                )
-            )
-        else:
-            await ctx.respond(
-                ctx.bot.d.localizer.get_text(
-                    ctx, "cmd.loop_start.starting_loop.response"
-                ).format(
-                    ctx.bot.d.localizer.get_text(
-                        ctx, "generic.track_info_no_url"
-                    ).format(
-                        player.track.info.author,
-                        player.track.info.title,
-                        player.track.user_data["requester_id"],
-                    )
-                )
+        queue = ctx.bot.d.queues.get(ctx.guild_id)
+        assert queue is not None
+        # la cola de lavalink se vacía y la canción vuelve a empezar cuando termina
+        ctx.bot.d.sessions.get(ctx.guild_id).set_repeat(
+            RepeatMode.TRACK, queue, player.track
+        )
+        ctx.bot.d.queue_store.record(ctx.guild_id, "repeat", RepeatMode.TRACK.value)
+
+        await ctx.respond(
+            ctx.bot.d.localizer.format(
+                ctx,
+                "cmd.loop_start.starting_loop.response",
+                ctx.bot.d.track_info.render(ctx, player.track),
             )
+        )
     else:
         await ctx.respond(
             ctx.bot.d.localizer.get_text(ctx, "cmd.loop.nothing_playing.response")
@@ -697,37 +667,67 @@ async def loop_end(ctx: Context) -> None:
     player = await voice.player_ctx.get_player()
 
     if player.track:
-        queue_ref = voice.player_ctx.get_queue()
-        queue_ref.remove(0)
-        if voice.lavalink.data:
-            voice.lavalink.data.remove(ctx.guild_id)
-        if player.track.info.uri:
-            await ctx.respond(
-                ctx.bot.d.localizer.get_text(
-                    ctx, "cmd.loop_end.ending_loop.response"
-                ).format(
-                    ctx.bot.d.localizer.get_text(ctx, "generic.track_info_url").format(
-                        player.track.info.author,
-                        player.track.info.title,
-                        player.track.info.uri,
-                        player.track.user_data["requester_id"],
-                    )
-                )
+        queue = ctx.bot.d.queues.get(ctx.guild_id)
+        assert queue is not None
+        ctx.bot.d.sessions.get(ctx.guild_id).set_repeat(
+            RepeatMode.OFF, queue, player.track
+        )
+        ctx.bot.d.queue_store.record(ctx.guild_id, "repeat", RepeatMode.OFF.value)
+        await ctx.respond(
+            ctx.bot.d.localizer.format(
+                ctx,
+                "cmd.loop_end.ending_loop.response",
+                ctx.bot.d.track_info.render(ctx, player.track),
             )
-        else:
-            await ctx.respond(
-                ctx.bot.d.localizer.get_text(
-                    ctx, "cmd.loop_end.ending_loop.response"
-                ).format(
-                    ctx.bot.d.localizer.get_text(
-                        ctx, "generic.track_info_no_url"
-                    ).format(
-                        player.track.info.author,
-                        player.track.info.title,
-                        player.track.user_data["requester_id"],
-                    )
-                )
+        )
+    else:
+        await ctx.respond(
+            ctx.bot.d.localizer.get_text(ctx, "cmd.loop.nothing_playing.response")
+        )
+
+
+# @loop.child hace que /loop queue sea un subcomando de loop
+@loop.child
+@lightbulb.command(
+    "queue",
+    "Loops the whole queue, putting every song at the end when it starts",
+    auto_defer=True,
+    name_localizations={hikari.Locale.ES_ES: "cola"},
+    description_localizations={
+        hikari.Locale.ES_ES: "Repite toda la cola, poniendo cada canción al final cuando empieza"
+    },
+)
+@lightbulb.implements(lightbulb.PrefixSubCommand, lightbulb.SlashSubCommand)
+async def loop_queue(ctx: Context) -> None:
+    if not ctx.guild_id:
+        return None
+
+    voice = ctx.bot.voice.connections.get(ctx.guild_id)
+
+    if not voice:
+        await ctx.respond(
+            ctx.bot.d.localizer.get_text(ctx, "cmd.error.no_voice.response")
+        )
+        return None
+
+    assert isinstance(voice, LavalinkVoice)
+
+    player = await voice.player_ctx.get_player()
+
+    if player.track:
+        queue = ctx.bot.d.queues.get(ctx.guild_id)
+        assert queue is not None
+        # la canción que suena ya ha empezado, así que se pone al final ahora
+        ctx.bot.d.sessions.get(ctx.guild_id).set_repeat(
+            RepeatMode.QUEUE, queue, player.track
+        )
+        ctx.bot.d.queue_store.record(ctx.guild_id, "repeat", RepeatMode.QUEUE.value)
+
+        await ctx.respond(
+            ctx.bot.d.localizer.format(
+                ctx, "cmd.loop_queue.starting_loop.response", len(queue)
             )
+        )
     else:
         await ctx.respond(
             ctx.bot.d.localizer.get_text(ctx, "cmd.loop.nothing_playing.response")
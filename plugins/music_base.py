@@ -1,6 +1,9 @@
+import asyncio
+import functools
 import locale
 import os
 import logging
+import time
 import typing as t
 
 import hikari
@@ -10,6 +13,19 @@ from hikari import GatewayBot
 from lightbulb import Plugin
 from lavalink_rs.model import events
 
+from lavalink_manager import LavalinkManager, NodeConfig, parse_nodes
+from guild_session import GuildSessions
+from lavalink_voice import LavalinkVoice
+from now_playing import NowPlaying
+from player_reaper import PlayerReaper, count_listeners
+from prefetch import Prefetcher
+from queue_pages import QueuePages
+from queue_store import PersistedGuild, QueueStore
+from shadow_queue import ShadowQueues
+from track_cache import TrackCache
+from track_index import TrackIndex
+from track_info import track_fields
+
 plugin = Plugin("Music (base) events")
 plugin.add_checks(lightbulb.guild_only)
 
@@ -44,71 +60,388 @@ class Events(lavalink_rs.EventHandler):
         assert player_ctx.data
 
         data = player_ctx.data
+        # lavalink_rs quita de la cola la canción que empieza, la copia local hace lo mismo
+        queue = data[1].d.queues.get(event.guild_id.inner)
+        repeated = False
+        if queue is not None:
+            repeated = queue.track_started(event.track)
+            # y según el modo de repetición se elige qué suena después
+            data[1].d.sessions.get(event.guild_id.inner).track_started(
+                queue, event.track
+            )
 
-        if event.track.user_data.get("title"):
-            title = event.track.user_data["title"]
-            author = event.track.user_data["author"]
-            uri = event.track.user_data["uri"]
-        else:
-            title = event.track.info.title
-            author = event.track.info.author
-            uri = event.track.info.uri
-
-        if uri:
-            await data[1].rest.create_message(
-                data[0],
-                data[1]
-                .d.localizer.get_text(data[2], "event.track_start.response")
-                .format(
-                    data[1]
-                    .d.localizer.get_text(data[2], "generic.track_info_url")
-                    .format(
-                        author,
-                        title,
-                        uri,
-                        event.track.user_data["requester_id"],
-                    )
-                ),
+        author, title, uri, _ = track_fields(event.track)
+        track_info = data[1].d.track_info.render(data[2], event.track)
+
+        # se edita el mismo mensaje en vez de mandar uno nuevo por cada canción
+        data[1].d.now_playing.update(
+            data[1].rest,
+            event.guild_id.inner,
+            data[0],
+            data[1].d.localizer.format(
+                data[2], "event.track_start.response", track_info
+            ),
+        )
+
+        # las canciones que suenan se pueden autocompletar en /play
+        data[1].d.track_index.add(title, author, uri)
+
+        # la canción que suena se guarda para poder seguir con ella si el bot se reinicia,
+        # una canción que se repite ya estaba guardada
+        if not repeated:
+            data[1].d.queue_store.record(event.guild_id.inner, "track", event.track)
+
+        # se preparan las siguientes canciones mientras suena esta
+        data[1].d.prefetcher.track_started(data[1], event.guild_id.inner, event.track)
+
+        data[1].d.reaper.touch(event.guild_id.inner)
+
+    # el evento track_end cuando termina una canción
+    async def track_end(
+        self,
+        client: lavalink_rs.LavalinkClient,
+        session_id: str,
+        event: events.TrackEnd,
+    ) -> None:
+        del session_id
+
+        player_ctx = client.get_player_context(event.guild_id.inner)
+
+        if not player_ctx or not player_ctx.data:
+            return
+
+        data = player_ctx.data
+        queue = data[1].d.queues.get(event.guild_id.inner)
+        # la canción que se repite vuelve a empezar desde la copia local de la cola
+        if queue is not None:
+            await data[1].d.sessions.get(event.guild_id.inner).track_ended(
+                queue, event.track, event.reason
             )
-        else:
-            await data[1].rest.create_message(
-                data[0],
-                data[1]
-                .d.localizer.get_text(data[2], "event.track_start.response")
-                .format(
-                    data[1]
-                    .d.localizer.get_text(data[2], "generic.track_info_no_url")
-                    .format(
-                        author,
-                        title,
-                        event.track.user_data["requester_id"],
-                    )
-                ),
+
+
+@plugin.listener(hikari.StartingEvent, bind=True)
+async def start_lavalink(plug: Plugin, event: hikari.StartingEvent) -> None:
+    """Event that triggers once, before the bot connects to the gateway."""
+
+    # LAVALINK_NODES es una lista de nodos "host:puerto|ssl|contraseña" separados por comas,
+    # si no está, se usa el único nodo de LAVALINK_HOSTNAME
+    nodes = parse_nodes(os.environ.get("LAVALINK_NODES", ""))
+    if not nodes:
+        nodes = [
+            NodeConfig(
+                os.environ["LAVALINK_HOSTNAME"],
+                os.environ.get("LAVALINK_SSL", "false").lower() == "true",
+                os.environ["LAVALINK_PASSWORD"],
             )
+        ]
+
+    # solo hay un cliente de lavalink por proceso, compartido por todos los shards
+    plug.bot.d.lavalink_manager = LavalinkManager(
+        float(os.environ.get("LAVALINK_HEALTH_INTERVAL", 10)),
+        int(os.environ.get("LAVALINK_HEALTH_FAILURES", 3)),
+        float(os.environ.get("LAVALINK_STATS_TIMEOUT", 180)),
+    )
+    plug.bot.d.lavalink_manager.on_player_moved = functools.partial(
+        player_moved, plug.bot
+    )
+    me = await plug.bot.rest.fetch_my_user()
 
-        if client.data and event.guild_id.inner in client.data:
-            queue_ref = player_ctx.get_queue()
-            queue_ref.push_to_front(event.track)
+    plug.bot.d.lavalink = await plug.bot.d.lavalink_manager.start(
+        me.id, Events(), nodes
+    )
+
+
+async def player_moved(
+    bot: lightbulb.BotApp, guild_id: int, player_ctx: lavalink_rs.PlayerContext
+) -> None:
+    # cuando un nodo se cae, el reproductor se mueve a otro y la conexión de voz
+    # tiene que usar el nuevo
+    voice = bot.voice.connections.get(hikari.Snowflake(guild_id))
+
+    if isinstance(voice, LavalinkVoice):
+        voice.player_ctx = player_ctx
+
+    bot.d.queues.moved(guild_id, player_ctx)
 
 
 @plugin.listener(hikari.ShardReadyEvent, bind=True)
-async def start_lavalink(plug: Plugin, event: hikari.ShardReadyEvent) -> None:
-    """Event that triggers when the hikari gateway is ready."""
+async def register_shard(plug: Plugin, event: hikari.ShardReadyEvent) -> None:
+    """Event that triggers when a shard is ready, including after reconnecting."""
+
+    plug.bot.d.lavalink_manager.register_shard(event.shard.id)
+
+
+@plugin.listener(hikari.ShardDisconnectedEvent, bind=True)
+async def unregister_shard(plug: Plugin, event: hikari.ShardDisconnectedEvent) -> None:
+    """Event that triggers when a shard loses its gateway connection."""
+
+    plug.bot.d.lavalink_manager.unregister_shard(event.shard.id)
+
+
+@plugin.listener(hikari.StoppedEvent, bind=True)
+async def stop_lavalink(plug: Plugin, event: hikari.StoppedEvent) -> None:
+    """Event that triggers when the bot has disconnected from the gateway."""
+
+    await plug.bot.d.lavalink_manager.stop()
+
+
+@plugin.listener(hikari.StartingEvent, bind=True)
+async def start_caches(plug: Plugin, event: hikari.StartingEvent) -> None:
+    """Event that triggers before the bot connects to the gateway."""
+
+    # la cache de busquedas se comparte entre todos los servidores
+    plug.bot.d.track_cache = TrackCache(
+        int(os.environ.get("TRACK_CACHE_SIZE", 2048)),
+        float(os.environ.get("TRACK_CACHE_TTL", 6 * 60 * 60)),
+        os.environ.get("TRACK_CACHE_PATH") or None,
+    )
+    plug.bot.d.track_cache.start(float(os.environ.get("TRACK_CACHE_FLUSH_INTERVAL", 5)))
+    plug.bot.d.track_index = TrackIndex(
+        int(os.environ.get("TRACK_INDEX_SIZE", 5000)),
+        os.environ.get("TRACK_INDEX_PATH") or None,
+    )
+    plug.bot.d.track_index.start(float(os.environ.get("TRACK_INDEX_FLUSH_INTERVAL", 5)))
+    plug.bot.d.prefetcher = Prefetcher(
+        int(os.environ.get("PREFETCH_DEPTH", 3)),
+        int(os.environ.get("PREFETCH_CONCURRENCY", 2)),
+    )
+    plug.bot.d.queue_pages = QueuePages(
+        int(os.environ.get("QUEUE_PAGE_SIZE", 9)),
+        int(os.environ.get("QUEUE_PAGES_PER_GUILD", 8)),
+    )
+    # cada cambio de la copia local de la cola invalida sus páginas de /queue
+    plug.bot.d.queues = ShadowQueues()
+    plug.bot.d.queues.on_change = plug.bot.d.queue_pages.invalidate
+    plug.bot.d.queues.start(float(os.environ.get("QUEUE_RECONCILE_INTERVAL", 120)))
+    # el modo de repetición de cada servidor
+    plug.bot.d.sessions = GuildSessions()
+    # y cada cambio se guarda en disco, para recuperar las colas al reiniciar el bot
+    plug.bot.d.queue_store = QueueStore(
+        os.environ.get("QUEUE_STORE_PATH", "queues.sqlite3"),
+        int(os.environ.get("QUEUE_STORE_SNAPSHOT_EVERY", 100)),
+        float(os.environ.get("QUEUE_STORE_PARKED_TTL", 24 * 60 * 60)),
+    )
+    plug.bot.d.queue_store.start_flushing(
+        float(os.environ.get("QUEUE_STORE_FLUSH_INTERVAL", 1))
+    )
+    plug.bot.d.queues.on_write = plug.bot.d.queue_store.record
+    # los reproductores sin nadie escuchando se desconectan, guardando su cola
+    plug.bot.d.reaper = PlayerReaper(
+        float(os.environ.get("REAPER_IDLE_TIMEOUT", 15 * 60)),
+        float(os.environ.get("REAPER_ALONE_TIMEOUT", 2 * 60)),
+    )
+    plug.bot.d.reaper.on_reap = functools.partial(reap_player, plug.bot)
+
+
+@plugin.listener(hikari.StoppedEvent, bind=True)
+async def stop_caches(plug: Plugin, event: hikari.StoppedEvent) -> None:
+    """Event that triggers when the bot has disconnected from the gateway."""
+
+    logging.info(f"Track cache stats: {plug.bot.d.track_cache.stats()}")
+    logging.info(f"Track index stats: {plug.bot.d.track_index.stats()}")
+    logging.info(f"Prefetch stats: {plug.bot.d.prefetcher.stats()}")
+    logging.info(f"Queue page stats: {plug.bot.d.queue_pages.stats()}")
+    logging.info(f"Queue mirror stats: {plug.bot.d.queues.stats()}")
+    logging.info(f"Session stats: {plug.bot.d.sessions.stats()}")
+    logging.info(f"Queue store stats: {plug.bot.d.queue_store.stats()}")
+    logging.info(f"Reaper stats: {plug.bot.d.reaper.stats()}")
+    plug.bot.d.reaper.stop()
+    plug.bot.d.queues.stop()
+    plug.bot.d.queue_store.close()
+    plug.bot.d.track_cache.close()
+    plug.bot.d.track_index.close()
+
+
+@plugin.listener(hikari.StartedEvent, bind=True)
+async def restore_players(plug: Plugin, event: hikari.StartedEvent) -> None:
+    """Event that triggers once the bot is connected to the gateway."""
 
-    node = lavalink_rs.NodeBuilder(
-        os.environ["LAVALINK_HOSTNAME"],
-        False,  # is the server SSL?
-        os.environ["LAVALINK_PASSWORD"],
-        event.my_user.id,
+    bot = plug.bot
+    store = bot.d.queue_store
+    semaphore = asyncio.Semaphore(int(os.environ.get("QUEUE_RESTORE_CONCURRENCY", 8)))
+
+    async def restore(guild_id: int, state: PersistedGuild) -> None:
+        async with semaphore:
+            start = time.perf_counter()
+
+            try:
+                await restore_player(bot, guild_id, state)
+            except Exception as e:
+                logging.error(f"Could not restore the player of {guild_id}: {e}")
+                store.forget(guild_id)
+                return
+
+            store.restore_times[guild_id] = time.perf_counter() - start
+            logging.info(
+                f"Restored the player of {guild_id} in {store.restore_times[guild_id] * 1000:.0f}ms"
+            )
+
+    # solo se recuperan los servidores de los shards de este proceso, del resto se
+    # encarga el proceso que tiene su shard, que comparte el mismo fichero
+    guilds = {}
+
+    for guild_id, state in store.guilds().items():
+        if hikari.snowflakes.calculate_shard_id(bot, guild_id) in bot.shards:
+            guilds[guild_id] = state
+        else:
+            store.release(guild_id)
+
+    await asyncio.gather(*[restore(k, v) for k, v in guilds.items()])
+
+    store.start(
+        float(os.environ.get("QUEUE_STORE_POSITION_INTERVAL", 15)), bot.d.lavalink
+    )
+    bot.d.reaper.start(float(os.environ.get("REAPER_INTERVAL", 30)), bot.d.lavalink)
+
+
+async def restore_player(
+    bot: lightbulb.BotApp, guild_id: int, state: PersistedGuild
+) -> None:
+    # las canciones se decodifican antes de conectarse, por si falla
+    tracks = await bot.d.queue_store.decode(bot.d.lavalink, guild_id, state)
+
+    if not tracks:
+        bot.d.queue_store.forget(guild_id)
+        return
+
+    voice = await LavalinkVoice.connect(
+        hikari.Snowflake(guild_id),
+        hikari.Snowflake(state.voice_channel_id),
+        bot,
+        bot.d.lavalink,
+        (hikari.Snowflake(state.text_channel_id), bot, state.locale),
+    )
+    bot.d.queue_store.joined(
+        guild_id, state.voice_channel_id, state.text_channel_id, state.locale
+    )
+    queue = bot.d.queues.create(guild_id, voice.player_ctx)
+    # puede que ya no quede nadie en el canal al que se vuelve
+    bot.d.reaper.joined(
+        guild_id, not count_listeners(bot.cache, guild_id, state.voice_channel_id)
+    )
+
+    await bot.d.queue_store.resume(
+        guild_id, state, tracks, queue, bot.d.sessions.get(guild_id)
+    )
+
+
+async def reap_player(bot: lightbulb.BotApp, guild_id: int, reason: str) -> None:
+    voice = bot.voice.connections.get(hikari.Snowflake(guild_id))
+
+    if not isinstance(voice, LavalinkVoice):
+        return
+
+    # la cola se guarda antes de salir, para que /play pueda seguir donde se quedó
+    player = await voice.player_ctx.get_player()
+    bot.d.queue_store.park(
+        guild_id, player.state.position if player.track else None, player.paused
+    )
+
+    text_channel_id, _, locale = voice.player_ctx.data
+
+    await voice.disconnect()
+    bot.d.prefetcher.forget(guild_id)
+    bot.d.now_playing.forget(guild_id)
+    bot.d.playlists.forget(guild_id)
+    bot.d.queues.forget(guild_id)
+    bot.d.sessions.forget(guild_id)
+    bot.d.lavalink_manager.forget_player(guild_id)
+    logging.info(f"Left the {reason} player of {guild_id}")
+
+    try:
+        await bot.rest.create_message(
+            text_channel_id,
+            bot.d.localizer.get_text(locale, "event.reaper.left.response"),
+        )
+    except hikari.HikariError as e:
+        logging.warning(f"Could not say why the bot left {guild_id}: {e}")
+
+
+@plugin.listener(hikari.VoiceStateUpdateEvent, bind=True)
+async def voice_state_updated(
+    plug: Plugin, event: hikari.VoiceStateUpdateEvent
+) -> None:
+    """Event that triggers when someone joins, leaves or moves between voice channels."""
+
+    bot = plug.bot
+    me = bot.get_me()
+
+    if not me:
+        return
+
+    # si han echado al bot del canal, ya no hay nada que vigilar
+    if event.state.user_id == me.id and not event.state.channel_id:
+        bot.d.reaper.forget(event.guild_id)
+        return
+
+    voice = bot.voice.connections.get(event.guild_id)
+
+    if not isinstance(voice, LavalinkVoice):
+        return
+
+    # el bot puede haber sido movido a otro canal
+    own_state = bot.cache.get_voice_state(event.guild_id, me.id)
+    channel_id = own_state.channel_id if own_state else voice.channel_id
+
+    bot.d.reaper.alone(
+        event.guild_id, not count_listeners(bot.cache, event.guild_id, channel_id)
     )
 
-    lavalink_client = await lavalink_rs.LavalinkClient.new(
-        Events(),
-        [node],
-        lavalink_rs.NodeDistributionStrategy.sharded(),
+
+@plugin.listener(lightbulb.CommandCompletionEvent, bind=True)
+async def command_completed(
+    plug: Plugin, event: lightbulb.CommandCompletionEvent
+) -> None:
+    """Event that triggers after a command finished without errors."""
+
+    # cualquier comando cuenta como actividad del reproductor del servidor
+    if event.context.guild_id:
+        plug.bot.d.reaper.touch(event.context.guild_id)
+
+
+@plugin.listener(hikari.StoppingEvent, bind=True)
+async def save_positions(plug: Plugin, event: hikari.StoppingEvent) -> None:
+    """Event that triggers before the bot disconnects from the gateway."""
+
+    await plug.bot.d.queue_store.save_positions(plug.bot.d.lavalink)
+
+
+@plugin.listener(hikari.StartingEvent, bind=True)
+async def start_now_playing(plug: Plugin, event: hikari.StartingEvent) -> None:
+    """Event that triggers before the bot connects to the gateway."""
+
+    plug.bot.d.now_playing = NowPlaying(
+        float(os.environ.get("NOW_PLAYING_MIN_INTERVAL", 2)),
+        int(os.environ.get("NOW_PLAYING_MAX_DISTANCE", 10)),
     )
 
-    plug.bot.d.lavalink = lavalink_client
+
+@plugin.listener(hikari.GuildMessageCreateEvent, bind=True)
+async def now_playing_scrolled(
+    plug: Plugin, event: hikari.GuildMessageCreateEvent
+) -> None:
+    """Event that triggers when a message is sent to a guild channel."""
+
+    # si hay muchos mensajes después del de la canción, se manda uno nuevo
+    plug.bot.d.now_playing.message_created(
+        event.guild_id, event.channel_id, event.message_id
+    )
+
+
+@plugin.listener(hikari.GuildMessageDeleteEvent, bind=True)
+async def now_playing_deleted(
+    plug: Plugin, event: hikari.GuildMessageDeleteEvent
+) -> None:
+    """Event that triggers when a message is deleted from a guild channel."""
+
+    plug.bot.d.now_playing.message_deleted(event.guild_id, event.message_id)
+
+
+@plugin.listener(hikari.StoppedEvent, bind=True)
+async def stop_now_playing(plug: Plugin, event: hikari.StoppedEvent) -> None:
+    """Event that triggers when the bot has disconnected from the gateway."""
+
+    logging.info(f"Now playing stats: {plug.bot.d.now_playing.stats()}")
 
 
 def load(bot: GatewayBot) -> None:
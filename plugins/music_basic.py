@@ -1,18 +1,33 @@
-import asyncio
+import functools
+import os
 import sys
+import time
 import traceback
 from pprint import pprint
 
-from lavalink_rs import PlayerContext
 from lavalink_rs.model.search import SearchEngines
 
+import tracing
+from format_policy import FormatPolicy
 from lavalink_voice import LavalinkVoice
+from negative_cache import NegativeCache
+from player_reaper import count_listeners
+from playlist_ingest import PlaylistIngester
+from shadow_queue import ShadowQueue
+from source_router import LAVALINK, YT_DLP, SourceRouter
+from stream_cache import StreamCache
+from track_cache import query_type
+from ytdl_pool import (
+    ExtractionEmpty,
+    ExtractionFailed,
+    ExtractionPool,
+    ExtractionQueueFull,
+)
 
 import logging
 import typing as t
 
 import hikari
-import yt_dlp
 import lightbulb
 from hikari import GatewayBot
 from lightbulb import Plugin, Context
@@ -32,7 +47,128 @@ ytdl_format_options = {
     "no_warnings": True,
     "default_search": "auto",
 }
-ytdl = yt_dlp.YoutubeDL(ytdl_format_options)
+
+# la respuesta a cada motivo por el que una query no se ha podido reproducir
+FAILURE_RESPONSES = {
+    "unsupported": "cmd.play.url_not_supported",
+    "not_found": "cmd.play.not_found",
+    "unavailable": "error.response",
+    "error": "error.response",
+    "busy": "cmd.play.yt-dlp.busy",
+}
+# los fallos que pueden no repetirse al volver a intentarlo, y no se recuerdan
+TRANSIENT_FAILURES = {"error", "busy"}
+
+
+@plugin.listener(hikari.StartingEvent, bind=True)
+async def start_ytdl_pool(plug: Plugin, event: hikari.StartingEvent) -> None:
+    """Event that triggers before the bot connects to the gateway."""
+
+    # yt-dlp tiene su propio pool de workers para no llenar el executor por defecto
+    plug.bot.d.ytdl_pool = ExtractionPool(
+        ytdl_format_options,
+        int(os.environ.get("YTDL_WORKERS", 4)),
+        int(os.environ.get("YTDL_QUEUE_SIZE", 16)),
+        float(os.environ.get("YTDL_TIMEOUT", 30)),
+        os.environ.get("YTDL_USE_PROCESSES", "false").lower() == "true",
+    )
+    # las URLs firmadas caducan, así que se vuelven a extraer antes de que pase
+    plug.bot.d.stream_cache = StreamCache(
+        plug.bot.d.ytdl_pool,
+        int(os.environ.get("STREAM_CACHE_SIZE", 1024)),
+        float(os.environ.get("STREAM_CACHE_TTL", 30 * 60)),
+        float(os.environ.get("STREAM_CACHE_REFRESH_MARGIN", 5 * 60)),
+        float(os.environ.get("STREAM_CACHE_KEEP_ALIVE", 3 * 60 * 60)),
+    )
+    plug.bot.d.stream_cache.on_refresh = functools.partial(
+        refresh_queued_streams, plug.bot
+    )
+    # de todos los formatos de cada extracción, se reproduce solo audio hasta un bitrate
+    plug.bot.d.format_policy = FormatPolicy(
+        float(os.environ.get("AUDIO_MAX_BITRATE", 160))
+    )
+    plug.bot.d.stream_cache.format_policy = plug.bot.d.format_policy
+    plug.bot.d.stream_cache.start(60)
+
+
+@plugin.listener(hikari.StoppedEvent, bind=True)
+async def stop_ytdl_pool(plug: Plugin, event: hikari.StoppedEvent) -> None:
+    """Event that triggers when the bot has disconnected from the gateway."""
+
+    logging.info(f"yt-dlp pool stats: {plug.bot.d.ytdl_pool.stats()}")
+    logging.info(f"Stream cache stats: {plug.bot.d.stream_cache.stats()}")
+    logging.info(f"Format policy stats: {plug.bot.d.format_policy.stats()}")
+    plug.bot.d.stream_cache.stop()
+    plug.bot.d.ytdl_pool.close()
+
+
+@plugin.listener(hikari.StartingEvent, bind=True)
+async def start_router(plug: Plugin, event: hikari.StartingEvent) -> None:
+    """Event that triggers before the bot connects to the gateway."""
+
+    # el router aprende por dominio si las queries funcionan en lavalink o en yt-dlp
+    plug.bot.d.router = SourceRouter(int(os.environ.get("SOURCE_ROUTER_SIZE", 1024)))
+    # y las queries que no funcionan en ninguno de los dos se recuerdan un rato
+    plug.bot.d.negative_cache = NegativeCache(
+        int(os.environ.get("NEGATIVE_CACHE_SIZE", 1024)),
+        float(os.environ.get("NEGATIVE_CACHE_TTL", 5 * 60)),
+    )
+
+
+@plugin.listener(hikari.StoppedEvent, bind=True)
+async def stop_router(plug: Plugin, event: hikari.StoppedEvent) -> None:
+    """Event that triggers when the bot has disconnected from the gateway."""
+
+    logging.info(f"Source router stats: {plug.bot.d.router.stats()}")
+    logging.info(f"Negative cache stats: {plug.bot.d.negative_cache.stats()}")
+
+
+@plugin.listener(hikari.StartingEvent, bind=True)
+async def start_playlists(plug: Plugin, event: hikari.StartingEvent) -> None:
+    """Event that triggers before the bot connects to the gateway."""
+
+    # las playlists grandes se añaden a la cola por partes
+    plug.bot.d.playlists = PlaylistIngester(
+        int(os.environ.get("PLAYLIST_CHUNK_SIZE", 100)),
+        int(os.environ.get("MAX_QUEUE_LENGTH", 5000)),
+        float(os.environ.get("PLAYLIST_PROGRESS_INTERVAL", 2)),
+    )
+
+
+@plugin.listener(hikari.StoppedEvent, bind=True)
+async def stop_playlists(plug: Plugin, event: hikari.StoppedEvent) -> None:
+    """Event that triggers when the bot has disconnected from the gateway."""
+
+    logging.info(f"Playlist stats: {plug.bot.d.playlists.stats()}")
+
+
+async def refresh_queued_streams(
+    bot: lightbulb.BotApp, original_url: str, ytdl_query: t.Dict[str, t.Any]
+) -> None:
+    # cambia las canciones de la cola que usan una URL que va a caducar por la nueva
+    for voice in list(bot.voice.connections.values()):
+        if not isinstance(voice, LavalinkVoice):
+            continue
+
+        queue = bot.d.queues.get(voice.guild_id)
+
+        if not queue:
+            continue
+
+        for idx, i in enumerate(queue.slice(0, len(queue))):
+            if not i.user_data or i.user_data.get("uri") != original_url:
+                continue
+
+            tracks = await bot.d.stream_cache.load(
+                voice.lavalink, voice.guild_id, ytdl_query
+            )
+            track = tracks.data
+            track.info = i.info
+            track.user_data = i.user_data
+
+            # la cola puede haber cambiado mientras se cargaba la canción
+            if queue.peek(idx) is i:
+                queue.set(idx, track)
 
 
 async def _join(ctx: Context) -> t.Optional[hikari.Snowflake]:
@@ -61,16 +197,27 @@ async def _join(ctx: Context) -> t.Optional[hikari.Snowflake]:
     # si no está conectado a ningún canal, entonces se conecta al canal introducido en el comando,
     # o en el que está el usuario
     if not voice:
-        locale = None
-        if ctx.interaction:
-            locale = ctx.interaction.locale
-        voice = await LavalinkVoice.connect(
-            ctx.guild_id,
-            channel_id,
-            ctx.bot,
-            ctx.bot.d.lavalink,
-            (ctx.channel_id, ctx.bot, locale),
-        )
+        with tracing.span("join", guild_id=ctx.guild_id, channel_id=channel_id):
+            locale = None
+            if ctx.interaction:
+                locale = ctx.interaction.locale
+            voice = await LavalinkVoice.connect(
+                ctx.guild_id,
+                channel_id,
+                ctx.bot,
+                ctx.bot.d.lavalink,
+                (ctx.channel_id, ctx.bot, locale),
+            )
+            # la cola se lee de una copia local, que empieza vacía como la del reproductor
+            ctx.bot.d.queues.create(ctx.guild_id, voice.player_ctx)
+            ctx.bot.d.queue_store.joined(
+                ctx.guild_id, channel_id, ctx.channel_id, locale
+            )
+            # si se pide entrar a otro canal, puede que no haya nadie escuchando
+            ctx.bot.d.reaper.joined(
+                ctx.guild_id,
+                not count_listeners(ctx.bot.cache, ctx.guild_id, channel_id),
+            )
 
     return channel_id
 
@@ -100,13 +247,12 @@ async def _join(ctx: Context) -> t.Optional[hikari.Snowflake]:
 @lightbulb.implements(lightbulb.PrefixCommand, lightbulb.SlashCommand)
 async def join(ctx: Context) -> None:
     """Joins the voice channel you are in"""
-    channel_id = await _join(ctx)
+    with ctx.bot.d.tracer.trace("command.join", guild_id=ctx.guild_id):
+        channel_id = await _join(ctx)
 
     if channel_id:
         await ctx.respond(
-            ctx.bot.d.localizer.get_text(ctx, "cmd.join.channel_id.response").format(
-                channel_id
-            )
+            ctx.bot.d.localizer.format(ctx, "cmd.join.channel_id.response", channel_id)
         )
     else:
         await ctx.respond(
@@ -137,6 +283,14 @@ async def leave(ctx: Context) -> None:
         return None
     # el bot se desconecta del canal
     await voice.disconnect()
+    ctx.bot.d.prefetcher.forget(ctx.guild_id)
+    ctx.bot.d.now_playing.forget(ctx.guild_id)
+    ctx.bot.d.playlists.forget(ctx.guild_id)
+    ctx.bot.d.queues.forget(ctx.guild_id)
+    ctx.bot.d.sessions.forget(ctx.guild_id)
+    ctx.bot.d.queue_store.forget(ctx.guild_id)
+    ctx.bot.d.reaper.forget(ctx.guild_id)
+    ctx.bot.d.lavalink_manager.forget_player(ctx.guild_id)
 
     await ctx.respond(
         ctx.bot.d.localizer.get_text(ctx, "cmd.leave.left_channel.response")
@@ -149,6 +303,7 @@ async def leave(ctx: Context) -> None:
     "The spotify search query, or any URL",
     modifier=lightbulb.OptionModifier.CONSUME_REST,
     required=False,
+    autocomplete=True,
     name_localizations={hikari.Locale.ES_ES: "busqueda"},
     description_localizations={
         hikari.Locale.ES_ES: "La busqueda en spotify, o cualquier URL"
@@ -169,6 +324,33 @@ async def leave(ctx: Context) -> None:
     lightbulb.SlashCommand,
 )
 async def play(ctx: Context) -> None:
+    # cada etapa del comando (unirse, buscar, yt-dlp...) se mide por separado
+    with ctx.bot.d.tracer.trace("command.play", guild_id=ctx.guild_id):
+        await _play(ctx)
+
+
+@play.autocomplete("query")
+async def play_autocomplete(
+    option: hikari.AutocompleteInteractionOption,
+    interaction: hikari.AutocompleteInteraction,
+) -> t.List[hikari.impl.AutocompleteChoiceBuilder]:
+    # se sugieren las canciones que ya han sonado, sin buscar nada en lavalink
+    bot = t.cast(lightbulb.BotApp, interaction.app)
+    choices = []
+
+    for i in bot.d.track_index.search(str(option.value or "")):
+        # discord no acepta nombres ni valores de más de 100 caracteres
+        if len(i.uri) > 100:
+            continue
+
+        choices.append(
+            hikari.impl.AutocompleteChoiceBuilder(name=i.name[:100], value=i.uri)
+        )
+
+    return choices
+
+
+async def _play(ctx: Context) -> None:
     if not ctx.guild_id:
         return None
 
@@ -189,13 +371,17 @@ async def play(ctx: Context) -> None:
     assert isinstance(voice, LavalinkVoice)
 
     player_ctx = voice.player_ctx
+    queue = ctx.bot.d.queues.get(ctx.guild_id)
+
+    assert queue is not None
 
     # si no hay argumentos en el comando, sigue la reproducción a partir de la siguiente canción
     # después de haber usado un /stop
     if not ctx.options.query:
+        tracing.annotate(query_type="resume")
         player = await player_ctx.get_player()
         # si no hay ninguna canción reproduciendose y hay canciones en la cola...
-        if not player.track and await player_ctx.get_queue().get_count():
+        if not player.track and len(queue):
             # el bot hará un /skip para reproducir la siguiente canción
             player_ctx.skip()
         # si ya hay una canción, entonces el bot pondrá un mensaje
@@ -205,11 +391,33 @@ async def play(ctx: Context) -> None:
                     ctx, "cmd.play.song_already_playing.response"
                 )
             )
-        # y si no hay ninguna canción en la cola, el bot pondrá otro mensaje
         else:
-            await ctx.respond(
-                ctx.bot.d.localizer.get_text(ctx, "cmd.play.empty_queue.response")
-            )
+            state = ctx.bot.d.queue_store.unpark(ctx.guild_id)
+
+            # si el bot salió por no tener a nadie escuchando, sigue con la cola que tenía
+            if state:
+                tracks = await ctx.bot.d.queue_store.decode(
+                    ctx.bot.d.lavalink, ctx.guild_id, state
+                )
+                await ctx.bot.d.queue_store.resume(
+                    ctx.guild_id,
+                    state,
+                    tracks,
+                    queue,
+                    ctx.bot.d.sessions.get(ctx.guild_id),
+                )
+                await ctx.respond(
+                    ctx.bot.d.localizer.format(
+                        ctx, "cmd.play.resumed_queue.response", len(tracks)
+                    )
+                )
+            # y si no hay ninguna canción en la cola, el bot pondrá otro mensaje
+            else:
+                await ctx.respond(
+                    ctx.bot.d.localizer.get_text(
+                        ctx, "cmd.play.empty_queue.response"
+                    )
+                )
 
         return None
 
@@ -220,94 +428,86 @@ async def play(ctx: Context) -> None:
     if not query.startswith("http"):
         query = SearchEngines.spotify(query)
 
+    # si la query ha fallado hace poco en lavalink y en yt-dlp, se responde lo mismo
+    # sin volver a intentarlo
+    reason = ctx.bot.d.negative_cache.get(query)
+
+    if reason:
+        tracing.annotate(query_type=query_type(query), failed=reason)
+        await ctx.respond(
+            ctx.bot.d.localizer.get_text(ctx, FAILURE_RESPONSES[reason])
+        )
+        return None
+
+    # el router decide si la query va primero a lavalink o directamente a yt-dlp,
+    # por su dominio y por lo que ha funcionado antes con él
+    route = await ctx.bot.d.router.route(query)
+    tracing.annotate(query_type=query_type(query), route=route)
+
+    start = time.perf_counter()
+    # por qué ha fallado yt-dlp, si se ha probado antes que lavalink
+    failure = None
+
+    if route == YT_DLP:
+        failure = await play_routed_yt_dlp(query, ctx, queue, has_joined)
+
+        if not failure:
+            ctx.bot.d.router.skipped(query)
+            return None
+
+    # si yt-dlp no ha podido, se prueba lavalink antes de responder
+    loading = time.perf_counter()
+
     try:
         # loaded_tracks son los resultados de la busqueda del bot o del url
-        tracks = await ctx.bot.d.lavalink.load_tracks(ctx.guild_id, query)
+        # si la misma busqueda se ha hecho hace poco, sale de la cache sin llamar a lavalink
+        tracks = await ctx.bot.d.track_cache.load_tracks(
+            ctx.bot.d.lavalink, ctx.guild_id, query
+        )
         loaded_tracks = tracks.data
-    # si loaded_tracks está vacío, entonces la excepción buscará la query en yt_dlp
-    except Exception as e:
-        try:
-            await play_yt_dlp(query, ctx, player_ctx, has_joined)
-        # si la aplicación no soporta la url entonces saldrá una excepción con un mensaje anunciandolo
-        # except yt_dlp.UnsupportedUrl:
-        #    await ctx.respond(ctx.bot.d.localizer.get_text(ctx, "cmd.play.url_not_supported"))
-        except Exception as e:
-            # logging.error son mensajes que salen cuando corres la aplicación
-            traceback.print_exception(type(e), e, e.__traceback__, file=sys.stderr)
-            logging.error(e)
-            await ctx.respond(ctx.bot.d.localizer.get_text(ctx, "error.response"))
+    # si lavalink falla, entonces la excepción buscará la query en yt_dlp
+    except Exception:
+        ctx.bot.d.router.record(query, LAVALINK, "error", time.perf_counter() - loading)
+        await fall_back_to_yt_dlp(query, ctx, queue, has_joined, failure, start)
         return None
 
+    if tracks.load_type == TrackLoadType.Error:
+        outcome = "error"
+    elif tracks.load_type == TrackLoadType.Empty:
+        outcome = "empty"
+    else:
+        outcome = "ok"
+
+    ctx.bot.d.router.record(query, LAVALINK, outcome, time.perf_counter() - loading)
+
     # Single track
     # este if mira si el resultado de la query hay resultados, si es una canción, una playlist, si está vacío o si
     # hay un error
     if tracks.load_type == TrackLoadType.Track:
         loaded_tracks.user_data = {"requester_id": int(ctx.author.id)}
-        player_ctx.queue(loaded_tracks)
-        # si hay url, la pone en el mensaje de la información de la canción cuando empieza la canción
-        if loaded_tracks.info.uri:
-            await ctx.respond(
-                ctx.bot.d.localizer.get_text(
-                    ctx, "cmd.play.added_to_queue.response"
-                ).format(
-                    ctx.bot.d.localizer.get_text(ctx, "generic.track_info_url").format(
-                        loaded_tracks.info.author,
-                        loaded_tracks.info.title,
-                        loaded_tracks.info.uri,
-                        loaded_tracks.user_data["requester_id"],
-                    )
-                )
-            )
-        # si no, pone el mensaje sin la url
-        else:
-            await ctx.respond(
-                ctx.bot.d.localizer.get_text(
-                    ctx, "cmd.play.added_to_queue.response"
-                ).format(
-                    ctx.bot.d.localizer.get_text(
-                        ctx, "generic.track_info_no_url"
-                    ).format(
-                        loaded_tracks.info.author,
-                        loaded_tracks.info.title,
-                        loaded_tracks.user_data["requester_id"],
-                    )
-                )
+        queue.push_to_back(loaded_tracks)
+        # pone la información de la canción en el mensaje, con la url si la tiene
+        await ctx.respond(
+            ctx.bot.d.localizer.format(
+                ctx,
+                "cmd.play.added_to_queue.response",
+                ctx.bot.d.track_info.render(ctx, loaded_tracks),
             )
+        )
 
     # Search results
     # este elif coge el primer resultado de la busqueda de la query (cuando no se pone un enlace de música)
     elif tracks.load_type == TrackLoadType.Search:
         loaded_tracks[0].user_data = {"requester_id": int(ctx.author.id)}
-        player_ctx.queue(loaded_tracks[0])
-        # si hay url, la pone en el mensaje de la información de la canción cuando empieza la canción
-        if loaded_tracks[0].info.uri:
-            await ctx.respond(
-                ctx.bot.d.localizer.get_text(
-                    ctx, "cmd.play.added_to_queue.response"
-                ).format(
-                    ctx.bot.d.localizer.get_text(ctx, "generic.track_info_url").format(
-                        loaded_tracks[0].info.author,
-                        loaded_tracks[0].info.title,
-                        loaded_tracks[0].info.uri,
-                        loaded_tracks[0].user_data["requester_id"],
-                    )
-                )
-            )
-        # si no, pone el mensaje sin la url
-        else:
-            await ctx.respond(
-                ctx.bot.d.localizer.get_text(
-                    ctx, "cmd.play.added_to_queue.response"
-                ).format(
-                    ctx.bot.d.localizer.get_text(
-                        ctx, "generic.track_info_no_url"
-                    ).format(
-                        loaded_tracks[0].info.author,
-                        loaded_tracks[0].info.title,
-                        loaded_tracks[0].user_data["requester_id"],
-                    )
-                )
+        queue.push_to_back(loaded_tracks[0])
+        # pone la información de la canción en el mensaje, con la url si la tiene
+        await ctx.respond(
+            ctx.bot.d.localizer.format(
+                ctx,
+                "cmd.play.added_to_queue.response",
+                ctx.bot.d.track_info.render(ctx, loaded_tracks[0]),
             )
+        )
 
     # Playlist
     # se llega a este elif cuando pones una playlist en la query
@@ -317,104 +517,119 @@ async def play(ctx: Context) -> None:
             # se añade la playlist a la cola con el video del enlace en primer lugar
             track = loaded_tracks.tracks[loaded_tracks.info.selected_track]
             track.user_data = {"requester_id": int(ctx.author.id)}
-            player_ctx.queue(track)
-            # si hay url, la pone en el mensaje de la información de la canción cuando empieza la canción
-            if track.info.uri:
-                await ctx.respond(
-                    ctx.bot.d.localizer.get_text(
-                        ctx, "cmd.play.added_to_queue.response"
-                    ).format(
-                        ctx.bot.d.localizer.get_text(
-                            ctx, "generic.track_info_url"
-                        ).format(
-                            track.info.author,
-                            track.info.title,
-                            track.info.uri,
-                            track.user_data["requester_id"],
-                        )
-                    )
-                )
-            # si no hay url, entonces se pone la información sin la url
-            else:
-                await ctx.respond(
-                    ctx.bot.d.localizer.get_text(
-                        ctx, "cmd.play.added_to_queue.response"
-                    ).format(
-                        ctx.bot.d.localizer.get_text(
-                            ctx, "generic.track_info_no_url"
-                        ).format(
-                            track.info.author,
-                            track.info.title,
-                            track.user_data["requester_id"],
-                        )
-                    )
+            queue.push_to_back(track)
+            # pone la información de la canción en el mensaje, con la url si la tiene
+            await ctx.respond(
+                ctx.bot.d.localizer.format(
+                    ctx,
+                    "cmd.play.added_to_queue.response",
+                    ctx.bot.d.track_info.render(ctx, track),
                 )
+            )
         # este else es para cuando se envia el enlace de una playlist
         else:
-            tracks = loaded_tracks.tracks
-            for i in tracks:
-                i.user_data = {"requester_id": int(ctx.author.id)}
-            # se añade la playlist a la cola
-            queue = player_ctx.get_queue()
-            queue.append(tracks)
-            await ctx.respond(
-                ctx.bot.d.localizer.get_text(
-                    ctx, "cmd.play.added_playlist_to_queue.response"
-                ).format(loaded_tracks.info.name)
+            # se añade la primera canción a la cola para que empiece a sonar ya, y el resto
+            # se va añadiendo por partes en segundo plano, editando el mensaje con el progreso
+            await ctx.bot.d.playlists.ingest(
+                ctx, queue, loaded_tracks.info.name, loaded_tracks.tracks
             )
 
     # Error or no results
     # el else sale si hay un error o no se encuentran resultados
     else:
-        try:
-            # se busca la query en yt-dlp
-            await play_yt_dlp(query, ctx, player_ctx, has_joined)
-        # el except sale cuando la aplicación no soporta el url que se está dando
-        except yt_dlp.UnsupportedUrl:
-            await ctx.respond(
-                ctx.bot.d.localizer.get_text(ctx, "cmd.play.url_not_supported")
-            )
-        # este except sale cuando hay un error distinto
-        except Exception as e:
-            logging.error(e)
-            await ctx.respond(ctx.bot.d.localizer.get_text(ctx, "error.response"))
+        # se busca la query en yt-dlp
+        await fall_back_to_yt_dlp(query, ctx, queue, has_joined, failure, start)
         return None
     # try_play reproduce la canción cuando es la primera vez que usas el comando !play
-    await try_play(player_ctx, has_joined)
+    await try_play(queue, has_joined)
     return None
 
 
-async def play_yt_dlp(
-    query: str, ctx: Context, player_ctx: PlayerContext, has_joined: bool
-):
+async def fall_back_to_yt_dlp(
+    query: str,
+    ctx: Context,
+    queue: ShadowQueue,
+    has_joined: bool,
+    failure: t.Optional[str],
+    start: float,
+) -> None:
+    # si yt-dlp ya ha fallado antes de probar lavalink, no se vuelve a intentar
+    if not failure:
+        failure = await play_routed_yt_dlp(query, ctx, queue, has_joined)
+
+    if not failure:
+        return None
+
+    # ha fallado en lavalink y en yt-dlp, así que se recuerda un rato, salvo si el
+    # fallo no dice nada de la query
+    if failure not in TRANSIENT_FAILURES:
+        ctx.bot.d.negative_cache.put(query, failure, time.perf_counter() - start)
+
+    await ctx.respond(ctx.bot.d.localizer.get_text(ctx, FAILURE_RESPONSES[failure]))
+
+
+async def play_routed_yt_dlp(
+    query: str, ctx: Context, queue: ShadowQueue, has_joined: bool
+) -> t.Optional[str]:
+    """Busca la query en yt-dlp, devolviendo por qué ha fallado si no ha podido."""
+    start = time.perf_counter()
+    outcome = "error"
+    # por qué no se puede reproducir la query
+    reason: t.Optional[str] = "error"
+
+    try:
+        await play_yt_dlp(query, ctx, queue, has_joined)
+        outcome = "ok"
+        reason = None
+    # si hay demasiadas extracciones pendientes, se avisa en vez de esperar
+    except ExtractionQueueFull:
+        # y no dice nada de si yt-dlp funciona con la query
+        outcome = ""
+        reason = "busy"
+    # si la busqueda no ha encontrado nada
+    except ExtractionEmpty:
+        outcome = "empty"
+        reason = "not_found"
+    # si ningún extractor de yt-dlp soporta la url, o el video ya no existe
+    except ExtractionFailed as e:
+        if e.unsupported:
+            outcome = "empty"
+            reason = "unsupported"
+        else:
+            logging.error(e)
+            reason = "unavailable"
+    except Exception as e:
+        # logging.error son mensajes que salen cuando corres la aplicación
+        traceback.print_exception(type(e), e, e.__traceback__, file=sys.stderr)
+        logging.error(e)
+
+    if outcome:
+        ctx.bot.d.router.record(query, YT_DLP, outcome, time.perf_counter() - start)
+
+    return reason
+
+
+async def play_yt_dlp(query: str, ctx: Context, queue: ShadowQueue, has_joined: bool):
+    with tracing.span(
+        "play_yt_dlp", guild_id=ctx.guild_id, query_type=query_type(query)
+    ):
+        await _play_yt_dlp(query, ctx, queue, has_joined)
+
+
+async def _play_yt_dlp(query: str, ctx: Context, queue: ShadowQueue, has_joined: bool):
     # el query.replace cambia la busqueda de spotify por la de youtube
     query = query.replace("spsearch", "ytsearch")
     # si no encuentra resultados con la busqueda en spotify...
     # el bot buscará en yt-dlp
-    ytdl_query = {}
-
-    # el metodo extract() extrae la información del resultado de la query
-    def extract() -> t.Dict[str, t.Any]:
-        info = ytdl.extract_info(query, download=False)
-        return info  # type: ignore
-
-    loop = asyncio.get_event_loop()
-
-    ytdl_query = await loop.run_in_executor(None, extract)
-    print(ytdl_query["url"])
+    # el pool extrae la información del resultado de la query, y si ya se está
+    # extrayendo la misma query, espera al mismo resultado. Si la URL ya se ha
+    # extraído y todavía no ha caducado, se usa la de la cache
+    ytdl_query = await ctx.bot.d.stream_cache.extract(query)
 
-    tracks = await ctx.bot.d.lavalink.load_tracks(ctx.guild_id, ytdl_query["url"])
+    tracks = await ctx.bot.d.stream_cache.load(
+        ctx.bot.d.lavalink, ctx.guild_id, ytdl_query
+    )
     loaded_tracks = tracks.data
-    if tracks.load_type == TrackLoadType.Track:
-        valid = []
-        for i in ytdl_query["formats"]:
-            if not i.get("filesize_approx"):
-                valid.append(i["url"])
-        tracks = await ctx.bot.d.lavalink.load_tracks(ctx.guild_id, valid[-1])
-        loaded_tracks = tracks.data
-
-    if tracks.load_type != TrackLoadType.Track:  # tracks is empty
-        raise Exception("Invalid API response")
 
     info = loaded_tracks.info
 
@@ -431,45 +646,30 @@ async def play_yt_dlp(
                                "title": info.title,
                                "author": info.author,
                                "uri": info.uri}
-    player_ctx.queue(loaded_tracks)
+    queue.push_to_back(loaded_tracks)
 
-    if loaded_tracks.info.uri:
-        await ctx.respond(
-            ctx.bot.d.localizer.get_text(
-                ctx, "cmd.play.added_to_queue.response"
-            ).format(
-                ctx.bot.d.localizer.get_text(ctx, "generic.track_info_url").format(
-                    loaded_tracks.info.author,
-                    loaded_tracks.info.title,
-                    loaded_tracks.info.uri,
-                    loaded_tracks.user_data["requester_id"],
-                )
-            )
-        )
-    else:
-        await ctx.respond(
-            ctx.bot.d.localizer.get_text(
-                ctx, "cmd.play.added_to_queue.response"
-            ).format(
-                ctx.bot.d.localizer.get_text(ctx, "generic.track_info_no_url").format(
-                    loaded_tracks.info.author,
-                    loaded_tracks.info.title,
-                    loaded_tracks.user_data["requester_id"],
-                )
-            )
+    await ctx.respond(
+        ctx.bot.d.localizer.format(
+            ctx,
+            "cmd.play.added_to_queue.response",
+            ctx.bot.d.track_info.render(ctx, loaded_tracks),
         )
+    )
     # try_play reproduce la canción cuando es la primera vez que usas el comando !play
-    await try_play(player_ctx, has_joined)
+    await try_play(queue, has_joined)
     return None
 
 
-async def try_play(player_ctx: PlayerContext, has_joined: bool):
-    player_data = await player_ctx.get_player()
+async def try_play(queue: ShadowQueue, has_joined: bool):
+    player_ctx = queue.player_ctx
+
+    with tracing.span("try_play"):
+        player_data = await player_ctx.get_player()
 
     if player_data:
         if (
             not player_data.track
-            and await player_ctx.get_queue().get_queue()
+            and len(queue)
             and not has_joined
         ):
             player_ctx.skip()
@@ -505,29 +705,17 @@ async def skip(ctx: Context) -> None:
     # si se está reproduciendo una canción el bot introducirá en un mensaje la canción que ha saltado,
     # con la información de esta
     if player.track:
-        if player.track.info.uri:
-            await ctx.respond(
-                ctx.bot.d.localizer.get_text(ctx, "cmd.skip.skipped.response").format(
-                    ctx.bot.d.localizer.get_text(ctx, "generic.track_info_url").format(
-                        player.track.info.author,
-                        player.track.info.title,
-                        player.track.info.uri,
-                        player.track.user_data["requester_id"],
-                    )
-                )
-            )
-        else:
-            await ctx.respond(
-                ctx.bot.d.localizer.get_text(ctx, "cmd.skip.skipped.response").format(
-                    ctx.bot.d.localizer.get_text(
-                        ctx, "generic.track_info_no_url"
-                    ).format(
-                        player.track.info.author,
-                        player.track.info.title,
-                        player.track.user_data["requester_id"],
-                    )
-                )
+        await ctx.respond(
+            ctx.bot.d.localizer.format(
+                ctx,
+                "cmd.skip.skipped.response",
+                ctx.bot.d.track_info.render(ctx, player.track),
             )
+        )
+        # si se repetía la canción, la cola de lavalink vuelve a tener las siguientes
+        queue = ctx.bot.d.queues.get(ctx.guild_id)
+        if queue is not None:
+            queue.attach()
         # el bot salta a la siguiente canción en la cola
         voice.player_ctx.skip()
     # si no hay ninguna canción reproduciendose entonces pondrá un mensaje diciendolo
@@ -567,29 +755,13 @@ async def stop(ctx: Context) -> None:
     # si se está reproduciendo una canción el bot introducirá en un mensaje la canción que ha parado,
     # con la información de esta
     if player.track:
-        if player.track.info.uri:
-            await ctx.respond(
-                ctx.bot.d.localizer.get_text(ctx, "cmd.stop.stopped.response").format(
-                    ctx.bot.d.localizer.get_text(ctx, "generic.track_info_url").format(
-                        player.track.info.author,
-                        player.track.info.title,
-                        player.track.info.uri,
-                        player.track.user_data["requester_id"],
-                    )
-                )
-            )
-        else:
-            await ctx.respond(
-                ctx.bot.d.localizer.get_text(ctx, "cmd.stop.stopped.response").format(
-                    ctx.bot.d.localizer.get_text(
-                        ctx, "generic.track_info_no_url"
-                    ).format(
-                        player.track.info.author,
-                        player.track.info.title,
-                        player.track.user_data["requester_id"],
-                    )
-                )
+        await ctx.respond(
+            ctx.bot.d.localizer.format(
+                ctx,
+                "cmd.stop.stopped.response",
+                ctx.bot.d.track_info.render(ctx, player.track),
             )
+        )
         # para la canción
         await voice.player_ctx.stop_now()
     else:
@@ -0,0 +1,147 @@
+from __future__ import annotations
+import asyncio
+import logging
+import time
+import typing as t
+
+import lightbulb
+from lavalink_rs.model.track import TrackData
+
+from stream_cache import parse_expiry
+
+
+def track_key(track: TrackData) -> str:
+    """Return an identity for a queued track that survives its stream URL being swapped."""
+    if track.user_data and track.user_data.get("uri"):
+        return track.user_data["uri"]
+
+    return track.info.uri or track.encoded
+
+
+class Prefetcher:
+    __slots__ = [
+        "depth",
+        "prefetched",
+        "hits",
+        "misses",
+        "wasted",
+        "refreshed",
+        "__semaphore",
+        "__pending",
+        "__tasks",
+    ]
+
+    def __init__(self, depth: int, concurrency: int) -> None:
+        self.depth = depth
+        self.prefetched = 0
+        self.hits = 0
+        self.misses = 0
+        self.wasted = 0
+        self.refreshed = 0
+
+        self.__semaphore = asyncio.Semaphore(concurrency)
+        self.__pending: t.Dict[int, t.Set[str]] = {}
+        self.__tasks: t.Dict[int, asyncio.Task[None]] = {}
+
+    def stats(self) -> t.Dict[str, int]:
+        """Return the counters of the prefetcher."""
+        return {
+            "prefetched": self.prefetched,
+            "hits": self.hits,
+            "misses": self.misses,
+            "wasted": self.wasted,
+            "refreshed": self.refreshed,
+        }
+
+    def track_started(
+        self, bot: lightbulb.BotApp, guild_id: int, track: TrackData
+    ) -> None:
+        """Count the track that just started and prefetch the next ones."""
+        pending = self.__pending.get(guild_id, set())
+        key = track_key(track)
+
+        if key in pending:
+            pending.discard(key)
+            self.hits += 1
+        else:
+            self.misses += 1
+
+        task = self.__tasks.get(guild_id)
+
+        if task and not task.done():
+            task.cancel()
+
+        self.__tasks[guild_id] = asyncio.create_task(self.__prefetch(bot, guild_id))
+
+    def forget(self, guild_id: int) -> None:
+        """Drop everything prefetched for a guild that stopped playing."""
+        self.wasted += len(self.__pending.pop(guild_id, ()))
+        task = self.__tasks.pop(guild_id, None)
+
+        if task:
+            task.cancel()
+
+    async def __prefetch(self, bot: lightbulb.BotApp, guild_id: int) -> None:
+        queue = bot.d.queues.get(guild_id)
+
+        if not queue:
+            return
+
+        upcoming = queue.slice(0, self.depth)
+
+        keys = {track_key(i) for i in upcoming}
+        pending = self.__pending.setdefault(guild_id, set())
+
+        # whatever was prefetched and is no longer coming up won't be played next
+        self.wasted += len(pending - keys)
+        pending &= keys
+
+        streams = []
+
+        for i in upcoming:
+            if track_key(i) in pending:
+                continue
+
+            if i.user_data and i.user_data.get("title"):
+                streams.append(i)
+            else:
+                # the queue already has the TrackData lavalink plays, nothing to load
+                pending.add(track_key(i))
+                self.prefetched += 1
+
+        await asyncio.gather(
+            *[self.__prefetch_track(bot, guild_id, i) for i in streams]
+        )
+
+    async def __prefetch_track(
+        self, bot: lightbulb.BotApp, guild_id: int, track: TrackData
+    ) -> None:
+        async with self.__semaphore:
+            try:
+                await self.__prefetch_stream(bot, track)
+            except Exception as e:
+                logging.warning(f"Could not prefetch {track_key(track)}: {e}")
+                return
+
+        self.__pending.setdefault(guild_id, set()).add(track_key(track))
+        self.prefetched += 1
+
+    async def __prefetch_stream(self, bot: lightbulb.BotApp, track: TrackData) -> None:
+        stream_cache = bot.d.stream_cache
+        uri = track.user_data["uri"]
+        # for yt-dlp tracks the identifier is the signed media URL
+        expiry = parse_expiry(track.info.identifier)
+
+        stream_cache.touch(uri)
+
+        if expiry:
+            fresh = expiry - stream_cache.refresh_margin > time.time()
+        else:
+            fresh = stream_cache.get(uri) is not None
+
+        if fresh:
+            return
+
+        # refreshing swaps the queued track for one with the new URL
+        if await stream_cache.refresh(uri):
+            self.refreshed += 1
@@ -0,0 +1,60 @@
+from __future__ import annotations
+import collections
+import dataclasses
+import typing as t
+
+
+@dataclasses.dataclass
+class QueuePage:
+    text: str
+    count: int
+
+
+class QueuePages:
+    """The rendered pages of the queue of every guild, kept until the queue changes."""
+
+    __slots__ = ["page_size", "max_pages", "hits", "misses", "__pages"]
+
+    def __init__(self, page_size: int, max_pages: int) -> None:
+        self.page_size = page_size
+        self.max_pages = max_pages
+        self.hits = 0
+        self.misses = 0
+
+        self.__pages: t.Dict[int, t.OrderedDict[t.Tuple[str, int], QueuePage]] = {}
+
+    def stats(self) -> t.Dict[str, int]:
+        """Return the counters of the cache."""
+        return {
+            "guilds": len(self.__pages),
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+    def page_count(self, count: int) -> int:
+        return max(1, -(-count // self.page_size))
+
+    def get(self, guild_id: int, locale: str, page: int) -> t.Optional[QueuePage]:
+        pages = self.__pages.get(guild_id)
+        rendered = pages.get((locale, page)) if pages else None
+
+        if not rendered:
+            self.misses += 1
+            return None
+
+        assert pages
+        pages.move_to_end((locale, page))
+        self.hits += 1
+
+        return rendered
+
+    def put(self, guild_id: int, locale: str, page: int, rendered: QueuePage) -> None:
+        pages = self.__pages.setdefault(guild_id, collections.OrderedDict())
+        pages[(locale, page)] = rendered
+
+        while len(pages) > self.max_pages:
+            pages.popitem(last=False)
+
+    def invalidate(self, guild_id: int) -> None:
+        """Drop the pages of a guild, after anything in its queue changed."""
+        self.__pages.pop(guild_id, None)
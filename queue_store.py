@@ -0,0 +1,446 @@
+from __future__ import annotations
+import asyncio
+import dataclasses
+import json
+import logging
+import sqlite3
+import time
+import typing as t
+
+from lavalink_rs import LavalinkClient
+from lavalink_rs.model.track import TrackData
+
+from guild_session import GuildSession, RepeatMode
+from shadow_queue import ShadowQueue
+
+
+def dump_track(track: TrackData) -> t.Dict[str, t.Any]:
+    """Return what is needed to rebuild a track with `decode_tracks`, without searching it again."""
+    return {"encoded": track.encoded, "user_data": track.user_data or {}}
+
+
+def _dump_arg(arg: t.Any) -> t.Any:
+    if isinstance(arg, TrackData):
+        return dump_track(arg)
+    elif isinstance(arg, list):
+        return [_dump_arg(i) for i in arg]
+
+    return arg
+
+
+@dataclasses.dataclass
+class PersistedGuild:
+    voice_channel_id: int
+    text_channel_id: int
+    locale: t.Optional[str]
+    repeat: str = RepeatMode.OFF.value
+    current: t.Optional[t.Dict[str, t.Any]] = None
+    position: int = 0
+    paused: bool = False
+    queue: t.List[t.Dict[str, t.Any]] = dataclasses.field(default_factory=list)
+
+    @classmethod
+    def load(cls, data: t.Dict[str, t.Any]) -> PersistedGuild:
+        # the states saved before the repeat modes only had a loop of the track
+        if "loop" in data:
+            data = dict(data)
+            data["repeat"] = (
+                RepeatMode.TRACK.value if data.pop("loop") else RepeatMode.OFF.value
+            )
+
+        return cls(**data)
+
+    def apply(self, op: str, args: t.List[t.Any]) -> None:
+        """Replay one logged change on top of this state."""
+        queue = self.queue
+
+        if op == "push_to_back":
+            queue.append(args[0])
+        elif op == "push_to_front":
+            queue.insert(0, args[0])
+        elif op == "append":
+            queue.extend(args[0])
+        elif op == "remove":
+            del queue[args[0]]
+        elif op == "clear":
+            queue.clear()
+        elif op == "set":
+            queue[args[0]] = args[1]
+        elif op == "swap":
+            queue[args[0]], queue[args[1]] = queue[args[1]], queue[args[0]]
+        elif op == "replace":
+            self.queue = list(args[0])
+        elif op == "pop":
+            del queue[0]
+        elif op == "track":
+            self.current = args[0]
+            self.position = 0
+            self.paused = False
+        elif op == "position":
+            self.position, self.paused = args
+        elif op == "repeat":
+            self.repeat = args[0]
+        elif op == "loop":
+            self.repeat = RepeatMode.TRACK.value if args[0] else RepeatMode.OFF.value
+        else:
+            raise ValueError(f"Unknown queue operation {op}")
+
+
+class QueueStore:
+    """Keeps the state of every player on disk, as an append-only log of changes and snapshots.
+
+    A snapshot of a guild replaces its log once the log is `snapshot_every` entries long.
+    The state of a player that was disconnected for being unused is parked for
+    `parked_ttl` seconds instead, until it's resumed. The log entries are written
+    in batches, every time `flush` runs.
+    """
+
+    __slots__ = [
+        "snapshot_every",
+        "parked_ttl",
+        "logged",
+        "snapshots",
+        "parked",
+        "resumed",
+        "restore_times",
+        "__db",
+        "__guilds",
+        "__logged_since",
+        "__pending",
+        "__task",
+        "__flush_task",
+    ]
+
+    def __init__(
+        self, path: str, snapshot_every: int, parked_ttl: float = 24 * 60 * 60
+    ) -> None:
+        self.snapshot_every = snapshot_every
+        self.parked_ttl = parked_ttl
+        self.logged = 0
+        self.snapshots = 0
+        self.parked = 0
+        self.resumed = 0
+        self.restore_times: t.Dict[int, float] = {}
+
+        self.__db = sqlite3.connect(path)
+        self.__db.execute("PRAGMA journal_mode=WAL")
+        # with WAL a commit survives a crash of the process, only an OS crash can lose it
+        self.__db.execute("PRAGMA synchronous=NORMAL")
+        self.__db.execute(
+            "CREATE TABLE IF NOT EXISTS snapshots ("
+            "guild_id INTEGER PRIMARY KEY, seq INTEGER, state TEXT)"
+        )
+        self.__db.execute(
+            "CREATE TABLE IF NOT EXISTS log ("
+            "seq INTEGER PRIMARY KEY AUTOINCREMENT, guild_id INTEGER, op TEXT, args TEXT)"
+        )
+        self.__db.execute(
+            "CREATE TABLE IF NOT EXISTS parked ("
+            "guild_id INTEGER PRIMARY KEY, parked_at REAL, state TEXT)"
+        )
+        self.__db.execute(
+            "DELETE FROM parked WHERE parked_at < ?", (time.time() - parked_ttl,)
+        )
+        self.__db.commit()
+
+        self.__guilds = self.__load()
+        self.__logged_since: t.Dict[int, int] = {}
+        # the log entries not written yet, a commit each would block the event loop
+        self.__pending: t.List[t.Tuple[int, str, str]] = []
+        self.__task: t.Optional[asyncio.Task[None]] = None
+        self.__flush_task: t.Optional[asyncio.Task[None]] = None
+
+    def stats(self) -> t.Dict[str, int]:
+        """Return the counters of the store."""
+        return {
+            "guilds": len(self.__guilds),
+            "logged": self.logged,
+            "snapshots": self.snapshots,
+            "restored": len(self.restore_times),
+            "parked": self.parked,
+            "resumed": self.resumed,
+        }
+
+    def guilds(self) -> t.Dict[int, PersistedGuild]:
+        """Return the saved state of every guild, as it was when the process stopped."""
+        return dict(self.__guilds)
+
+    def joined(
+        self,
+        guild_id: int,
+        voice_channel_id: int,
+        text_channel_id: int,
+        locale: t.Optional[str],
+    ) -> None:
+        """Start saving the state of a new player, which has nothing queued yet."""
+        self.__guilds[guild_id] = PersistedGuild(
+            voice_channel_id, text_channel_id, locale
+        )
+        self.snapshot(guild_id)
+
+    def record(self, guild_id: int, op: str, *args: t.Any) -> None:
+        """Append a change of a player to the log, see `PersistedGuild.apply`."""
+        state = self.__guilds.get(guild_id)
+
+        if not state:
+            return
+
+        args_json = json.dumps([_dump_arg(i) for i in args])
+
+        try:
+            # applied from the JSON, so the state never shares objects with lavalink_rs
+            state.apply(op, json.loads(args_json))
+        except IndexError:
+            logging.warning(f"The saved queue of {guild_id} can't {op}, skipping it")
+            return
+
+        self.__pending.append((guild_id, op, args_json))
+        self.logged += 1
+
+        logged_since = self.__logged_since.get(guild_id, 0) + 1
+        self.__logged_since[guild_id] = logged_since
+
+        if logged_since >= self.snapshot_every:
+            self.snapshot(guild_id)
+
+    def snapshot(self, guild_id: int) -> None:
+        """Save the whole state of a guild, dropping the log it replaces."""
+        state = self.__guilds.get(guild_id)
+
+        if not state:
+            return
+
+        # the log it replaces must be on disk first
+        self.flush()
+        seq = self.__db.execute("SELECT MAX(seq) FROM log").fetchone()[0] or 0
+
+        self.__db.execute(
+            "INSERT OR REPLACE INTO snapshots VALUES (?, ?, ?)",
+            (guild_id, seq, json.dumps(dataclasses.asdict(state))),
+        )
+        self.__db.execute(
+            "DELETE FROM log WHERE guild_id = ? AND seq <= ?", (guild_id, seq)
+        )
+        self.__db.commit()
+        self.__logged_since[guild_id] = 0
+        self.snapshots += 1
+
+    def forget(self, guild_id: int) -> None:
+        """Stop saving a player that left its voice channel."""
+        self.__guilds.pop(guild_id, None)
+        self.__logged_since.pop(guild_id, None)
+        self.__pending = [i for i in self.__pending if i[0] != guild_id]
+
+        self.__db.execute("DELETE FROM snapshots WHERE guild_id = ?", (guild_id,))
+        self.__db.execute("DELETE FROM log WHERE guild_id = ?", (guild_id,))
+        self.__db.execute("DELETE FROM parked WHERE guild_id = ?", (guild_id,))
+        self.__db.commit()
+
+    def release(self, guild_id: int) -> None:
+        """Stop keeping a guild that another process owns in memory, leaving it on disk."""
+        self.__guilds.pop(guild_id, None)
+        self.__logged_since.pop(guild_id, None)
+
+    def park(self, guild_id: int, position: t.Optional[int], paused: bool) -> bool:
+        """Stop saving a player that is being disconnected, keeping its state to resume it.
+
+        `position` is the one of the playing track, `None` if nothing is playing.
+        """
+        state = self.__guilds.get(guild_id)
+
+        if not state:
+            return False
+
+        if position is None:
+            state.current = None
+            state.position = 0
+        else:
+            state.position = position
+
+        state.paused = paused
+        self.forget(guild_id)
+
+        self.__db.execute(
+            "INSERT OR REPLACE INTO parked VALUES (?, ?, ?)",
+            (guild_id, time.time(), json.dumps(dataclasses.asdict(state))),
+        )
+        self.__db.commit()
+        self.parked += 1
+
+        return True
+
+    def unpark(self, guild_id: int) -> t.Optional[PersistedGuild]:
+        """Return and drop the parked state of a guild, if it hasn't expired."""
+        row = self.__db.execute(
+            "SELECT parked_at, state FROM parked WHERE guild_id = ?", (guild_id,)
+        ).fetchone()
+
+        if not row:
+            return None
+
+        self.__db.execute("DELETE FROM parked WHERE guild_id = ?", (guild_id,))
+        self.__db.commit()
+
+        if row[0] + self.parked_ttl < time.time():
+            return None
+
+        self.resumed += 1
+
+        return PersistedGuild.load(json.loads(row[1]))
+
+    async def decode(
+        self, lavalink: LavalinkClient, guild_id: int, state: PersistedGuild
+    ) -> t.List[TrackData]:
+        """Rebuild the current track and the queue of a saved state, in that order."""
+        saved = ([state.current] if state.current else []) + state.queue
+
+        if not saved:
+            return []
+
+        # decoded all at once, without searching them again in lavalink or yt-dlp
+        tracks = await lavalink.decode_tracks(guild_id, [i["encoded"] for i in saved])
+
+        for track, i in zip(tracks, saved):
+            track.user_data = i["user_data"]
+
+        return tracks
+
+    async def resume(
+        self,
+        guild_id: int,
+        state: PersistedGuild,
+        tracks: t.List[TrackData],
+        queue: ShadowQueue,
+        session: GuildSession,
+    ) -> None:
+        """Continue playing a saved state on the player of `queue`, which must be joined."""
+        player_ctx = queue.player_ctx
+        queued = tracks
+        # track_start repeats the track that was playing, as it did before
+        session.repeat = RepeatMode(state.repeat)
+
+        if session.repeat is not RepeatMode.OFF:
+            self.record(guild_id, "repeat", state.repeat)
+
+        if state.current:
+            current, queued = tracks[0], tracks[1:]
+
+            # the states saved before the repeat modes kept the looped track at the
+            # start of the queue too
+            if (
+                session.repeat is RepeatMode.TRACK
+                and queued
+                and queued[0].encoded == current.encoded
+            ):
+                queued = queued[1:]
+
+            await player_ctx.play_now(current)
+
+            if state.position:
+                await player_ctx.set_position_ms(state.position)
+
+            if state.paused:
+                await player_ctx.set_pause(True)
+
+        # appended after the track that was playing, or lavalink_rs would start with the queue
+        if queued:
+            queue.append(queued)
+
+    def flush(self) -> None:
+        """Write the log entries recorded since the last flush, in one transaction."""
+        if not self.__pending:
+            return
+
+        entries, self.__pending = self.__pending, []
+
+        try:
+            self.__db.executemany(
+                "INSERT INTO log (guild_id, op, args) VALUES (?, ?, ?)", entries
+            )
+            self.__db.commit()
+        except sqlite3.Error:
+            # kept for the next flush, in the order they were recorded
+            self.__db.rollback()
+            self.__pending = entries + self.__pending
+            raise
+
+    def start_flushing(self, interval: float) -> None:
+        """Start writing the recorded changes every `interval` seconds in the background."""
+        if not self.__flush_task:
+            self.__flush_task = asyncio.create_task(self.__flush_loop(interval))
+
+    def start(self, interval: float, lavalink: LavalinkClient) -> None:
+        """Start saving the position of the playing tracks in the background."""
+        if not self.__task:
+            self.__task = asyncio.create_task(self.__position_loop(interval, lavalink))
+
+    def stop(self) -> None:
+        for task in (self.__task, self.__flush_task):
+            if task:
+                task.cancel()
+
+        self.__task = self.__flush_task = None
+
+    def close(self) -> None:
+        self.stop()
+        self.flush()
+        self.__db.close()
+
+    def __load(self) -> t.Dict[int, PersistedGuild]:
+        guilds = {}
+
+        for guild_id, state in self.__db.execute(
+            "SELECT guild_id, state FROM snapshots"
+        ):
+            guilds[guild_id] = PersistedGuild.load(json.loads(state))
+
+        for guild_id, op, args in self.__db.execute(
+            "SELECT guild_id, op, args FROM log ORDER BY seq"
+        ):
+            if guild_id in guilds:
+                try:
+                    guilds[guild_id].apply(op, json.loads(args))
+                except (IndexError, ValueError) as e:
+                    logging.warning(
+                        f"Skipping a bad queue log entry of {guild_id}: {e}"
+                    )
+
+        return guilds
+
+    async def save_positions(self, lavalink: LavalinkClient) -> None:
+        """Snapshot every playing guild with the current position of its track."""
+        for guild_id, state in list(self.__guilds.items()):
+            player_ctx = lavalink.get_player_context(guild_id)
+
+            if not player_ctx or not state.current:
+                continue
+
+            try:
+                player = await player_ctx.get_player()
+            except Exception as e:
+                logging.warning(f"Could not save the position in {guild_id}: {e}")
+                continue
+
+            if player.track and self.__guilds.get(guild_id) is state:
+                state.position = player.state.position
+                state.paused = player.paused
+                self.snapshot(guild_id)
+
+    async def __flush_loop(self, interval: float) -> None:
+        while True:
+            await asyncio.sleep(interval)
+
+            # another process sharing the file can keep it locked for a while
+            try:
+                self.flush()
+            except Exception as e:
+                logging.error(f"Could not save the queue changes: {e}")
+
+    async def __position_loop(self, interval: float, lavalink: LavalinkClient) -> None:
+        while True:
+            await asyncio.sleep(interval)
+
+            try:
+                await self.save_positions(lavalink)
+            except Exception as e:
+                logging.error(f"Could not save the positions of the players: {e}")
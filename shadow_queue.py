@@ -0,0 +1,291 @@
+from __future__ import annotations
+import asyncio
+import logging
+import random
+import typing as t
+
+from lavalink_rs import PlayerContext
+from lavalink_rs.model.track import TrackData
+
+
+class ShadowQueue:
+    """A copy of the queue of a player, so reading it doesn't go through lavalink_rs.
+
+    Every write is applied to the copy and sent to the real queue as the
+    smallest operation that does the same. While a track is repeated the real
+    queue is kept empty instead, see `detach`.
+    """
+
+    __slots__ = [
+        "player_ctx",
+        "version",
+        "__tracks",
+        "__detached",
+        "__repeating",
+        "__on_change",
+    ]
+
+    def __init__(
+        self,
+        player_ctx: PlayerContext,
+        on_change: t.Callable[[str, t.Tuple[t.Any, ...]], None],
+        tracks: t.Optional[t.List[TrackData]] = None,
+    ) -> None:
+        self.player_ctx = player_ctx
+        # increases with every change, to notice writes while the real queue is read
+        self.version = 0
+        self.__tracks = tracks or []
+        self.__detached = False
+        # the encoded track that is playing while detached
+        self.__repeating: t.Optional[str] = None
+        self.__on_change = on_change
+
+    def __len__(self) -> int:
+        return len(self.__tracks)
+
+    def peek(self, index: int = 0) -> t.Optional[TrackData]:
+        if 0 <= index < len(self.__tracks):
+            return self.__tracks[index]
+
+        return None
+
+    def slice(self, start: int, stop: int) -> t.List[TrackData]:
+        return self.__tracks[start:stop]
+
+    def push_to_back(self, track: TrackData) -> None:
+        self.__tracks.append(track)
+
+        if not self.__detached:
+            self.player_ctx.get_queue().push_to_back(track)
+
+        self.__changed("push_to_back", track)
+
+    def push_to_front(self, track: TrackData) -> None:
+        self.__tracks.insert(0, track)
+
+        if not self.__detached:
+            self.player_ctx.get_queue().push_to_front(track)
+
+        self.__changed("push_to_front", track)
+
+    def append(self, tracks: t.List[TrackData]) -> None:
+        self.__tracks.extend(tracks)
+
+        if not self.__detached:
+            self.player_ctx.get_queue().append(tracks)
+
+        self.__changed("append", tracks)
+
+    def remove(self, index: int) -> TrackData:
+        track = self.__tracks.pop(index)
+
+        if not self.__detached:
+            self.player_ctx.get_queue().remove(index)
+
+        self.__changed("remove", index)
+
+        return track
+
+    def clear(self) -> None:
+        self.__tracks.clear()
+
+        if not self.__detached:
+            self.player_ctx.get_queue().clear()
+
+        self.__changed("clear")
+
+    def set(self, index: int, track: TrackData) -> None:
+        """Put `track` in the place of the one at `index`."""
+        self.__tracks[index] = track
+
+        if not self.__detached:
+            self.player_ctx.get_queue().swap(index, track)
+
+        self.__changed("set", index, track)
+
+    def swap(self, index1: int, index2: int) -> None:
+        """Exchange the places of two tracks, without sending the whole queue."""
+        tracks = self.__tracks
+        tracks[index1], tracks[index2] = tracks[index2], tracks[index1]
+
+        if not self.__detached:
+            queue_ref = self.player_ctx.get_queue()
+            queue_ref.swap(index1, tracks[index1])
+            queue_ref.swap(index2, tracks[index2])
+
+        self.__changed("swap", index1, index2)
+
+    def shuffle(self) -> None:
+        # every place changes, so this is the only write that sends the whole queue
+        random.shuffle(self.__tracks)
+
+        if not self.__detached:
+            self.player_ctx.get_queue().replace(self.real())
+
+        self.__changed("replace", self.__tracks)
+
+    def detach(self, playing: TrackData) -> None:
+        """Empty the real queue, so lavalink_rs doesn't start the next track when one ends.
+
+        The copy keeps the tracks, and every write only changes the copy until
+        `attach`, while `playing` is started again when it ends.
+        """
+        self.__repeating = playing.encoded
+
+        if not self.__detached:
+            self.__detached = True
+            # a reconcile reading the real queue meanwhile must not adopt it
+            self.version += 1
+            self.player_ctx.get_queue().clear()
+
+    def attach(self) -> None:
+        """Give the real queue the tracks of the copy back, after `detach`."""
+        if self.__detached:
+            self.__detached = False
+            self.version += 1
+            self.player_ctx.get_queue().replace(self.real())
+
+    @property
+    def detached(self) -> bool:
+        return self.__detached
+
+    def track_started(self, track: TrackData) -> bool:
+        """Follow the real queue, that removes the track it starts playing from its front.
+
+        Return if the track started again while the real queue was detached.
+        """
+        if self.__detached:
+            # the real queue was empty, the copy doesn't change
+            return track.encoded == self.__repeating
+
+        if self.__tracks and self.__tracks[0].encoded == track.encoded:
+            self.__tracks.pop(0)
+            self.__changed("pop")
+
+        return False
+
+    def real(self) -> t.List[TrackData]:
+        """Return what the real queue should have."""
+        if self.__detached:
+            return []
+
+        return list(self.__tracks)
+
+    def adopt(self, tracks: t.List[TrackData]) -> None:
+        """Replace the copy with the real queue, without writing anything back."""
+        self.__detached = False
+        self.__tracks = tracks
+        self.__changed("replace", tracks)
+
+    def __changed(self, op: str, *args: t.Any) -> None:
+        self.version += 1
+        self.__on_change(op, args)
+
+
+class ShadowQueues:
+    __slots__ = [
+        "reconciled",
+        "drifted",
+        "on_change",
+        "on_write",
+        "__queues",
+        "__task",
+    ]
+
+    def __init__(self) -> None:
+        self.reconciled = 0
+        self.drifted = 0
+        self.on_change: t.Optional[t.Callable[[int], None]] = None
+        # receives every write as the name of the ShadowQueue operation and its arguments
+        self.on_write: t.Optional[t.Callable[..., None]] = None
+
+        self.__queues: t.Dict[int, ShadowQueue] = {}
+        self.__task: t.Optional[asyncio.Task[None]] = None
+
+    def stats(self) -> t.Dict[str, int]:
+        """Return the counters of the mirrors."""
+        return {
+            "guilds": len(self.__queues),
+            "tracks": sum(len(i) for i in self.__queues.values()),
+            "longest": max((len(i) for i in self.__queues.values()), default=0),
+            "reconciled": self.reconciled,
+            "drifted": self.drifted,
+        }
+
+    def get(self, guild_id: int) -> t.Optional[ShadowQueue]:
+        return self.__queues.get(guild_id)
+
+    def create(self, guild_id: int, player_ctx: PlayerContext) -> ShadowQueue:
+        """Start mirroring the queue of a new player, which is empty."""
+        queue = ShadowQueue(
+            player_ctx, lambda op, args: self.__changed(guild_id, op, args)
+        )
+        self.__queues[guild_id] = queue
+
+        return queue
+
+    def moved(self, guild_id: int, player_ctx: PlayerContext) -> None:
+        """Point the mirror of a guild to its player on another node."""
+        queue = self.__queues.get(guild_id)
+
+        if queue:
+            queue.player_ctx = player_ctx
+
+    def forget(self, guild_id: int) -> None:
+        self.__queues.pop(guild_id, None)
+
+        if self.on_change:
+            self.on_change(guild_id)
+
+    def start(self, interval: float) -> None:
+        """Start comparing the mirrors with the real queues in the background."""
+        if not self.__task:
+            self.__task = asyncio.create_task(self.__reconcile_loop(interval))
+
+    def stop(self) -> None:
+        if self.__task:
+            self.__task.cancel()
+            self.__task = None
+
+    async def reconcile(self, guild_id: int) -> bool:
+        """Make the mirror of a guild match its real queue, returning if it didn't."""
+        queue = self.__queues.get(guild_id)
+
+        if not queue:
+            return False
+
+        version = queue.version
+        real = [i.track for i in await queue.player_ctx.get_queue().get_queue()]
+        self.reconciled += 1
+
+        # the mirror was written to meanwhile, it will be checked next time
+        if queue.version != version or self.__queues.get(guild_id) is not queue:
+            return False
+
+        if [i.encoded for i in real] == [i.encoded for i in queue.real()]:
+            return False
+
+        self.drifted += 1
+        logging.warning(f"The queue mirror of {guild_id} drifted, using the real one")
+        queue.adopt(real)
+
+        return True
+
+    async def __reconcile_loop(self, interval: float) -> None:
+        while True:
+            await asyncio.sleep(interval)
+
+            for guild_id in list(self.__queues):
+                try:
+                    await self.reconcile(guild_id)
+                except Exception as e:
+                    logging.error(
+                        f"Could not check the queue mirror of {guild_id}: {e}"
+                    )
+
+    def __changed(self, guild_id: int, op: str, args: t.Tuple[t.Any, ...]) -> None:
+        if self.on_change:
+            self.on_change(guild_id)
+
+        if self.on_write:
+            self.on_write(guild_id, op, *args)
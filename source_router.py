@@ -0,0 +1,234 @@
+from __future__ import annotations
+import asyncio
+import collections
+import typing as t
+import urllib.parse
+
+from track_cache import query_type
+
+LAVALINK = "lavalink"
+YT_DLP = "yt_dlp"
+
+# sites the lavalink sources, and the LavaSrc plugin, resolve themselves
+LAVALINK_DOMAINS = {
+    "youtube.com",
+    "youtu.be",
+    "soundcloud.com",
+    "bandcamp.com",
+    "twitch.tv",
+    "vimeo.com",
+    "spotify.com",
+    "deezer.com",
+    "music.apple.com",
+}
+# files the http source of lavalink plays without extracting anything
+AUDIO_EXTENSIONS = (".mp3", ".ogg", ".opus", ".flac", ".wav", ".m4a", ".aac", ".webm")
+# how much every new outcome moves the success rate of a backend
+SCORE_WEIGHT = 0.3
+
+
+def route_key(query: str) -> str:
+    """Return what the router learns by: the domain of a URL, or the kind of query."""
+    kind = query_type(query)
+
+    if kind != "url":
+        return kind
+
+    host = (urllib.parse.urlsplit(query.strip()).hostname or "").lower()
+
+    for prefix in ("www.", "m."):
+        if host.startswith(prefix):
+            host = host[len(prefix) :]
+
+    return host
+
+
+def _lavalink_domain(host: str) -> bool:
+    return any(host == i or host.endswith(f".{i}") for i in LAVALINK_DOMAINS)
+
+
+def _yt_dlp_extractor(url: str) -> t.Optional[str]:
+    from yt_dlp.extractor import gen_extractor_classes
+
+    # the generic extractor matches every URL, and is what lavalink's http source does too
+    for extractor in gen_extractor_classes():
+        if extractor.ie_key() != "Generic" and extractor.suitable(url):
+            return extractor.ie_key()
+
+    return None
+
+
+class BackendRecord:
+    """How a backend did with the queries of a domain."""
+
+    __slots__ = ["attempts", "score", "failure_seconds"]
+
+    def __init__(self) -> None:
+        self.attempts = 0
+        # recent success rate, the newest outcomes weigh the most
+        self.score = 1.0
+        # how long it takes to fail, what routing around it saves
+        self.failure_seconds = 0.0
+
+    def record(self, ok: bool, seconds: float) -> None:
+        self.attempts += 1
+        self.score += SCORE_WEIGHT * (ok - self.score)
+
+        if not ok:
+            if self.failure_seconds:
+                self.failure_seconds += SCORE_WEIGHT * (seconds - self.failure_seconds)
+            else:
+                self.failure_seconds = seconds
+
+
+class DomainRecord:
+    __slots__ = ["prior", "routed", "backends"]
+
+    def __init__(self, prior: str) -> None:
+        # where the queries go before there are outcomes to learn from
+        self.prior = prior
+        self.routed = 0
+        self.backends = {LAVALINK: BackendRecord(), YT_DLP: BackendRecord()}
+
+
+class SourceRouter:
+    """Sends every query straight to the backend that resolves it: lavalink or yt-dlp.
+
+    URLs start with a guess from their domain: lavalink for the sites it has a
+    source for, plain audio files and searches, yt-dlp for the URLs one of its
+    extractors supports, and lavalink for the rest. Then the outcome of every
+    query is recorded per domain, and the ones where lavalink keeps failing but
+    yt-dlp doesn't skip lavalink, except for a probe every `probe_every` queries
+    in case it can resolve them again.
+    """
+
+    __slots__ = [
+        "max_domains",
+        "min_attempts",
+        "probe_every",
+        "routed",
+        "fallbacks",
+        "probes",
+        "saved_seconds",
+        "__domains",
+        "__failure_seconds",
+    ]
+
+    def __init__(
+        self, max_domains: int, min_attempts: int = 3, probe_every: int = 20
+    ) -> None:
+        self.max_domains = max_domains
+        self.min_attempts = min_attempts
+        self.probe_every = probe_every
+        self.routed = {LAVALINK: 0, YT_DLP: 0}
+        self.fallbacks = 0
+        self.probes = 0
+        # lavalink calls not made, at what they take to fail in the same domain
+        self.saved_seconds = 0.0
+
+        self.__domains: t.OrderedDict[str, DomainRecord] = collections.OrderedDict()
+        # what lavalink takes to fail in any domain, for the ones it was never tried in
+        self.__failure_seconds = 0.0
+
+    def stats(self) -> t.Dict[str, int]:
+        """Return the counters of the router."""
+        return {
+            "domains": len(self.__domains),
+            "routed_lavalink": self.routed[LAVALINK],
+            "routed_yt_dlp": self.routed[YT_DLP],
+            "fallbacks": self.fallbacks,
+            "probes": self.probes,
+            "saved_ms": int(self.saved_seconds * 1000),
+        }
+
+    def domains(self) -> t.Dict[str, t.Dict[str, t.Any]]:
+        """Return what was learned of every domain, to inspect the routing."""
+        return {
+            key: {
+                "prior": record.prior,
+                "route": self.__choose(record),
+                **{
+                    f"{name}_{stat}": getattr(backend, stat)
+                    for name, backend in record.backends.items()
+                    for stat in BackendRecord.__slots__
+                },
+            }
+            for key, record in self.__domains.items()
+        }
+
+    async def route(self, query: str) -> str:
+        """Return the backend to resolve a query with first."""
+        key = route_key(query)
+        record = self.__domains.get(key)
+
+        if record is None:
+            record = await self.__learn(key, query)
+
+        self.__domains.move_to_end(key)
+        record.routed += 1
+        backend = self.__choose(record)
+
+        if backend == YT_DLP and record.routed % self.probe_every == 0:
+            self.probes += 1
+            backend = LAVALINK
+
+        self.routed[backend] += 1
+
+        return backend
+
+    def skipped(self, query: str) -> None:
+        """Count the lavalink call a query sent to yt-dlp didn't need, once it played."""
+        record = self.__domains.get(route_key(query))
+        seconds = record.backends[LAVALINK].failure_seconds if record else 0
+
+        self.saved_seconds += seconds or self.__failure_seconds
+
+    def record(self, query: str, backend: str, outcome: str, seconds: float) -> None:
+        """Learn how a backend did with a query: `ok`, `empty` or `error`."""
+        if backend == LAVALINK and outcome != "ok":
+            self.fallbacks += 1
+            self.__failure_seconds = seconds
+
+        # a search without results says nothing of the backend, a URL without them does
+        if outcome == "empty" and query_type(query) != "url":
+            return
+
+        record = self.__domains.get(route_key(query))
+
+        if record is not None:
+            record.backends[backend].record(outcome == "ok", seconds)
+
+    def __choose(self, record: DomainRecord) -> str:
+        lavalink = record.backends[LAVALINK]
+        yt_dlp = record.backends[YT_DLP]
+
+        def failing(backend: BackendRecord) -> bool:
+            return backend.attempts >= self.min_attempts and backend.score < 0.5
+
+        if failing(yt_dlp):
+            return LAVALINK
+        elif failing(lavalink):
+            return YT_DLP
+        # resolving in lavalink is cheaper than extracting, when it works
+        elif lavalink.attempts >= self.min_attempts:
+            return LAVALINK
+
+        return record.prior
+
+    async def __learn(self, key: str, query: str) -> DomainRecord:
+        prior = LAVALINK
+
+        if query_type(query) == "url" and not (
+            _lavalink_domain(key)
+            or urllib.parse.urlsplit(query).path.lower().endswith(AUDIO_EXTENSIONS)
+        ):
+            # the first match compiles the patterns of every extractor, it takes a while
+            if await asyncio.to_thread(_yt_dlp_extractor, query):
+                prior = YT_DLP
+
+        record = self.__domains[key] = DomainRecord(prior)
+
+        while len(self.__domains) > self.max_domains:
+            self.__domains.popitem(last=False)
+
+        return record
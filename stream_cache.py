@@ -0,0 +1,252 @@
+from __future__ import annotations
+import asyncio
+import collections
+import logging
+import re
+import time
+import typing as t
+import urllib.parse
+
+from lavalink_rs import LavalinkClient
+from lavalink_rs.model.track import Track, TrackLoadType
+
+import tracing
+from format_policy import FormatPolicy
+from ytdl_pool import ExtractionPool
+
+EXPIRY_PARAMS = ("expire", "expires", "Expires", "exp")
+EXPIRY_PATH = re.compile(r"/expire/(\d+)")
+
+
+def parse_expiry(url: str) -> t.Optional[float]:
+    """Return the unix time a signed media URL stops working at, if it says so."""
+    parts = urllib.parse.urlsplit(url)
+    params = urllib.parse.parse_qs(parts.query)
+    value = None
+
+    for i in EXPIRY_PARAMS:
+        if params.get(i):
+            value = params[i][0]
+            break
+    else:
+        match = EXPIRY_PATH.search(parts.path)
+
+        if match:
+            value = match.group(1)
+
+    if not value or not value.isdigit():
+        return None
+
+    expiry = float(value)
+
+    # some CDNs sign with milliseconds instead of seconds
+    if expiry > 1e12:
+        expiry /= 1000
+
+    return expiry
+
+
+async def load_stream(
+    lavalink: LavalinkClient, guild_id: int, info: t.Dict[str, t.Any]
+) -> Track:
+    """Load the media URL of a yt-dlp extraction as a Lavalink track."""
+    with tracing.span("load_stream", guild_id=guild_id, format=info.get("format_id")):
+        # the stream cache already made `url` the format its policy chose
+        tracks = await lavalink.load_tracks(guild_id, info["url"])
+
+        if tracks.load_type != TrackLoadType.Track:  # tracks is empty
+            raise Exception("Invalid API response")
+
+        return tracks
+
+
+class StreamEntry:
+    __slots__ = ["info", "expires_at", "last_used"]
+
+    def __init__(self, info: t.Dict[str, t.Any], expires_at: float) -> None:
+        self.info = info
+        self.expires_at = expires_at
+        self.last_used = time.time()
+
+
+class StreamCache:
+    __slots__ = [
+        "max_entries",
+        "default_ttl",
+        "refresh_margin",
+        "keep_alive",
+        "hits",
+        "misses",
+        "refreshes",
+        "on_refresh",
+        "on_load",
+        "format_policy",
+        "__pool",
+        "__entries",
+        "__aliases",
+        "__task",
+    ]
+
+    def __init__(
+        self,
+        pool: ExtractionPool,
+        max_entries: int,
+        default_ttl: float,
+        refresh_margin: float,
+        keep_alive: float,
+    ) -> None:
+        self.max_entries = max_entries
+        self.default_ttl = default_ttl
+        self.refresh_margin = refresh_margin
+        self.keep_alive = keep_alive
+        self.hits = 0
+        self.misses = 0
+        self.refreshes = 0
+        self.on_refresh: t.Optional[
+            t.Callable[[str, t.Dict[str, t.Any]], t.Awaitable[None]]
+        ] = None
+        # receives the outcome and the seconds of every stream loaded in lavalink
+        self.on_load: t.Optional[t.Callable[[str, float], None]] = None
+        # chooses the format of every extraction before it's stored
+        self.format_policy: t.Optional[FormatPolicy] = None
+
+        self.__pool = pool
+        self.__entries: t.OrderedDict[str, StreamEntry] = collections.OrderedDict()
+        self.__aliases: t.OrderedDict[str, str] = collections.OrderedDict()
+        self.__task: t.Optional[asyncio.Task[None]] = None
+
+    def stats(self) -> t.Dict[str, int]:
+        """Return the counters of the cache."""
+        return {
+            "entries": len(self.__entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "refreshes": self.refreshes,
+        }
+
+    def get(self, url: str) -> t.Optional[t.Dict[str, t.Any]]:
+        """Return the extraction of a query or `original_url` while its stream URL is fresh."""
+        entry = self.__entries.get(self.__aliases.get(url, url))
+
+        if not entry or entry.expires_at - self.refresh_margin < time.time():
+            return None
+
+        entry.last_used = time.time()
+        return entry.info
+
+    async def load(
+        self, lavalink: LavalinkClient, guild_id: int, info: t.Dict[str, t.Any]
+    ) -> Track:
+        """`load_stream`, timing it for `on_load`."""
+        start = time.perf_counter()
+        outcome = "failed"
+
+        try:
+            tracks = await load_stream(lavalink, guild_id, info)
+            outcome = "track"
+        finally:
+            if self.on_load:
+                self.on_load(outcome, time.perf_counter() - start)
+
+        return tracks
+
+    def touch(self, url: str) -> None:
+        """Mark an `original_url` as still in use, so it keeps being refreshed."""
+        entry = self.__entries.get(self.__aliases.get(url, url))
+
+        if entry:
+            entry.last_used = time.time()
+
+    async def extract(self, query: str) -> t.Dict[str, t.Any]:
+        """Return a fresh extraction for a query, only calling yt-dlp on a miss."""
+        with tracing.span("stream_cache.extract"):
+            info = self.get(query)
+
+            if info:
+                self.hits += 1
+                tracing.annotate(cache="hit")
+                return info
+
+            self.misses += 1
+            tracing.annotate(cache="miss")
+            info = await self.__pool.extract(query)
+            self.put(query, info)
+
+            return info
+
+    def put(self, query: str, info: t.Dict[str, t.Any]) -> str:
+        """Store an extraction under its `original_url` and the query that produced it."""
+        key = info.get("original_url") or info.get("webpage_url") or query
+
+        if self.format_policy:
+            self.format_policy.select(info)
+
+        expires_at = parse_expiry(info.get("url") or "")
+
+        if not expires_at:
+            expires_at = time.time() + self.default_ttl
+
+        self.__entries[key] = StreamEntry(info, expires_at)
+        self.__entries.move_to_end(key)
+
+        if query != key:
+            self.__aliases[query] = key
+            self.__aliases.move_to_end(query)
+
+        while len(self.__entries) > self.max_entries:
+            self.__entries.popitem(last=False)
+
+        while len(self.__aliases) > self.max_entries:
+            self.__aliases.popitem(last=False)
+
+        return key
+
+    def start(self, interval: float) -> None:
+        """Start refreshing the entries that are about to expire in the background."""
+        if not self.__task:
+            self.__task = asyncio.create_task(self.__refresh_loop(interval))
+
+    def stop(self) -> None:
+        if self.__task:
+            self.__task.cancel()
+            self.__task = None
+
+    async def refresh(self, key: str) -> t.Optional[t.Dict[str, t.Any]]:
+        """Extract an `original_url` again, replacing its cached stream URL."""
+        try:
+            info = await self.__pool.extract(key)
+        except Exception as e:
+            logging.warning(f"Could not refresh the stream URL of {key}: {e}")
+            self.__entries.pop(key, None)
+            return None
+
+        last_used = self.__entries[key].last_used if key in self.__entries else 0
+        self.__entries[self.put(key, info)].last_used = last_used
+        self.refreshes += 1
+
+        if self.on_refresh:
+            try:
+                await self.on_refresh(key, info)
+            except Exception as e:
+                logging.error(f"Error updating the refreshed stream {key}: {e}")
+
+        return info
+
+    async def __refresh_loop(self, interval: float) -> None:
+        while True:
+            await asyncio.sleep(interval)
+
+            now = time.time()
+            stale = [
+                (k, v)
+                for k, v in self.__entries.items()
+                if v.expires_at - self.refresh_margin - interval < now
+            ]
+
+            for key, entry in stale:
+                # nothing will play what nobody used in a while, so drop it instead
+                if entry.last_used + self.keep_alive < now:
+                    self.__entries.pop(key, None)
+                    continue
+
+                await self.refresh(key)
@@ -0,0 +1,262 @@
+from __future__ import annotations
+import asyncio
+import contextlib
+import contextvars
+import json
+import logging
+import random
+import time
+import typing as t
+
+import aiohttp
+
+_current: contextvars.ContextVar[t.Optional[Span]] = contextvars.ContextVar(
+    "span", default=None
+)
+
+
+class Span:
+    """A timed operation of a trace, exported in the Zipkin v2 JSON format."""
+
+    __slots__ = [
+        "tracer",
+        "trace_id",
+        "id",
+        "parent_id",
+        "name",
+        "tags",
+        "timestamp",
+        "duration",
+        "__start",
+    ]
+
+    def __init__(
+        self,
+        tracer: Tracer,
+        name: str,
+        parent: t.Optional[Span],
+        tags: t.Dict[str, t.Any],
+    ) -> None:
+        self.tracer = tracer
+        self.trace_id = parent.trace_id if parent else f"{random.getrandbits(128):032x}"
+        self.id = f"{random.getrandbits(64):016x}"
+        self.parent_id = parent.id if parent else None
+        self.name = name
+        self.tags = {k: str(v) for k, v in tags.items() if v is not None}
+        # microseconds since the epoch, like Zipkin expects
+        self.timestamp = int(time.time() * 1_000_000)
+        self.duration = 0
+        self.__start = time.perf_counter()
+
+    def set(self, key: str, value: t.Any) -> None:
+        if value is not None:
+            self.tags[key] = str(value)
+
+    def finish(self) -> None:
+        self.duration = max(1, int((time.perf_counter() - self.__start) * 1_000_000))
+        self.tracer.finished(self)
+
+    def to_zipkin(self) -> t.Dict[str, t.Any]:
+        data: t.Dict[str, t.Any] = {
+            "traceId": self.trace_id,
+            "id": self.id,
+            "name": self.name,
+            "timestamp": self.timestamp,
+            "duration": self.duration,
+            "localEndpoint": {"serviceName": self.tracer.service},
+            "tags": self.tags,
+        }
+
+        if self.parent_id:
+            data["parentId"] = self.parent_id
+
+        return data
+
+
+@contextlib.contextmanager
+def _activate(span: Span) -> t.Iterator[Span]:
+    token = _current.set(span)
+
+    try:
+        yield span
+    except BaseException as e:
+        # a cancelled command is not an error of the operation, but it's worth seeing
+        span.set("error", str(e) or type(e).__name__)
+        raise
+    finally:
+        _current.reset(token)
+        span.finish()
+
+
+@contextlib.contextmanager
+def span(name: str, **tags: t.Any) -> t.Iterator[t.Optional[Span]]:
+    """Time an operation as a child of the current span, if the current trace is sampled.
+
+    Outside of a sampled trace this does nothing, so it's cheap to use anywhere.
+    """
+    parent = _current.get()
+
+    if parent is None:
+        yield None
+        return
+
+    with _activate(Span(parent.tracer, name, parent, tags)) as child:
+        yield child
+
+
+def annotate(**tags: t.Any) -> None:
+    """Add tags to the current span, if there is one."""
+    current = _current.get()
+
+    if current is not None:
+        for k, v in tags.items():
+            current.set(k, v)
+
+
+class FileExporter:
+    """Appends the spans to a file, one Zipkin v2 JSON object per line."""
+
+    __slots__ = ["path"]
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+
+    async def export(self, spans: t.List[t.Dict[str, t.Any]]) -> None:
+        lines = "".join(json.dumps(i, separators=(",", ":")) + "\n" for i in spans)
+        await asyncio.to_thread(self.__write, lines)
+
+    async def close(self) -> None:
+        pass
+
+    def __write(self, lines: str) -> None:
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(lines)
+
+
+class ZipkinExporter:
+    """Sends the spans to the `/api/v2/spans` endpoint of a Zipkin compatible collector."""
+
+    __slots__ = ["url", "__session"]
+
+    def __init__(self, url: str) -> None:
+        self.url = url
+        self.__session: t.Optional[aiohttp.ClientSession] = None
+
+    async def export(self, spans: t.List[t.Dict[str, t.Any]]) -> None:
+        if not self.__session:
+            self.__session = aiohttp.ClientSession(
+                timeout=aiohttp.ClientTimeout(total=10)
+            )
+
+        async with self.__session.post(self.url, json=spans) as response:
+            if response.status >= 300:
+                raise Exception(f"{response.status} {await response.text()}")
+
+    async def close(self) -> None:
+        if self.__session:
+            await self.__session.close()
+            self.__session = None
+
+
+class Tracer:
+    """Starts the sampled traces and exports their finished spans in batches."""
+
+    __slots__ = [
+        "service",
+        "sample_rate",
+        "max_pending",
+        "traces",
+        "sampled",
+        "exported",
+        "dropped",
+        "__exporter",
+        "__pending",
+        "__task",
+    ]
+
+    def __init__(
+        self,
+        service: str,
+        sample_rate: float,
+        exporter: t.Optional[t.Union[FileExporter, ZipkinExporter]],
+        max_pending: int = 10_000,
+    ) -> None:
+        self.service = service
+        self.sample_rate = sample_rate
+        self.max_pending = max_pending
+        self.traces = 0
+        self.sampled = 0
+        self.exported = 0
+        self.dropped = 0
+
+        self.__exporter = exporter
+        self.__pending: t.List[t.Dict[str, t.Any]] = []
+        self.__task: t.Optional[asyncio.Task[None]] = None
+
+    def stats(self) -> t.Dict[str, int]:
+        """Return the counters of the tracer."""
+        return {
+            "traces": self.traces,
+            "sampled": self.sampled,
+            "pending": len(self.__pending),
+            "exported": self.exported,
+            "dropped": self.dropped,
+        }
+
+    @contextlib.contextmanager
+    def trace(self, name: str, **tags: t.Any) -> t.Iterator[t.Optional[Span]]:
+        """Start a trace, or a child span if there is one already, when sampled."""
+        parent = _current.get()
+
+        if parent is None:
+            self.traces += 1
+
+            if not self.__exporter or random.random() >= self.sample_rate:
+                yield None
+                return
+
+            self.sampled += 1
+
+        with _activate(Span(self, name, parent, tags)) as root:
+            yield root
+
+    def finished(self, span: Span) -> None:
+        if len(self.__pending) >= self.max_pending:
+            self.dropped += 1
+            return
+
+        self.__pending.append(span.to_zipkin())
+
+    def start(self, interval: float) -> None:
+        """Start exporting the finished spans in the background."""
+        if self.__exporter and not self.__task:
+            self.__task = asyncio.create_task(self.__export_loop(interval))
+
+    async def stop(self) -> None:
+        if self.__task:
+            self.__task.cancel()
+            self.__task = None
+
+        await self.flush()
+
+        if self.__exporter:
+            await self.__exporter.close()
+
+    async def flush(self) -> None:
+        """Export the spans finished since the last flush."""
+        if not self.__exporter or not self.__pending:
+            return
+
+        spans, self.__pending = self.__pending, []
+
+        try:
+            await self.__exporter.export(spans)
+            self.exported += len(spans)
+        except Exception as e:
+            self.dropped += len(spans)
+            logging.warning(f"Could not export {len(spans)} spans: {e}")
+
+    async def __export_loop(self, interval: float) -> None:
+        while True:
+            await asyncio.sleep(interval)
+            await self.flush()
@@ -0,0 +1,466 @@
+from __future__ import annotations
+import asyncio
+import collections
+import dataclasses
+import json
+import logging
+import sqlite3
+import time
+import typing as t
+import unicodedata
+import urllib.parse
+
+from lavalink_rs import LavalinkClient
+from lavalink_rs.model.track import Track, TrackData, TrackLoadType
+
+import tracing
+
+# URL parameters that never change what a link resolves to
+IGNORED_URL_PARAMS = {"si", "feature", "pp", "ab_channel", "fbclid", "gclid"}
+
+
+def normalize_query(query: str) -> str:
+    """Return the cache key for a query passed to `LavalinkClient.load_tracks`."""
+    query = query.strip()
+
+    if query.lower().startswith(("http://", "https://")):
+        return _canonicalize_url(query)
+
+    prefix, sep, text = query.partition(":")
+
+    if not sep:
+        prefix, text = "", query
+
+    text = unicodedata.normalize("NFKC", text).casefold()
+    text = " ".join(text.split())
+
+    return f"{prefix}{sep}{text}"
+
+
+def query_type(query: str) -> str:
+    """Return what kind of query this is: `url`, the search prefix or `identifier`."""
+    if query.lower().startswith(("http://", "https://")):
+        return "url"
+
+    prefix, sep, _ = query.partition(":")
+
+    return prefix.lower() if sep and prefix.lower().endswith("search") else "identifier"
+
+
+def _canonicalize_url(url: str) -> str:
+    parts = urllib.parse.urlsplit(url)
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or "").lower()
+    path = parts.path or "/"
+
+    if parts.port and not (
+        (scheme == "http" and parts.port == 80)
+        or (scheme == "https" and parts.port == 443)
+    ):
+        host = f"{host}:{parts.port}"
+
+    query = [
+        (k, v)
+        for k, v in urllib.parse.parse_qsl(parts.query, keep_blank_values=True)
+        if k not in IGNORED_URL_PARAMS and not k.startswith("utm_")
+    ]
+
+    if host in ("youtu.be", "www.youtu.be") and len(path) > 1:
+        query.append(("v", path[1:]))
+        host, path = "www.youtube.com", "/watch"
+    elif host in ("youtube.com", "m.youtube.com"):
+        host = "www.youtube.com"
+    elif host == "spotify.com":
+        host = "open.spotify.com"
+
+    if len(path) > 1:
+        path = path.rstrip("/")
+
+    return urllib.parse.urlunsplit(
+        (
+            "https" if scheme == "http" else scheme,
+            host,
+            path,
+            urllib.parse.urlencode(sorted(query)),
+            "",
+        )
+    )
+
+
+@dataclasses.dataclass
+class CachedPlaylistInfo:
+    name: str
+    selected_track: t.Optional[int]
+
+
+@dataclasses.dataclass
+class CachedPlaylistData:
+    info: CachedPlaylistInfo
+    tracks: t.List[TrackData]
+    plugin_info: t.Any = None
+
+
+@dataclasses.dataclass
+class CachedTrack:
+    """A `Track` rebuilt from the cache, with the same interface."""
+
+    load_type: TrackLoadType
+    data: t.Union[TrackData, t.List[TrackData], CachedPlaylistData]
+
+
+class CacheEntry:
+    __slots__ = ["expires_at", "load_type", "payload", "tracks"]
+
+    def __init__(
+        self, expires_at: float, load_type: str, payload: t.Dict[str, t.Any]
+    ) -> None:
+        self.expires_at = expires_at
+        self.load_type = load_type
+        self.payload = payload
+        # the next hit takes them, and new ones are decoded in the background,
+        # because the commands set the requester in the `user_data` of the tracks
+        # they queue and `TrackData` can't be copied
+        self.tracks: t.Optional[CachedTrack] = None
+
+
+class TrackCache:
+    __slots__ = [
+        "max_entries",
+        "ttl",
+        "hits",
+        "misses",
+        "disk_hits",
+        "evictions",
+        "on_load",
+        "__entries",
+        "__db",
+        "__pending",
+        "__task",
+        "__refills",
+    ]
+
+    def __init__(
+        self, max_entries: int, ttl: float, path: t.Optional[str] = None
+    ) -> None:
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.disk_hits = 0
+        self.evictions = 0
+        # receives the load type and the seconds of every query sent to lavalink
+        self.on_load: t.Optional[t.Callable[[str, float], None]] = None
+
+        self.__entries: t.OrderedDict[str, CacheEntry] = collections.OrderedDict()
+        self.__db: t.Optional[sqlite3.Connection] = None
+        # the rows not written to disk yet, `None` for the ones to delete
+        self.__pending: t.Dict[str, t.Optional[t.Tuple[str, str, float]]] = {}
+        self.__task: t.Optional[asyncio.Task[None]] = None
+        self.__refills: t.Dict[str, asyncio.Task[None]] = {}
+
+        if path:
+            self.__db = sqlite3.connect(path)
+            self.__db.execute("PRAGMA journal_mode=WAL")
+            self.__db.execute(
+                "CREATE TABLE IF NOT EXISTS tracks ("
+                "key TEXT PRIMARY KEY, load_type TEXT, payload TEXT, expires_at REAL)"
+            )
+            self.__db.execute("DELETE FROM tracks WHERE expires_at < ?", (time.time(),))
+            self.__db.commit()
+
+    def __len__(self) -> int:
+        return len(self.__entries)
+
+    def stats(self) -> t.Dict[str, int]:
+        """Return the hit/miss counters of the cache."""
+        return {
+            "entries": len(self.__entries),
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+    def get(self, key: str) -> t.Optional[CacheEntry]:
+        """Return the entry of a normalized query, if it has not expired."""
+        entry = self.__entries.get(key)
+
+        if not entry:
+            return None
+
+        if entry.expires_at < time.monotonic():
+            del self.__entries[key]
+            return None
+
+        self.__entries.move_to_end(key)
+        return entry
+
+    def put(self, key: str, tracks: t.Union[Track, CachedTrack]) -> None:
+        """Store a load result, evicting the least recently used entries."""
+        load_type = _load_type_name(tracks.load_type)
+
+        if not load_type:
+            return
+
+        payload = _dump(tracks)
+        self.__remember(key, load_type, payload, time.monotonic() + self.ttl)
+
+        if self.__db:
+            self.__pending[key] = (
+                load_type,
+                json.dumps(payload),
+                time.time() + self.ttl,
+            )
+
+    def invalidate(self, key: str) -> None:
+        """Forget a normalized query, both in memory and on disk."""
+        self.__entries.pop(key, None)
+
+        if self.__db:
+            self.__pending[key] = None
+
+    def flush(self) -> None:
+        """Write the entries stored and invalidated since the last flush, in one transaction."""
+        if not self.__db or not self.__pending:
+            return
+
+        pending, self.__pending = self.__pending, {}
+
+        try:
+            self.__db.executemany(
+                "INSERT OR REPLACE INTO tracks VALUES (?, ?, ?, ?)",
+                [(k, *v) for k, v in pending.items() if v],
+            )
+            self.__db.executemany(
+                "DELETE FROM tracks WHERE key = ?",
+                [(k,) for k, v in pending.items() if not v],
+            )
+            self.__db.commit()
+        except sqlite3.Error:
+            # kept for the next flush, under the changes made since
+            self.__db.rollback()
+            self.__pending = {**pending, **self.__pending}
+            raise
+
+    def start(self, interval: float) -> None:
+        """Start writing the new entries to disk every `interval` seconds in the background."""
+        if self.__db and not self.__task:
+            self.__task = asyncio.create_task(self.__flush_loop(interval))
+
+    def stop(self) -> None:
+        if self.__task:
+            self.__task.cancel()
+            self.__task = None
+
+    async def load_tracks(
+        self,
+        lavalink: LavalinkClient,
+        guild_id: int,
+        query: str,
+    ) -> t.Union[Track, CachedTrack]:
+        """`LavalinkClient.load_tracks`, answering repeated queries without a REST call.
+
+        Only the first hit after a miss, and a burst of hits faster than the
+        decoding in the background, wait for Lavalink to decode the tracks.
+        """
+        with tracing.span(
+            "load_tracks", guild_id=guild_id, query_type=query_type(query)
+        ):
+            return await self.__load_tracks(lavalink, guild_id, query)
+
+    def close(self) -> None:
+        self.stop()
+        self.flush()
+
+        for task in self.__refills.values():
+            task.cancel()
+
+        if self.__db:
+            self.__db.close()
+            self.__db = None
+
+    async def __load_tracks(
+        self,
+        lavalink: LavalinkClient,
+        guild_id: int,
+        query: str,
+    ) -> t.Union[Track, CachedTrack]:
+        key = normalize_query(query)
+        entry = self.get(key)
+
+        if entry:
+            cached, entry.tracks = entry.tracks, None
+
+            if not cached:
+                cached = await self.__decode(
+                    lavalink, guild_id, key, entry.load_type, entry.payload
+                )
+
+            if cached:
+                self.hits += 1
+                tracing.annotate(cache="memory")
+                self.__refill(lavalink, guild_id, key)
+                return cached
+
+        cached = await self.__load_from_disk(lavalink, guild_id, key)
+
+        if cached:
+            self.disk_hits += 1
+            tracing.annotate(cache="disk")
+            self.__refill(lavalink, guild_id, key)
+            return cached
+
+        self.misses += 1
+        tracing.annotate(cache="miss")
+        start = time.perf_counter()
+
+        try:
+            tracks = await lavalink.load_tracks(guild_id, query)
+        except Exception:
+            self.__loaded("failed", start)
+            raise
+
+        self.__loaded(
+            _load_type_name(tracks.load_type)
+            or ("error" if tracks.load_type == TrackLoadType.Error else "empty"),
+            start,
+        )
+        self.put(key, tracks)
+
+        return tracks
+
+    def __loaded(self, load_type: str, start: float) -> None:
+        tracing.annotate(load_type=load_type)
+
+        if self.on_load:
+            self.on_load(load_type, time.perf_counter() - start)
+
+    def __remember(
+        self,
+        key: str,
+        load_type: str,
+        payload: t.Dict[str, t.Any],
+        expires_at: float,
+    ) -> None:
+        self.__entries[key] = CacheEntry(expires_at, load_type, payload)
+        self.__entries.move_to_end(key)
+
+        while len(self.__entries) > self.max_entries:
+            self.__entries.popitem(last=False)
+            self.evictions += 1
+
+    async def __load_from_disk(
+        self, lavalink: LavalinkClient, guild_id: int, key: str
+    ) -> t.Optional[CachedTrack]:
+        if not self.__db:
+            return None
+
+        if key in self.__pending:
+            row = self.__pending[key]
+        else:
+            row = self.__db.execute(
+                "SELECT load_type, payload, expires_at FROM tracks WHERE key = ?",
+                (key,),
+            ).fetchone()
+
+        if not row or row[2] < time.time():
+            return None
+
+        load_type, payload = row[0], json.loads(row[1])
+        tracks = await self.__decode(lavalink, guild_id, key, load_type, payload)
+
+        if tracks:
+            self.__remember(
+                key, load_type, payload, time.monotonic() + row[2] - time.time()
+            )
+
+        return tracks
+
+    async def __decode(
+        self,
+        lavalink: LavalinkClient,
+        guild_id: int,
+        key: str,
+        load_type: str,
+        payload: t.Dict[str, t.Any],
+    ) -> t.Optional[CachedTrack]:
+        # decode_tracks only decodes what was already resolved, it never searches
+        try:
+            decoded = await lavalink.decode_tracks(guild_id, payload["encoded"])
+        except Exception as e:
+            logging.warning(f"Could not decode cached tracks for {key}: {e}")
+            return None
+
+        if load_type == "track":
+            tracks = CachedTrack(TrackLoadType.Track, decoded[0])
+        elif load_type == "search":
+            tracks = CachedTrack(TrackLoadType.Search, decoded)
+        else:
+            tracks = CachedTrack(
+                TrackLoadType.Playlist,
+                CachedPlaylistData(
+                    CachedPlaylistInfo(payload["name"], payload["selected_track"]),
+                    decoded,
+                ),
+            )
+
+        return tracks
+
+    def __refill(self, lavalink: LavalinkClient, guild_id: int, key: str) -> None:
+        if key not in self.__refills:
+            task = asyncio.create_task(self.__decode_next(lavalink, guild_id, key))
+            task.add_done_callback(lambda _: self.__refills.pop(key, None))
+            self.__refills[key] = task
+
+    async def __decode_next(
+        self, lavalink: LavalinkClient, guild_id: int, key: str
+    ) -> None:
+        entry = self.__entries.get(key)
+
+        if not entry or entry.tracks:
+            return
+
+        tracks = await self.__decode(
+            lavalink, guild_id, key, entry.load_type, entry.payload
+        )
+
+        # the entry may have been replaced or evicted meanwhile
+        if self.__entries.get(key) is entry:
+            entry.tracks = tracks
+
+    async def __flush_loop(self, interval: float) -> None:
+        while True:
+            await asyncio.sleep(interval)
+
+            # another process sharing the file can keep it locked for a while
+            try:
+                self.flush()
+            except Exception as e:
+                logging.error(f"Could not save the track cache: {e}")
+
+
+def _load_type_name(load_type: TrackLoadType) -> t.Optional[str]:
+    # TrackLoadType is not hashable, so it can't be used as a dict key
+    if load_type == TrackLoadType.Track:
+        return "track"
+    elif load_type == TrackLoadType.Search:
+        return "search"
+    elif load_type == TrackLoadType.Playlist:
+        return "playlist"
+
+    return None
+
+
+def _dump(tracks: t.Union[Track, CachedTrack]) -> t.Dict[str, t.Any]:
+    data = tracks.data
+
+    if tracks.load_type == TrackLoadType.Track:
+        return {"encoded": [data.encoded]}  # type: ignore
+    elif tracks.load_type == TrackLoadType.Search:
+        return {"encoded": [i.encoded for i in data]}  # type: ignore
+
+    return {
+        "encoded": [i.encoded for i in data.tracks],  # type: ignore
+        "name": data.info.name,  # type: ignore
+        "selected_track": data.info.selected_track,  # type: ignore
+    }
@@ -0,0 +1,244 @@
+from __future__ import annotations
+import asyncio
+import collections
+import heapq
+import logging
+import sqlite3
+import time
+import typing as t
+import unicodedata
+
+
+def normalize_text(text: str) -> str:
+    """Return the text lowercased, without accents and with single spaces."""
+    text = unicodedata.normalize("NFKD", text.casefold())
+    text = "".join(i for i in text if not unicodedata.combining(i))
+
+    return " ".join("".join(i if i.isalnum() else " " for i in text).split())
+
+
+def trigrams(text: str) -> t.Set[str]:
+    """Return the trigrams of a normalized text, with a space before every word."""
+    text = f" {text}"
+    return {text[i : i + 3] for i in range(len(text) - 2)}
+
+
+class IndexedTrack:
+    __slots__ = ["title", "author", "uri", "plays", "played", "text"]
+
+    def __init__(self, title: str, author: str, uri: str, plays: int) -> None:
+        self.title = title
+        self.author = author
+        self.uri = uri
+        self.plays = plays
+        # the order in which the tracks were last played, higher is more recent
+        self.played = 0
+        self.text = normalize_text(f"{author} {title}")
+
+    @property
+    def name(self) -> str:
+        return f"{self.author} - {self.title}"
+
+
+class TrackIndex:
+    """A bounded trigram index of the tracks that were played, to autocomplete queries.
+
+    Only the `max_entries` most recently played tracks are kept. With a `path`,
+    they are also saved in a SQLite database to survive restarts.
+    """
+
+    __slots__ = [
+        "max_entries",
+        "searches",
+        "evictions",
+        "__tracks",
+        "__postings",
+        "__played",
+        "__db",
+        "__pending",
+        "__task",
+    ]
+
+    def __init__(self, max_entries: int, path: t.Optional[str] = None) -> None:
+        self.max_entries = max_entries
+        self.searches = 0
+        self.evictions = 0
+
+        # the most recently played last
+        self.__tracks: t.OrderedDict[str, IndexedTrack] = collections.OrderedDict()
+        self.__postings: t.Dict[str, t.Set[str]] = {}
+        self.__played = 0
+        self.__db: t.Optional[sqlite3.Connection] = None
+        # the rows not written to disk yet, `None` for the evicted ones
+        self.__pending: t.Dict[str, t.Optional[t.Tuple[str, str, int, float]]] = {}
+        self.__task: t.Optional[asyncio.Task[None]] = None
+
+        if path:
+            self.__db = sqlite3.connect(path)
+            self.__db.execute("PRAGMA journal_mode=WAL")
+            self.__db.execute(
+                "CREATE TABLE IF NOT EXISTS tracks ("
+                "uri TEXT PRIMARY KEY, title TEXT, author TEXT, plays INTEGER, "
+                "played_at REAL)"
+            )
+            self.__db.commit()
+
+            rows = self.__db.execute(
+                "SELECT uri, title, author, plays FROM tracks "
+                "ORDER BY played_at DESC LIMIT ?",
+                (max_entries,),
+            ).fetchall()
+
+            for uri, title, author, plays in reversed(rows):
+                self.__insert(IndexedTrack(title, author, uri, plays))
+
+            self.__db.execute(
+                "DELETE FROM tracks WHERE uri NOT IN "
+                "(SELECT uri FROM tracks ORDER BY played_at DESC LIMIT ?)",
+                (max_entries,),
+            )
+            self.__db.commit()
+
+    def __len__(self) -> int:
+        return len(self.__tracks)
+
+    def stats(self) -> t.Dict[str, int]:
+        """Return the counters of the index."""
+        return {
+            "tracks": len(self.__tracks),
+            "trigrams": len(self.__postings),
+            "searches": self.searches,
+            "evictions": self.evictions,
+        }
+
+    def add(self, title: str, author: str, uri: t.Optional[str]) -> None:
+        """Index a track that was played, or make it the most recent one if it was already."""
+        if not uri:
+            return
+
+        track = self.__tracks.get(uri)
+
+        if track and track.title == title and track.author == author:
+            track.plays += 1
+            self.__played += 1
+            track.played = self.__played
+            self.__tracks.move_to_end(uri)
+        else:
+            if track:
+                self.__remove(uri)
+
+            track = IndexedTrack(title, author, uri, track.plays + 1 if track else 1)
+            self.__insert(track)
+
+        if self.__db:
+            self.__pending[uri] = (title, author, track.plays, time.time())
+
+        while len(self.__tracks) > self.max_entries:
+            evicted = self.__remove(next(iter(self.__tracks))).uri
+            self.evictions += 1
+
+            if self.__db:
+                self.__pending[evicted] = None
+
+    def search(self, text: str, limit: int = 25) -> t.List[IndexedTrack]:
+        """Return the tracks that best match a partial query, without any network call.
+
+        Tracks sharing more trigrams with the query come first, and then the most
+        played and most recent ones.
+        """
+        self.searches += 1
+        query = normalize_text(text)
+
+        if not query:
+            return list(reversed(self.__tracks.values()))[:limit]
+
+        grams = trigrams(query)
+        candidates: t.Dict[str, int]
+
+        if not grams:
+            # one letter, every word starting with it matches
+            candidates = {
+                k: 1 for k, v in self.__tracks.items() if f" {query}" in f" {v.text}"
+            }
+        else:
+            candidates = collections.Counter()
+
+            for gram in grams:
+                candidates.update(self.__postings.get(gram, ()))
+
+        # at least half of the trigrams must match, to allow for a typo or two
+        minimum = max(1, len(grams) // 2)
+
+        return heapq.nsmallest(
+            limit,
+            (self.__tracks[k] for k, v in candidates.items() if v >= minimum),
+            key=lambda i: (-candidates[i.uri], -i.plays, -i.played),
+        )
+
+    def flush(self) -> None:
+        """Write the tracks played and evicted since the last flush, in one transaction."""
+        if not self.__db or not self.__pending:
+            return
+
+        pending, self.__pending = self.__pending, {}
+
+        try:
+            self.__db.executemany(
+                "INSERT OR REPLACE INTO tracks VALUES (?, ?, ?, ?, ?)",
+                [(k, *v) for k, v in pending.items() if v],
+            )
+            self.__db.executemany(
+                "DELETE FROM tracks WHERE uri = ?",
+                [(k,) for k, v in pending.items() if not v],
+            )
+            self.__db.commit()
+        except sqlite3.Error as e:
+            # kept for the next flush, under the tracks played since
+            self.__db.rollback()
+            self.__pending = {**pending, **self.__pending}
+            logging.warning(f"Could not save {len(pending)} tracks in the index: {e}")
+
+    def start(self, interval: float) -> None:
+        """Start writing the played tracks to disk every `interval` seconds in the background."""
+        if self.__db and not self.__task:
+            self.__task = asyncio.create_task(self.__flush_loop(interval))
+
+    def stop(self) -> None:
+        if self.__task:
+            self.__task.cancel()
+            self.__task = None
+
+    def close(self) -> None:
+        self.stop()
+        self.flush()
+
+        if self.__db:
+            self.__db.close()
+            self.__db = None
+
+    def __insert(self, track: IndexedTrack) -> None:
+        self.__played += 1
+        track.played = self.__played
+        self.__tracks[track.uri] = track
+
+        for gram in trigrams(track.text):
+            self.__postings.setdefault(gram, set()).add(track.uri)
+
+    def __remove(self, uri: str) -> IndexedTrack:
+        track = self.__tracks.pop(uri)
+
+        for gram in trigrams(track.text):
+            posting = self.__postings.get(gram)
+
+            if posting is not None:
+                posting.discard(uri)
+
+                if not posting:
+                    del self.__postings[gram]
+
+        return track
+
+    async def __flush_loop(self, interval: float) -> None:
+        while True:
+            await asyncio.sleep(interval)
+            self.flush()
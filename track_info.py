@@ -0,0 +1,91 @@
+from __future__ import annotations
+import collections
+import typing as t
+
+import lightbulb
+from lavalink_rs.model.track import TrackData
+
+from localization import Localizer
+
+
+def track_fields(track: TrackData) -> t.Tuple[str, str, t.Optional[str], t.Any]:
+    """Return the author, title, uri and requester of a track as they are shown.
+
+    The tracks found with yt-dlp keep the real title, author and uri in their
+    `user_data`, because lavalink only knows their stream URL.
+    """
+    return _fields(track, track.user_data or {})
+
+
+def _fields(
+    track: TrackData, user_data: t.Dict[str, t.Any]
+) -> t.Tuple[str, str, t.Optional[str], t.Any]:
+    if user_data.get("title"):
+        author, title, uri = user_data["author"], user_data["title"], user_data["uri"]
+    else:
+        author, title, uri = track.info.author, track.info.title, track.info.uri
+
+    return author, title, uri, user_data.get("requester_id")
+
+
+class TrackInfoRenderer:
+    """Renders the `generic.track_info_*` text of tracks, once per track and locale."""
+
+    __slots__ = ["max_entries", "hits", "misses", "__localizer", "__rendered"]
+
+    def __init__(self, localizer: Localizer, max_entries: int) -> None:
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+
+        self.__localizer = localizer
+        self.__rendered: t.OrderedDict[t.Tuple[str, str, t.Any], str] = (
+            collections.OrderedDict()
+        )
+
+    def stats(self) -> t.Dict[str, int]:
+        """Return the counters of the cache."""
+        return {
+            "entries": len(self.__rendered),
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+    def render(
+        self,
+        locale: t.Union[str, lightbulb.Context, None],
+        track: TrackData,
+    ) -> str:
+        """Return the text of a track in a locale, or the one of the user of a command."""
+        view = self.__localizer.for_locale(locale or "")
+        user_data = track.user_data or {}
+        # the same track can be queued by different users
+        key = (view.locale, track.encoded, user_data.get("requester_id"))
+        text = self.__rendered.get(key)
+
+        if text is not None:
+            self.hits += 1
+            self.__rendered.move_to_end(key)
+            return text
+
+        self.misses += 1
+        author, title, uri, requester_id = _fields(track, user_data)
+        # both texts take the same arguments, the one without url just skips it
+        text = view.format(
+            "generic.track_info_url" if uri else "generic.track_info_no_url",
+            author,
+            title,
+            uri,
+            requester_id,
+        )
+
+        self.__rendered[key] = text
+
+        while len(self.__rendered) > self.max_entries:
+            self.__rendered.popitem(last=False)
+
+        return text
+
+    def clear(self) -> None:
+        """Forget every rendered text, after the localization files changed."""
+        self.__rendered.clear()
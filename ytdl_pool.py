@@ -0,0 +1,216 @@
+from __future__ import annotations
+import asyncio
+import concurrent.futures
+import functools
+import logging
+import threading
+import time
+import typing as t
+
+import yt_dlp
+
+import tracing
+
+_worker = threading.local()
+
+
+class ExtractionQueueFull(Exception):
+    pass
+
+
+class ExtractionTimeout(Exception):
+    pass
+
+
+class ExtractionEmpty(Exception):
+    pass
+
+
+class ExtractionFailed(Exception):
+    """A `DownloadError` of yt-dlp, without the traceback that can't leave a worker process."""
+
+    def __init__(self, message: str, unsupported: bool) -> None:
+        # both in args, so the exception is rebuilt the same when unpickled
+        super().__init__(message, unsupported)
+        self.unsupported = unsupported
+
+    def __str__(self) -> str:
+        return self.args[0]
+
+
+def _init_worker(options: t.Dict[str, t.Any]) -> None:
+    # every worker (thread or process) gets its own YoutubeDL instance,
+    # they are not safe to share between concurrent extractions
+    _worker.ytdl = yt_dlp.YoutubeDL(options)
+
+
+def _extract(query: str) -> t.Dict[str, t.Any]:
+    ytdl: yt_dlp.YoutubeDL = _worker.ytdl
+
+    try:
+        info = ytdl.extract_info(query, download=False)
+    except yt_dlp.utils.DownloadError as e:
+        # no extractor supports the URL, instead of the video being unavailable
+        unsupported = bool(e.exc_info) and isinstance(
+            e.exc_info[1], yt_dlp.utils.UnsupportedError
+        )
+        raise ExtractionFailed(str(e), unsupported) from None
+
+    # a search that found nothing is a playlist without entries
+    if info and info.get("_type") == "playlist" and not info.get("entries"):
+        raise ExtractionEmpty(query)
+
+    # the sanitized dict is plain data, so it can cross a process boundary
+    return ytdl.sanitize_info(info)  # type: ignore
+
+
+class ExtractionPool:
+    __slots__ = [
+        "timeout",
+        "max_pending",
+        "extractions",
+        "coalesced",
+        "failures",
+        "timeouts",
+        "rejected",
+        "on_extracted",
+        "__executor",
+        "__inflight",
+        "__waiters",
+        "__pending",
+    ]
+
+    def __init__(
+        self,
+        options: t.Dict[str, t.Any],
+        workers: int,
+        queue_size: int,
+        timeout: float,
+        use_processes: bool = False,
+    ) -> None:
+        self.timeout = timeout
+        self.max_pending = workers + queue_size
+        self.extractions = 0
+        self.coalesced = 0
+        self.failures = 0
+        self.timeouts = 0
+        self.rejected = 0
+        # receives the outcome ("ok", "failed" or "timeout") and the seconds of every extraction
+        self.on_extracted: t.Optional[t.Callable[[str, float], None]] = None
+
+        executor_type: t.Type[concurrent.futures.Executor]
+
+        if use_processes:
+            executor_type = concurrent.futures.ProcessPoolExecutor
+        else:
+            executor_type = concurrent.futures.ThreadPoolExecutor
+
+        self.__executor = executor_type(
+            workers, initializer=_init_worker, initargs=(options,)
+        )
+        self.__inflight: t.Dict[str, asyncio.Future[t.Dict[str, t.Any]]] = {}
+        self.__waiters: t.Dict[str, int] = {}
+        self.__pending = 0
+
+    @property
+    def pending(self) -> int:
+        """Return the amount of extractions running or waiting for a worker."""
+        return self.__pending
+
+    def stats(self) -> t.Dict[str, int]:
+        """Return the counters of the pool."""
+        return {
+            "pending": self.__pending,
+            "extractions": self.extractions,
+            "coalesced": self.coalesced,
+            "failures": self.failures,
+            "timeouts": self.timeouts,
+            "rejected": self.rejected,
+        }
+
+    async def extract(self, query: str) -> t.Dict[str, t.Any]:
+        """Extract the info of a query, sharing the result with identical in-flight queries."""
+        future = self.__inflight.get(query)
+        coalesced = future is not None
+
+        if future:
+            self.coalesced += 1
+        else:
+            if self.__pending >= self.max_pending:
+                self.rejected += 1
+                raise ExtractionQueueFull(
+                    f"{self.__pending} extractions are already pending"
+                )
+
+            # the slot is taken now, so the calls of the same tick see it, and only
+            # freed when the worker is done, even if nobody waits for it anymore
+            self.__pending += 1
+            work = self.__executor.submit(_extract, query)
+            work.add_done_callback(
+                functools.partial(self.__release, asyncio.get_running_loop())
+            )
+
+            future = asyncio.ensure_future(self.__run(query, work))
+            self.__inflight[query] = future
+            future.add_done_callback(lambda _: self.__inflight.pop(query, None))
+
+        self.__waiters[query] = self.__waiters.get(query, 0) + 1
+
+        try:
+            with tracing.span("ytdl.extract", coalesced=coalesced):
+                return await asyncio.shield(future)
+        except asyncio.CancelledError:
+            # only cancel the extraction once nobody is waiting for it anymore
+            if self.__waiters.get(query) == 1:
+                future.cancel()
+            raise
+        finally:
+            self.__waiters[query] -= 1
+
+            if not self.__waiters[query]:
+                del self.__waiters[query]
+
+    def close(self) -> None:
+        self.__executor.shutdown(wait=False, cancel_futures=True)
+
+    async def __run(
+        self, query: str, work: concurrent.futures.Future[t.Dict[str, t.Any]]
+    ) -> t.Dict[str, t.Any]:
+        self.extractions += 1
+        start = time.perf_counter()
+
+        try:
+            # cancels the extraction if it hasn't started, a running one can't be stopped
+            info = await asyncio.wait_for(asyncio.wrap_future(work), self.timeout)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            self.__extracted("timeout", start)
+            logging.warning(f"yt-dlp extraction timed out after {self.timeout}s")
+            raise ExtractionTimeout(query) from None
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            self.failures += 1
+            self.__extracted("failed", start)
+            raise
+
+        self.__extracted("ok", start)
+
+        return info
+
+    def __release(
+        self, loop: asyncio.AbstractEventLoop, work: concurrent.futures.Future[t.Any]
+    ) -> None:
+        # runs in the worker thread, or wherever the future was cancelled
+        try:
+            loop.call_soon_threadsafe(self.__free)
+        except RuntimeError:
+            # the loop is already closed, there's nothing left to count for
+            pass
+
+    def __free(self) -> None:
+        self.__pending -= 1
+
+    def __extracted(self, outcome: str, start: float) -> None:
+        if self.on_extracted:
+            self.on_extracted(outcome, time.perf_counter() - start)